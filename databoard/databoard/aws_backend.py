@@ -216,8 +216,10 @@ def train_loop(event_name='pollenating_insects_3_JNI_2017',
                 score_submission(submission)
                 # update leaderboard
                 logging.info('Updating the leaderboard...')
-                update_leaderboards(submission.event.name)
-                update_all_user_leaderboards(submission.event.name)
+                event_team_ids = update_leaderboards(
+                    submission.event.name, [submission.id])
+                update_all_user_leaderboards(
+                    submission.event.name, event_team_ids)
                 compute_contributivity(event_name)
                 compute_historical_contributivity(event_name)
                 logging.info('Successfully finished training and testing the submission "{}"'.format(submission))
@@ -1,10 +1,12 @@
 import datetime
+import hashlib
 import imp
 import logging
 import os
 import shutil
 import time
 import timeit
+from collections import namedtuple
 
 import numpy as np
 import pandas as pd
@@ -12,19 +14,37 @@ import pandas as pd
 # import torch  # noqa
 from sklearn.externals.joblib import Parallel, delayed
 from sklearn.utils.validation import assert_all_finite
+from sqlalchemy import LargeBinary
+from sqlalchemy import type_coerce
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import undefer_group
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.orm.exc import NoResultFound
 
 from rampdb.model import (CVFold, DetachedSubmissionOnCVFold,
                           DuplicateSubmissionError, Event, EventAdmin,
-                          EventScoreType, EventTeam, Extension, Keyword,
+                          EventEnsemble, EventScoreType, EventTeam,
+                          Extension, Keyword, LeaderboardRow,
                           MissingExtensionError, MissingSubmissionFileError,
                           NameClashError, Problem, ProblemKeyword, Submission,
                           SubmissionFile, SubmissionFileType,
                           SubmissionFileTypeExtension, SubmissionOnCVFold,
+                          SubmissionScore,
                           SubmissionSimilarity, Team, TooEarlySubmissionError,
                           User, UserInteraction, Workflow, WorkflowElement,
                           WorkflowElementType)
+from rampdb.tools.database import remove_unreferenced_arrays
+from rampdb.tools.ensemble import EnsembleSearch
+from rampdb.tools.ensemble import get_warm_start_index_list
+from rampdb.tools.ensemble import prune_candidates
+from rampdb.tools.ensemble import select_ensemble
+from rampdb.tools.leaderboard import get_competition_leaderboard_rows
+from rampdb.tools.leaderboard import get_event_score_types
+from rampdb.tools.leaderboard import update_leaderboard_rows
+from rampdb.tools.scoring import bulk_score_submissions
+from rampdb.tools.tools import iter_bagged_predictions
+from rampdb.tools.tools import propagate_historical_contributivity
+from rampdb.utils import clear_module_cache
 
 from . import app
 from . import db
@@ -170,17 +190,10 @@ def _get_score_cv_bags(event, score_type, predictions_list, ground_truths,
     -------
     score_cv_bags : instance of Score ()
     """
-    if test_is_list is None:  # we combine the full list
-        test_is_list = [range(len(predictions.y_pred))
-                        for predictions in predictions_list]
-
-    y_comb = np.array(
-        [event.Predictions(n_samples=len(ground_truths.y_pred))
-         for _ in predictions_list])
     score_cv_bags = []
-    for i, test_is in enumerate(test_is_list):
-        y_comb[i].set_valid_in_train(predictions_list[i], test_is)
-        combined_predictions = combine_predictions_list(y_comb[:i + 1])
+    for combined_predictions in iter_bagged_predictions(
+            event.Predictions, predictions_list, len(ground_truths.y_pred),
+            test_is_list):
         valid_indexes = combined_predictions.valid_indexes
         score_cv_bags.append(score_type.score_function(
             ground_truths, combined_predictions, valid_indexes))
@@ -196,13 +209,8 @@ def get_next_best_single_fold(event, predictions_list, ground_truths,
     predictions_list[best_index_list] using event.official_score_function.
     If there is no model improving the input
     combination, the input best_index_list is returned. Otherwise the best
-    model is added to the list. We could also return the combined prediction
-    (for efficiency, so the combination would not have to be done each time;
-    right now the algo is quadratic), but I don't think any meaningful
-    rule will be associative, in which case we should redo the combination from
-    scratch each time the set changes. Since now combination = mean, we could
-    maintain the sum and the number of models, but it would be a bit bulky.
-    We'll see how this evolves.
+    model is added to the list. Use `EnsembleSearch` to run several steps
+    without recomputing the current combination each time.
 
     Parameters
     ----------
@@ -220,33 +228,25 @@ def get_next_best_single_fold(event, predictions_list, ground_truths,
         Indices of the models in the new combination. If the same as input,
         no models wer found improving the score.
     """
-    best_predictions = combine_predictions_list(
-        predictions_list, index_list=best_index_list)
-    best_score = event.official_score_function(
-        ground_truths, best_predictions)
-    best_index = -1
-    # Combination with replacement, what Caruana suggests. Basically, if a
-    # model is added several times, it's upweighted, leading to
-    # integer-weighted ensembles
-    r = np.arange(len(predictions_list))
-    # Randomization doesn't matter, only in case of exact equality.
-    # np.random.shuffle(r)
-    # print r
-    for i in r:
-        combined_predictions = combine_predictions_list(
-            predictions_list, index_list=np.append(best_index_list, i))
-        new_score = event.official_score_function(
-            ground_truths, combined_predictions)
-        is_lower_the_better = event.official_score_type.is_lower_the_better
-        if (is_lower_the_better and new_score < best_score) or\
-                (not is_lower_the_better and new_score > best_score):
-            best_predictions = combined_predictions
-            best_index = i
-            best_score = new_score
-    if best_index > -1:
-        return np.append(best_index_list, best_index), best_score
-    else:
-        return best_index_list, best_score
+    score_type = event.official_score_type
+    search = EnsembleSearch(
+        predictions_list, ground_truths, event.official_score_function,
+        score_type.is_lower_the_better, score_type.score_type_object)
+    return search.next_best(best_index_list)
+
+
+def _load_predictions(submissions_on_cv_fold):
+    """Load the deferred predictions of submissions on folds in one query.
+
+    The predictions of the instances already in the session are populated
+    in place, instead of being fetched one instance at a time on access.
+    """
+    ids = [submission_on_cv_fold.id
+           for submission_on_cv_fold in submissions_on_cv_fold]
+    if ids:
+        SubmissionOnCVFold.query.filter(SubmissionOnCVFold.id.in_(ids))\
+            .options(undefer_group('predictions')).all()
+    return submissions_on_cv_fold
 
 
 def compute_valid_score_cv_bag(submission):
@@ -257,14 +257,25 @@ def compute_valid_score_cv_bag(submission):
     """
     ground_truths_train = submission.event.problem.ground_truths_train()
     if submission.state == 'tested':
+        _load_predictions(submission.on_cv_folds)
         predictions_list = [submission_on_cv_fold.valid_predictions for
                             submission_on_cv_fold in submission.on_cv_folds]
         test_is_list = [submission_on_cv_fold.cv_fold.test_is for
                         submission_on_cv_fold in submission.on_cv_folds]
-        for score in submission.scores:
-            _, score.valid_score_cv_bags = _get_score_cv_bags(
-                submission.event, score.event_score_type, predictions_list,
-                ground_truths_train, test_is_list)
+        # the folds are combined once for all the scores
+        valid_score_cv_bags = [[] for _ in submission.scores]
+        for combined_predictions in iter_bagged_predictions(
+                submission.event.Predictions, predictions_list,
+                len(ground_truths_train.y_pred), test_is_list):
+            valid_indexes = combined_predictions.valid_indexes
+            for score, score_cv_bags in zip(submission.scores,
+                                            valid_score_cv_bags):
+                score_cv_bags.append(score.event_score_type.score_function(
+                    ground_truths_train, combined_predictions,
+                    valid_indexes))
+        for score, score_cv_bags in zip(submission.scores,
+                                        valid_score_cv_bags):
+            score.valid_score_cv_bags = score_cv_bags
             score.valid_score_cv_bag = float(score.valid_score_cv_bags[-1])
     else:
         for score in submission.scores:
@@ -289,16 +300,19 @@ def compute_test_score_cv_bag(submission):
         # When we have submission id in Predictions, we should get the
         # team and submission from the db
         ground_truths = submission.event.problem.ground_truths_test()
+        _load_predictions(submission.on_cv_folds)
         predictions_list = [submission_on_cv_fold.test_predictions for
                             submission_on_cv_fold in submission.on_cv_folds]
-        combined_predictions_list = [
-            combine_predictions_list(predictions_list[:i + 1]) for
-            i in range(len(predictions_list))]
-        for score in submission.scores:
-            score.test_score_cv_bags = [
-                score.score_function(
-                    ground_truths, combined_predictions) for
-                combined_predictions in combined_predictions_list]
+        test_score_cv_bags = [[] for _ in submission.scores]
+        for combined_predictions in iter_bagged_predictions(
+                submission.event.Predictions, predictions_list):
+            for score, score_cv_bags in zip(submission.scores,
+                                            test_score_cv_bags):
+                score_cv_bags.append(score.score_function(
+                    ground_truths, combined_predictions))
+        for score, score_cv_bags in zip(submission.scores,
+                                        test_score_cv_bags):
+            score.test_score_cv_bags = score_cv_bags
             score.test_score_cv_bag = float(score.test_score_cv_bags[-1])
     else:
         for score in submission.scores:
@@ -495,6 +509,9 @@ def add_problem(problem_name, force=False):
                              'all linked events. Use"force=True" if you want '
                              'to overwrite the problem and delete the events.')
         delete_problem(problem_name)
+        # the kit and the data may have been updated
+        clear_module_cache()
+        Problem.clear_ground_truth_cache()
 
     # load the module to get the type of workflow used for the problem
     problem_module = import_module_from_source(
@@ -998,7 +1015,7 @@ def make_submission(event_name, team_name, submission_name, submission_path):
     event_team.last_submission_name = submission_name
     db.session.commit()
 
-    update_leaderboards(event_name)
+    update_leaderboards(event_name, [submission.id])
     update_user_leaderboards(event_name, team.name)
 
     # We should copy files here
@@ -1223,8 +1240,11 @@ def backend_train_test_loop(event_name=None, timeout=20,
             train_test_submission(earliest_new_submission)
             score_submission(earliest_new_submission)
             event_names.add(earliest_new_submission.event.name)
-            update_leaderboards(earliest_new_submission.event.name)
-            update_all_user_leaderboards(earliest_new_submission.event.name)
+            event_team_ids = update_leaderboards(
+                earliest_new_submission.event.name,
+                [earliest_new_submission.id])
+            update_all_user_leaderboards(
+                earliest_new_submission.event.name, event_team_ids)
         else:
             # We only compute contributivity if nobody is waiting
             if is_compute_contributivity:
@@ -1236,6 +1256,108 @@ def backend_train_test_loop(event_name=None, timeout=20,
         time.sleep(timeout)
 
 
+def get_ensembled_submissions_states(event_name=None):
+    """Summarize the submissions entering the ensemble of each event.
+
+    The summary of an event changes when one of its submissions is scored,
+    retrained, rescored, deleted or excluded from the ensemble.
+
+    Parameters
+    ----------
+    event_name : string or None
+        If set, only this event is summarized. If prefixed by not_, all the
+        other events are summarized.
+
+    Returns
+    -------
+    states : dict
+        event name -> hash of the ids, training timestamps and valid scores
+        of the submissions
+    """
+    query = db.session.query(
+        Event.name, Submission.id, Submission.training_timestamp,
+        SubmissionScore.id, SubmissionScore.valid_score_cv_bag).select_from(
+        Submission).join(EventTeam).join(Event).outerjoin(
+        SubmissionScore).filter(
+        Submission.state == 'scored').filter(
+        Submission.is_not_sandbox).filter(
+        Submission.is_valid).filter(
+        Submission.is_to_ensemble)
+    if event_name is not None:
+        if event_name[:4] == 'not_':
+            query = query.filter(Event.name != event_name[4:])
+        else:
+            query = query.filter(Event.name == event_name)
+    hashes = {}
+    for row in query.order_by(Event.name, Submission.id, SubmissionScore.id):
+        hashes.setdefault(row[0], hashlib.sha1()).update(
+            repr(tuple(row[1:])).encode('utf-8'))
+    states = {name: sha1.hexdigest() for name, sha1 in hashes.items()}
+    # do not keep a transaction open between two polls
+    db.session.commit()
+    return states
+
+
+def backend_contributivity_loop(event_name=None, timeout=30,
+                                min_interval=5 * 60, quiet_period=60,
+                                max_delay=30 * 60):
+    """Automated contributivity loop.
+
+    Meant to run in its own process, next to backend_train_test_loop with
+    is_compute_contributivity=False, so that computing the contributivity
+    never delays the training. The submissions scored in a burst are
+    coalesced into a single computation per event.
+
+    Parameters
+    ----------
+    event_name : string or None
+        If set, only this event is watched. If prefixed by not, it excludes
+        that event.
+    timeout : int
+        Seconds between two polls of the database.
+    min_interval : int
+        Minimum number of seconds between two computations for an event.
+    quiet_period : int
+        An event is updated once none of its submissions changed for this
+        number of seconds.
+    max_delay : int
+        An event is updated at the latest this number of seconds after its
+        first pending change, even if its submissions keep changing.
+    """
+    states = {}
+    # event name -> time of the first and of the last pending changes
+    pending = {}
+    last_runs = {}
+    while(True):
+        now = time.time()
+        for name, state in get_ensembled_submissions_states(
+                event_name).items():
+            if states.get(name) != state:
+                states[name] = state
+                first_change, _ = pending.get(name, (now, now))
+                pending[name] = (first_change, now)
+        for name, (first_change, last_change) in list(pending.items()):
+            if now - last_runs.get(name, -float('inf')) < min_interval:
+                continue
+            if (now - last_change < quiet_period and
+                    now - first_change < max_delay):
+                continue
+            del pending[name]
+            last_runs[name] = now
+            logger.info('Computing contributivity of {} at {}'.format(
+                name, datetime.datetime.utcnow()))
+            try:
+                compute_contributivity(name)
+                compute_historical_contributivity(name)
+                set_n_submissions(name)
+            except Exception:
+                # the other events are still updated
+                logger.exception(
+                    'Computing contributivity of {} failed'.format(name))
+                db.session.rollback()
+        time.sleep(timeout)
+
+
 def train_test_submissions(submissions=None, force_retrain_test=False,
                            is_parallelize=None):
     """Train and test submission.
@@ -1249,7 +1371,12 @@ def train_test_submissions(submissions=None, force_retrain_test=False,
             Submission.is_not_sandbox).order_by(Submission.id).all()
     for submission in submissions:
         train_test_submission(submission, force_retrain_test)
-        score_submission(submission)
+    submission_ids = {}
+    for submission in submissions:
+        submission_ids.setdefault(submission.event.name, []).append(
+            submission.id)
+    for event_name, event_submission_ids in submission_ids.items():
+        score_submissions(event_name, event_submission_ids)
 
 
 # For parallel call
@@ -1313,46 +1440,53 @@ def train_test_submission(submission, force_retrain_test=False):
 
 
 def score_submission(submission):
+    score_submissions(submission.event.name, [submission.id])
+
+
+def score_submissions(event_name, submission_ids=None, n_jobs=None):
+    """Score submissions of an event at once.
+
+    The ground truths and the score functions are loaded once for all the
+    submissions, and the scores are stored in a single commit.
+
+    Parameters
+    ----------
+    event_name : string
+    submission_ids : list of integers or None
+        The submissions to score. All the tested submissions of the event if
+        None.
+    n_jobs : int or None
+        Number of processes scoring the submissions, the current process if
+        None.
+    """
+    event = Event.query.filter_by(name=event_name).one()
+    if submission_ids is None:
+        submissions = [submission for submission
+                       in get_submissions(event_name=event_name)
+                       if submission.state == 'tested']
+    else:
+        submissions = Submission.query.filter(
+            Submission.id.in_(submission_ids)).order_by(Submission.id).all()
     # We are conservative: only score if all stages (train, test, validation)
     # were completed. submission_on_cv_fold compute scores can be called
     # manually if needed for submission in various error states.
-    if submission.state == 'tested':
-        logger.info('Scoring  {}'.format(submission))
-        for submission_on_cv_fold in submission.on_cv_folds:
-            submission_on_cv_fold.compute_train_scores()
-            submission_on_cv_fold.compute_valid_scores()
-            submission_on_cv_fold.compute_test_scores()
-            submission_on_cv_fold.state = 'scored'
-        db.session.commit()
-        compute_test_score_cv_bag(submission)
-        compute_valid_score_cv_bag(submission)
-        # Means and stds were constructed on demand by fetching fold times.
-        # It was slow because submission_on_folds contain also possibly large
-        # predictions. If postgres solves this issue (which can be tested on
-        # the mean and std scores on the private leaderbord), the
-        # corresponding columns (which are now redundant) can be deleted in
-        # Submission and this computation can also be deleted.
-        submission.train_time_cv_mean = np.mean(
-            [ts.train_time for ts in submission.on_cv_folds])
-        submission.valid_time_cv_mean = np.mean(
-            [ts.valid_time for ts in submission.on_cv_folds])
-        submission.test_time_cv_mean = np.mean(
-            [ts.test_time for ts in submission.on_cv_folds])
-        submission.train_time_cv_std = np.std(
-            [ts.train_time for ts in submission.on_cv_folds])
-        submission.valid_time_cv_std = np.std(
-            [ts.valid_time for ts in submission.on_cv_folds])
-        submission.test_time_cv_std = np.std(
-            [ts.test_time for ts in submission.on_cv_folds])
-        db.session.commit()
+    tested_submissions = [submission for submission in submissions
+                          if submission.state == 'tested']
+    logger.info('Scoring {} submissions of {}'.format(
+        len(tested_submissions), event_name))
+    # The means and stds of the fold times are stored with the scores: they
+    # were constructed on demand by fetching fold times, which was slow
+    # because submission_on_folds contain also possibly large predictions.
+    bulk_score_submissions(db.session, event, tested_submissions, n_jobs)
+    db.session.commit()
+    for submission in tested_submissions:
         for score in submission.scores:
-            logger.info('valid_score {} = {}'.format(
-                score.score_name, score.valid_score_cv_bag))
-            logger.info('test_score {} = {}'.format(
-                score.score_name, score.test_score_cv_bag))
-        submission.state = 'scored'
-        db.session.commit()
-    send_trained_mails(submission)
+            logger.info('{} valid_score {} = {}'.format(
+                submission, score.score_name, score.valid_score_cv_bag))
+            logger.info('{} test_score {} = {}'.format(
+                submission, score.score_name, score.test_score_cv_bag))
+    for submission in submissions:
+        send_trained_mails(submission)
 
 
 def _make_error_message(e):
@@ -1505,23 +1639,33 @@ def test_submission_on_cv_fold(detached_submission_on_cv_fold, X, y,
 
 def compute_contributivity(event_name, start_time_stamp=None,
                            end_time_stamp=None, force_ensemble=False,
-                           is_save_y_pred=False):
+                           is_save_y_pred=False, full_recompute=False):
     compute_contributivity_no_commit(
         event_name, start_time_stamp, end_time_stamp, force_ensemble,
-        is_save_y_pred)
+        is_save_y_pred, full_recompute)
     db.session.commit()
+    delete_old_event_ensembles(event_name)
 
 
 def compute_contributivity_no_commit(
         event_name, start_time_stamp=None, end_time_stamp=None,
-        force_ensemble=False, is_save_y_pred=False):
+        force_ensemble=False, is_save_y_pred=False, full_recompute=False):
     """Compute contributivity leaderboard scores.
 
+    The ensemble selected on each fold is stored on the fold. The next
+    computation resumes the greedy selection from it, so that scoring a new
+    submission only costs the few steps it takes to add it, unless a
+    selected submission was deleted or excluded in between, or the ensemble
+    scores worse than when it was stored.
+
     Parameters
     ----------
     event_name : string
     force_ensemble : boolean
         To force include deleted models.
+    full_recompute : boolean
+        To restart the greedy selection from the best single submission
+        instead of resuming from the stored ensembles.
     """
     logger.info('Combining models')
     # The following should go into config, we'll get there when we have a
@@ -1548,19 +1692,117 @@ def compute_contributivity_no_commit(
     combined_test_predictions_list = []
     best_test_predictions_list = []
     test_is_list = []
-    for cv_fold in CVFold.query.filter_by(event=event).all():
-        logger.info('{}'.format(cv_fold))
-        ground_truths_valid = event.problem.ground_truths_valid(
-            cv_fold.test_is)
-        combined_predictions, best_predictions,\
-            combined_test_predictions, best_test_predictions =\
-            _compute_contributivity_on_fold(
-                cv_fold, ground_truths_valid,
-                start_time_stamp, end_time_stamp, force_ensemble)
+    cv_folds = CVFold.query.filter_by(event=event).all()
+    selected_submissions_on_folds = []
+    for cv_fold in cv_folds:
+        selected_submissions_on_fold = _select_submissions_on_fold(
+            cv_fold, start_time_stamp, end_time_stamp, force_ensemble)
         # TODO: if we do asynchron CVs, this has to be revisited
-        if combined_predictions is None:
+        if len(selected_submissions_on_fold) == 0:
             logger.info('No submissions to combine')
             return
+        selected_submissions_on_folds.append(selected_submissions_on_fold)
+
+    # The folds are independent: the greedy selections run in parallel
+    # processes, which only get arrays (memory-mapped by joblib) and names.
+    score_type = event.official_score_type
+    # the stored ensembles are only valid for the default selection of the
+    # submissions
+    is_default_selection = (start_time_stamp is None and
+                            end_time_stamp is None and not force_ensemble)
+    is_warm_start = not full_recompute and is_default_selection
+    start_index_lists = []
+    restart_index_lists = []
+    ensemble_scores = []
+    y_preds_list = []
+    for i, selected_submissions_on_fold in\
+            enumerate(selected_submissions_on_folds):
+        cv_fold = cv_folds[i]
+        best_index = _get_best_index_list(
+            selected_submissions_on_fold, score_type.is_lower_the_better)[0]
+        best_index_list = None
+        if is_warm_start:
+            best_index_list = get_warm_start_index_list(
+                cv_fold.ensemble_ids,
+                [submission_on_fold.id
+                 for submission_on_fold in selected_submissions_on_fold],
+                event.max_n_ensemble)
+        # the selection restarts from the best submission if the stored
+        # ensemble scores worse than when it was selected
+        restart_index_list = np.array([best_index])
+        ensemble_score = None
+        if best_index_list is None:
+            best_index_list = restart_index_list
+        else:
+            ensemble_score = cv_fold.ensemble_score
+        y_preds = np.array(
+            [submission_on_fold.valid_predictions.y_pred
+             for submission_on_fold in selected_submissions_on_fold])
+        # most submissions of large events have no chance to enter the
+        # ensemble: only the best ones, without duplicates, are candidates
+        if (event.max_n_ensemble_candidates is not None or
+                event.ensemble_duplicate_tolerance is not None):
+            candidate_indices = prune_candidates(
+                y_preds,
+                [submission_on_fold.official_score.valid_score
+                 for submission_on_fold in selected_submissions_on_fold],
+                score_type.is_lower_the_better,
+                event.max_n_ensemble_candidates,
+                event.ensemble_duplicate_tolerance,
+                keep=np.append(best_index_list, best_index))
+            logger.info('{} candidates out of {} submissions'.format(
+                len(candidate_indices), len(selected_submissions_on_fold)))
+            selected_submissions_on_folds[i] = [
+                selected_submissions_on_fold[j] for j in candidate_indices]
+            y_preds = y_preds[candidate_indices]
+            best_index_list = np.searchsorted(
+                candidate_indices, best_index_list)
+            restart_index_list = np.searchsorted(
+                candidate_indices, restart_index_list)
+        start_index_lists.append(best_index_list)
+        restart_index_lists.append(restart_index_list)
+        ensemble_scores.append(ensemble_score)
+        y_preds_list.append(y_preds)
+    y_train = event.problem.get_targets('train')
+    n_jobs = event.n_jobs if app.config.get('RAMP_PARALLELIZE') else 1
+    # the folds run n_jobs at a time, each getting its share of the event
+    # budget from when it starts
+    max_time = None
+    if event.max_ensemble_time is not None:
+        n_rounds = -(-len(cv_folds) // max(n_jobs, 1))
+        max_time = event.max_ensemble_time / n_rounds
+    selections = Parallel(n_jobs=n_jobs)(
+        delayed(select_ensemble)(
+            event.problem.module_path, score_type.name, y_preds,
+            y_train[cv_fold.test_is], best_index_list, event.max_n_ensemble,
+            max_time, ensemble_score, restart_index_list)
+        for cv_fold, y_preds, best_index_list, ensemble_score,
+        restart_index_list
+        in zip(cv_folds, y_preds_list, start_index_lists, ensemble_scores,
+               restart_index_lists))
+    del y_preds_list
+
+    fold_ensemble_ids = []
+    for cv_fold, selected_submissions_on_fold,\
+            (best_index_list, score, steps) in\
+            zip(cv_folds, selected_submissions_on_folds, selections):
+        logger.info('{}'.format(cv_fold))
+        for index_list, step_score in steps:
+            logger.info('\t{}: {}'.format(index_list, step_score))
+        fold_ensemble_ids.append(
+            [selected_submissions_on_fold[i].submission_id
+             for i in best_index_list])
+        # a full recomputation replaces the stored ensemble
+        if is_default_selection:
+            cv_fold.ensemble_ids = np.array(
+                [selected_submissions_on_fold[i].id for i in best_index_list])
+            cv_fold.ensemble_score = float(score)
+        combined_predictions, best_predictions,\
+            combined_test_predictions, best_test_predictions =\
+            _set_contributivity_on_fold(
+                selected_submissions_on_fold, best_index_list,
+                _get_best_index_list(selected_submissions_on_fold,
+                                     score_type.is_lower_the_better)[0])
         combined_predictions_list.append(combined_predictions)
         best_predictions_list.append(best_predictions)
         combined_test_predictions_list.append(combined_test_predictions)
@@ -1568,6 +1810,9 @@ def compute_contributivity_no_commit(
         test_is_list.append(cv_fold.test_is)
     for submission in submissions:
         set_contributivity(submission, is_commit=False)
+    # the combined predictions of the event, stored in a new EventEnsemble
+    y_preds = dict.fromkeys(['combined_valid_y_pred', 'foldwise_valid_y_pred',
+                             'combined_test_y_pred', 'foldwise_test_y_pred'])
     # if there are no predictions to combine, it crashed
     combined_predictions_list = [c for c in combined_predictions_list
                                  if c is not None]
@@ -1575,6 +1820,7 @@ def compute_contributivity_no_commit(
         combined_predictions, scores = _get_score_cv_bags(
             event, event.official_score_type, combined_predictions_list,
             ground_truths_train, test_is_list=test_is_list)
+        y_preds['combined_valid_y_pred'] = combined_predictions.y_pred
         if is_save_y_pred:
             np.savetxt(
                 'y_train_pred.csv', combined_predictions.y_pred, delimiter=',')
@@ -1586,9 +1832,10 @@ def compute_contributivity_no_commit(
     best_predictions_list = [c for c in best_predictions_list
                              if c is not None]
     if len(best_predictions_list) > 0:
-        _, scores = _get_score_cv_bags(
+        foldwise_predictions, scores = _get_score_cv_bags(
             event, event.official_score_type, best_predictions_list,
             ground_truths_train, test_is_list=test_is_list)
+        y_preds['foldwise_valid_y_pred'] = foldwise_predictions.y_pred
         logger.info('Combined foldwise best valid score = {}'.format(scores))
         event.combined_foldwise_valid_score = float(scores[-1])
     else:
@@ -1600,6 +1847,7 @@ def compute_contributivity_no_commit(
         combined_predictions, scores = _get_score_cv_bags(
             event, event.official_score_type, combined_test_predictions_list,
             ground_truths_test)
+        y_preds['combined_test_y_pred'] = combined_predictions.y_pred
         if is_save_y_pred:
             np.savetxt(
                 'y_test_pred.csv', combined_predictions.y_pred, delimiter=',')
@@ -1611,29 +1859,97 @@ def compute_contributivity_no_commit(
     best_test_predictions_list = [c for c in best_test_predictions_list
                                   if c is not None]
     if len(best_test_predictions_list) > 0:
-        _, scores = _get_score_cv_bags(
+        foldwise_predictions, scores = _get_score_cv_bags(
             event, event.official_score_type, best_test_predictions_list,
             ground_truths_test)
+        y_preds['foldwise_test_y_pred'] = foldwise_predictions.y_pred
         logger.info('Combined foldwise best valid score = {}'.format(scores))
         event.combined_foldwise_test_score = float(scores[-1])
     else:
         event.combined_foldwise_test_score = None
 
+    _add_event_ensemble(event, cv_folds, fold_ensemble_ids, y_preds)
+
     return event.combined_combined_valid_score,\
         event.combined_foldwise_valid_score,\
         event.combined_combined_test_score,\
         event.combined_foldwise_test_score
 
 
-def _compute_contributivity_on_fold(cv_fold, ground_truths_valid,
-                                    start_time_stamp=None, end_time_stamp=None,
-                                    force_ensemble=False, min_improvement=0.0):
-    """Construct the best model combination on a single fold.
+def _add_event_ensemble(event, cv_folds, fold_ensemble_ids, y_preds):
+    """Store a new version of the ensemble predictions of the event.
 
-    Using greedy forward selection with replacement. See
-    http://www.cs.cornell.edu/~caruana/ctp/ct.papers/
-    caruana.icml04.icdm06long.pdf.
-    Then sets foldwise contributivity.
+    Parameters
+    ----------
+    fold_ensemble_ids : list of lists of integers
+        Ids of the submissions of the ensemble of each fold of cv_folds.
+    y_preds : dict
+        The combined and foldwise valid and test predictions, keyed by
+        column name of EventEnsemble.
+    """
+    last_version = db.session.query(db.func.max(EventEnsemble.version))\
+        .filter(EventEnsemble.event_id == event.id).scalar()
+    event_ensemble = EventEnsemble(
+        event=event, version=(last_version or 0) + 1,
+        cv_fold_ids=np.array([cv_fold.id for cv_fold in cv_folds]),
+        ensemble_sizes=np.array(
+            [len(ensemble_ids) for ensemble_ids in fold_ensemble_ids]),
+        ensemble_submission_ids=np.concatenate(
+            [np.asarray(ensemble_ids, dtype=np.int64)
+             for ensemble_ids in fold_ensemble_ids]),
+        **y_preds)
+    db.session.add(event_ensemble)
+    logger.info('Stored {}'.format(event_ensemble))
+    return event_ensemble
+
+
+def delete_old_event_ensembles(event_name, n_versions=None):
+    """Delete the ensemble predictions of an event but the last versions.
+
+    The predictions of the deleted versions are also removed from the
+    prediction store, unless other rows hold the same arrays.
+
+    Parameters
+    ----------
+    event_name : string
+    n_versions : int or None, default is None
+        Number of versions kept. RAMP_N_EVENT_ENSEMBLE_VERSIONS if None.
+
+    Returns
+    -------
+    n_deleted : int
+        Number of deleted versions.
+    """
+    if n_versions is None:
+        n_versions = app.config.get('RAMP_N_EVENT_ENSEMBLE_VERSIONS', 10)
+    event = Event.query.filter_by(name=event_name).one()
+    ids = [id_ for id_, in db.session.query(EventEnsemble.id)
+           .filter(EventEnsemble.event_id == event.id)
+           .order_by(EventEnsemble.version.desc())
+           .offset(n_versions)]
+    if len(ids) == 0:
+        return 0
+    # the raw values, to find the arrays in the prediction store
+    columns = [EventEnsemble.combined_valid_y_pred,
+               EventEnsemble.combined_test_y_pred,
+               EventEnsemble.foldwise_valid_y_pred,
+               EventEnsemble.foldwise_test_y_pred]
+    blobs = [blob for row in db.session.query(
+             *[type_coerce(column, LargeBinary) for column in columns])
+             .filter(EventEnsemble.id.in_(ids))
+             for blob in row if blob is not None]
+    EventEnsemble.query.filter(EventEnsemble.id.in_(ids))\
+        .delete(synchronize_session='fetch')
+    db.session.commit()
+    n_arrays = remove_unreferenced_arrays(db.session, blobs)
+    logger.info('Deleted {} ensemble versions and {} arrays of {}'.format(
+        len(ids), n_arrays, event_name))
+    return len(ids)
+
+
+def _select_submissions_on_fold(cv_fold, start_time_stamp=None,
+                                end_time_stamp=None, force_ensemble=False):
+    """Select and reset the submissions to ensemble on a single fold.
 
     Parameters
     ----------
@@ -1675,40 +1991,46 @@ def _compute_contributivity_on_fold(cv_fold, ground_truths_valid,
             if submission_on_fold.submission.submission_timestamp <=
             end_time_stamp
         ]
-
-    if len(selected_submissions_on_fold) == 0:
-        return None, None, None, None
     # TODO: maybe this can be simplified. Don't need to get down
     # to prediction level.
-    predictions_list = [
-        submission_on_fold.valid_predictions
-        for submission_on_fold in selected_submissions_on_fold]
+    return _load_predictions(selected_submissions_on_fold)
+
+
+def _get_best_index_list(selected_submissions_on_fold, is_lower_the_better):
+    """Start the greedy selection with the best single submission."""
     valid_scores = [
         submission_on_fold.official_score.valid_score
         for submission_on_fold in selected_submissions_on_fold]
-    if cv_fold.event.official_score_type.is_lower_the_better:
+    if is_lower_the_better:
         best_prediction_index = np.argmin(valid_scores)
     else:
         best_prediction_index = np.argmax(valid_scores)
-    best_index_list = np.array([best_prediction_index])
-    improvement = True
-    while improvement and len(best_index_list) < cv_fold.event.max_n_ensemble:
-        old_best_index_list = best_index_list
-        best_index_list, score = get_next_best_single_fold(
-            cv_fold.event, predictions_list, ground_truths_valid,
-            best_index_list, min_improvement)
-        improvement = len(best_index_list) != len(old_best_index_list)
-        logger.info('\t{}: {}'.format(old_best_index_list, score))
+    return np.array([best_prediction_index])
+
+
+def _set_contributivity_on_fold(selected_submissions_on_fold,
+                                best_index_list, best_index=None):
+    """Set the foldwise contributivity of the selected ensemble.
+
+    Returns the combined and best valid and test predictions of the fold.
+    The best single submission is the first of the ensemble unless
+    best_index is given.
+    """
+    if best_index is None:
+        best_index = best_index_list[0]
     # set
-    selected_submissions_on_fold[best_index_list[0]].best = True
+    selected_submissions_on_fold[best_index].best = True
     # we share a unit of 1. among the contributive submissions
     unit_contributivity = 1. / len(best_index_list)
     for i in best_index_list:
         selected_submissions_on_fold[i].contributivity +=\
             unit_contributivity
+    predictions_list = [
+        submission_on_fold.valid_predictions
+        for submission_on_fold in selected_submissions_on_fold]
     combined_predictions = combine_predictions_list(
         predictions_list, index_list=best_index_list)
-    best_predictions = predictions_list[best_index_list[0]]
+    best_predictions = predictions_list[best_index]
 
     test_predictions_list = [
         submission_on_fold.test_predictions
@@ -1722,7 +2044,7 @@ def _compute_contributivity_on_fold(cv_fold, ground_truths_valid,
     else:
         combined_test_predictions = combine_predictions_list(
             test_predictions_list, index_list=best_index_list)
-        best_test_predictions = test_predictions_list[best_index_list[0]]
+        best_test_predictions = test_predictions_list[best_index]
 
     return combined_predictions, best_predictions,\
         combined_test_predictions, best_test_predictions
@@ -1731,35 +2053,64 @@ def _compute_contributivity_on_fold(cv_fold, ground_truths_valid,
 def compute_historical_contributivity_no_commit(event_name):
     submissions = get_submissions(event_name=event_name)
     submissions.sort(key=lambda x: x.submission_timestamp, reverse=True)
-    for submission in submissions:
-        submission.historical_contributivity = 0.0
-    for submission in submissions:
-        submission.historical_contributivity += submission.contributivity
-        submission_similaritys = SubmissionSimilarity.query.filter_by(
-            type='target_credit', target_submission=submission).all()
-        if submission_similaritys:
-            # if a target team enters several credits to a source submission
-            # we only take the latest
-            submission_similaritys.sort(
-                key=lambda x: x.timestamp, reverse=True)
-            processed_submissions = []
-            historical_contributivity = submission.historical_contributivity
-            for submission_similarity in submission_similaritys:
-                source_submission = submission_similarity.source_submission
-                if source_submission not in processed_submissions:
-                    partial_credit = historical_contributivity *\
-                        submission_similarity.similarity
-                    source_submission.historical_contributivity +=\
-                        partial_credit
-                    submission.historical_contributivity -= partial_credit
-                    processed_submissions.append(source_submission)
+    # all the credits of the event at once, the latest first
+    submission_similaritys = db.session.query(
+        SubmissionSimilarity.target_submission_id,
+        SubmissionSimilarity.source_submission_id,
+        SubmissionSimilarity.similarity).filter(
+        SubmissionSimilarity.type == 'target_credit').filter(
+        SubmissionSimilarity.target_submission_id == Submission.id).filter(
+        Submission.event_team_id == EventTeam.id).filter(
+        EventTeam.event_id == Event.id).filter(
+        Event.name == event_name).order_by(
+        SubmissionSimilarity.timestamp.desc(),
+        SubmissionSimilarity.id).all()
+    # credited submissions of other events keep their historical
+    # contributivity and receive the credits on top of it
+    event_submission_ids = set(submission.id for submission in submissions)
+    other_submission_ids = set(
+        source_submission_id for _, source_submission_id, _
+        in submission_similaritys
+        if source_submission_id is not None and
+        source_submission_id not in event_submission_ids)
+    if other_submission_ids:
+        other_submissions = Submission.query.filter(
+            Submission.id.in_(other_submission_ids)).all()
+    else:
+        other_submissions = []
+    index = {submission.id: i for i, submission
+             in enumerate(submissions + other_submissions)}
+    credits = {}
+    for target_submission_id, source_submission_id, similarity in\
+            submission_similaritys:
+        if source_submission_id is not None:
+            credits.setdefault(index[target_submission_id], []).append(
+                (index[source_submission_id], similarity))
+    contributivities = (
+        [submission.contributivity for submission in submissions] +
+        [submission.historical_contributivity
+         for submission in other_submissions])
+    historical_contributivities = propagate_historical_contributivity(
+        contributivities, credits)
+
+    submissions += other_submissions
+    db.session.bulk_update_mappings(Submission, [
+        {'id': submission.id,
+         'historical_contributivity': float(historical_contributivity)}
+        for submission, historical_contributivity
+        in zip(submissions, historical_contributivities)])
+    # the loaded submissions are up to date without being flushed again
+    for submission, historical_contributivity in\
+            zip(submissions, historical_contributivities):
+        set_committed_value(submission, 'historical_contributivity',
+                            float(historical_contributivity))
 
 
 def compute_historical_contributivity(event_name):
     compute_historical_contributivity_no_commit(event_name)
     db.session.commit()
-    update_leaderboards(event_name)
-    update_all_user_leaderboards(event_name)
+    event_team_ids = update_leaderboards(event_name)
+    update_all_user_leaderboards(event_name, event_team_ids)
 
 
 def is_user_signed_up(event_name, user_name):
@@ -1837,6 +2188,272 @@ def is_open_code(event, current_user, submission=None):
     return False
 
 
+def get_leaderboard_rows(event_name, team_name=None, user_name=None,
+                         is_error=None, is_new=None):
+    """Leaderboard rows of the submissions of an event.
+
+    Parameters
+    ----------
+    event_name : string
+    team_name : string or None, default is None
+        If set, only the rows of the submissions of the team.
+    user_name : string or None, default is None
+        If set, only the rows of the submissions of the teams of the user.
+    is_error : bool or None, default is None
+        If set, only the rows of the failed submissions, or the others.
+    is_new : bool or None, default is None
+        If set, only the rows of the submissions waiting to be trained, or
+        the others.
+
+    Returns
+    -------
+    rows : list of `LeaderboardRow` instances
+        Ordered by submission id.
+    """
+    event = Event.query.filter_by(name=event_name).one()
+    query = LeaderboardRow.query.filter_by(event_id=event.id)
+    if team_name is not None:
+        query = query.filter(LeaderboardRow.team_name == team_name)
+    if is_error is not None:
+        query = query.filter(LeaderboardRow.is_error == is_error)
+    if is_new is not None:
+        query = query.filter(LeaderboardRow.is_new == is_new)
+    if user_name is not None:
+        event_team_ids = [event_team.id for event_team
+                          in get_user_event_teams(event_name, user_name)]
+        if len(event_team_ids) == 0:
+            return []
+        query = query.filter(
+            LeaderboardRow.event_team_id.in_(event_team_ids))
+    return query.order_by(LeaderboardRow.submission_id).all()
+
+
+# title of a column, LeaderboardRow column to sort it by or None if it cannot
+# be sorted in the database, and cell value of a row
+_LeaderboardColumn = namedtuple(
+    '_LeaderboardColumn', ['title', 'sort_key', 'get_value'])
+
+LEADERBOARD_TYPES = ['public', 'private', 'user', 'competition',
+                     'private_competition']
+
+
+def get_leaderboard_columns(event, leaderboard_type, is_link=True):
+    """Columns of a leaderboard, in the order of the html leaderboards.
+
+    Parameters
+    ----------
+    event : `Event` instance
+    leaderboard_type : string
+        One of `LEADERBOARD_TYPES`. The 'user' leaderboard has the columns of
+        the 'public' one.
+    is_link : bool, default is True
+        Whether the submission names link to their code.
+
+    Returns
+    -------
+    columns : list of (title, sort_key, get_value) tuples
+        The competition leaderboards are sorted in memory, so their sort keys
+        are the titles.
+    """
+    score_name = event.official_score_name
+    if leaderboard_type == 'competition':
+        titles = ['rank', 'team', 'submission', score_name,
+                  'train time [s]', 'test time [s]', 'submitted at (UTC)']
+        return [_LeaderboardColumn(title, title, None) for title in titles]
+    if leaderboard_type == 'private_competition':
+        titles = ['rank', 'move', 'team', 'submission', score_name,
+                  'train time [s]', 'test time [s]', 'submitted at (UTC)']
+        return [_LeaderboardColumn(title, title, None) for title in titles]
+
+    is_private = leaderboard_type == 'private'
+    columns = [_LeaderboardColumn(
+        'team', LeaderboardRow.team_name, lambda row: row.team_name)]
+    if is_link:
+        columns.append(_LeaderboardColumn(
+            'submission', LeaderboardRow.submission_name,
+            lambda row: row.name_with_link))
+    else:
+        columns.append(_LeaderboardColumn(
+            'submission', LeaderboardRow.submission_name,
+            lambda row: row.submission_name))
+    contributivity_columns = [
+        _LeaderboardColumn(
+            'contributivity', LeaderboardRow.contributivity,
+            lambda row: row.contributivity),
+        _LeaderboardColumn(
+            'historical contributivity',
+            LeaderboardRow.historical_contributivity,
+            lambda row: row.historical_contributivity)]
+    if not is_private:
+        columns += contributivity_columns
+    # only the official scores are stored in their own columns
+    for i, score_type in enumerate(get_event_score_types(event)):
+        is_official = score_type.name == score_name
+        if is_private:
+            suffixes = [' pub bag', ' pub mean', ' pub std', ' pr bag',
+                        ' pr mean', ' pr std']
+            sort_keys = [None] * 6
+            if is_official:
+                sort_keys[0] = LeaderboardRow.official_valid_score
+                sort_keys[3] = LeaderboardRow.official_test_score
+        else:
+            suffixes = ['']
+            sort_keys = [LeaderboardRow.official_valid_score
+                         if is_official else None]
+        for j, (suffix, sort_key) in enumerate(zip(suffixes, sort_keys)):
+            columns.append(_LeaderboardColumn(
+                score_type.name + suffix, sort_key,
+                lambda row, i=i, j=j: row.scores[i, j]))
+    if is_private:
+        columns += contributivity_columns
+    columns.append(_LeaderboardColumn(
+        'train time [s]', LeaderboardRow.train_time,
+        lambda row: row.train_time))
+    if is_private:
+        columns.append(_LeaderboardColumn(
+            'trt std', LeaderboardRow.train_time_std,
+            lambda row: row.train_time_std))
+    columns.append(_LeaderboardColumn(
+        'test time [s]', LeaderboardRow.valid_time,
+        lambda row: row.valid_time))
+    if is_private:
+        columns += [
+            _LeaderboardColumn(
+                'tet std', LeaderboardRow.valid_time_std,
+                lambda row: row.valid_time_std),
+            _LeaderboardColumn(
+                'max RAM [MB]', LeaderboardRow.max_ram,
+                lambda row: row.max_ram)]
+    columns.append(_LeaderboardColumn(
+        'submitted at (UTC)', LeaderboardRow.submission_timestamp,
+        lambda row: date_time_format(row.submission_timestamp)))
+    return columns
+
+
+def get_leaderboard_sorting(event, leaderboard_type):
+    """Index and direction of the column a leaderboard is sorted by."""
+    if leaderboard_type in ['competition', 'private_competition']:
+        return 0, 'asc'
+    if event.official_score_type.is_lower_the_better:
+        direction = 'asc'
+    else:
+        direction = 'desc'
+    if leaderboard_type == 'private':
+        title = event.official_score_name + ' pr bag'
+    else:
+        title = event.official_score_name
+    titles = [column.title for column in get_leaderboard_columns(
+        event, leaderboard_type)]
+    return titles.index(title), direction
+
+
+def _to_json_value(value):
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+
+def get_leaderboard_page(event_name, leaderboard_type, start=0, length=None,
+                         sort_index=None, ascending=True, team_name=None,
+                         user_name=None, is_link=True):
+    """One page of a leaderboard.
+
+    The rows are filtered, sorted and paged in the database, except for
+    the competition leaderboards, which have at most one row per team.
+
+    Parameters
+    ----------
+    event_name : string
+    leaderboard_type : string
+        One of `LEADERBOARD_TYPES`.
+    start : int, default is 0
+        Index of the first row of the page.
+    length : int or None, default is None
+        Number of rows of the page. All the rows from start if None.
+    sort_index : int or None, default is None
+        Index of the column to sort by. If None or if the column cannot be
+        sorted, the leaderboard is sorted by its official score or rank.
+    ascending : bool, default is True
+        Sorting direction, unused if sort_index is None.
+    team_name : string or None, default is None
+        If set, only the rows of the teams whose name starts with it.
+    user_name : string or None, default is None
+        Only the rows of the teams of the user, for the 'user' leaderboard.
+    is_link : bool, default is True
+        Whether the submission names link to their code.
+
+    Returns
+    -------
+    n_rows : int
+        Number of rows of the leaderboard.
+    n_filtered_rows : int
+        Number of rows of the leaderboard of the teams matching team_name.
+    data : list of lists
+        The cells of the rows of the page.
+    """
+    if leaderboard_type not in LEADERBOARD_TYPES:
+        raise ValueError('Unknown leaderboard type: {}'.format(
+            leaderboard_type))
+    event = Event.query.filter_by(name=event_name).one()
+    columns = get_leaderboard_columns(event, leaderboard_type, is_link)
+    if sort_index is None or not 0 <= sort_index < len(columns) or\
+            columns[sort_index].sort_key is None:
+        sort_index, direction = get_leaderboard_sorting(
+            event, leaderboard_type)
+        ascending = direction == 'asc'
+
+    if leaderboard_type in ['competition', 'private_competition']:
+        leaderboard_dfs = _get_competition_leaderboard_dfs(event)
+        if leaderboard_type == 'competition':
+            leaderboard_df = leaderboard_dfs[0]
+        else:
+            leaderboard_df = leaderboard_dfs[1]
+        n_rows = len(leaderboard_df)
+        if team_name:
+            leaderboard_df = leaderboard_df[
+                leaderboard_df['team'].str.startswith(team_name)]
+        n_filtered_rows = len(leaderboard_df)
+        leaderboard_df = leaderboard_df.sort_values(
+            by=columns[sort_index].sort_key, ascending=ascending,
+            kind='mergesort')
+        stop = None if length is None else start + length
+        data = leaderboard_df.iloc[start:stop].values.tolist()
+        return n_rows, n_filtered_rows, [
+            [_to_json_value(value) for value in row] for row in data]
+
+    query = LeaderboardRow.query.filter_by(event_id=event.id)
+    if leaderboard_type == 'private':
+        query = query.filter(LeaderboardRow.is_private_leaderboard)
+    else:
+        query = query.filter(LeaderboardRow.is_public_leaderboard)
+    if leaderboard_type == 'user':
+        event_team_ids = [event_team.id for event_team
+                          in get_user_event_teams(event_name, user_name)]
+        if len(event_team_ids) == 0:
+            return 0, 0, []
+        query = query.filter(
+            LeaderboardRow.event_team_id.in_(event_team_ids))
+    n_rows = query.count()
+    if team_name:
+        pattern = team_name.replace('\\', '\\\\').replace(
+            '%', '\\%').replace('_', '\\_')
+        query = query.filter(
+            LeaderboardRow.team_name.like(pattern + '%', escape='\\'))
+    n_filtered_rows = query.count()
+    sort_key = columns[sort_index].sort_key
+    query = query.order_by(
+        sort_key.asc() if ascending else sort_key.desc(),
+        LeaderboardRow.submission_id)
+    query = query.offset(start)
+    if length is not None:
+        query = query.limit(length)
+    data = [[_to_json_value(column.get_value(row)) for column in columns]
+            for row in query]
+    return n_rows, n_filtered_rows, data
+
+
 def get_leaderboards(event_name, user_name=None):
     """Create leaderboards.
 
@@ -1845,43 +2462,31 @@ def get_leaderboards(event_name, user_name=None):
     leaderboard_html_with_links : html string
     leaderboard_html_with_no_links : html string
     """
-    submissions = get_submissions(event_name=event_name, user_name=user_name)
-    submissions = [submission for submission in submissions
-                   if submission.is_public_leaderboard and submission.is_valid]
     event = Event.query.filter_by(name=event_name).one()
+    return _get_leaderboards(
+        event, get_leaderboard_rows(event_name, user_name=user_name))
+
 
-    score_names = [score_type.name for score_type in event.score_types]
-    scoress = np.array([
-        [round(score.valid_score_cv_bag, score.precision)
-         for score in submission.ordered_scores(score_names)]
-        for submission in submissions
-    ]).T
+def _get_leaderboards(event, rows):
+    rows = [row for row in rows if row.is_public_leaderboard]
+    score_names = [score_type.name
+                   for score_type in get_event_score_types(event)]
     leaderboard_df = pd.DataFrame()
-    leaderboard_df['team'] = [
-        submission.event_team.team.name for submission in submissions]
-    leaderboard_df['submission'] = [
-        submission.name_with_link for submission in submissions]
+    leaderboard_df['team'] = [row.team_name for row in rows]
+    leaderboard_df['submission'] = [row.name_with_link for row in rows]
     leaderboard_df['submission no link'] = [
-        submission.name[:20] for submission in submissions]
-    leaderboard_df['contributivity'] = [
-        int(round(100 * submission.contributivity))
-        for submission in submissions]
+        row.submission_name for row in rows]
+    leaderboard_df['contributivity'] = [row.contributivity for row in rows]
     leaderboard_df['historical contributivity'] = [
-        int(round(100 * submission.historical_contributivity))
-        for submission in submissions]
+        row.historical_contributivity for row in rows]
     for score_name in score_names:  # to make sure the column is created
         leaderboard_df[score_name] = 0
-    for score_name, scores in zip(score_names, scoress):
-        leaderboard_df[score_name] = scores
-    leaderboard_df['train time [s]'] = [
-        int(round(submission.train_time_cv_mean))
-        for submission in submissions]
-    leaderboard_df['test time [s]'] = [
-        int(round(submission.valid_time_cv_mean))
-        for submission in submissions]
+    for i, score_name in enumerate(score_names):
+        leaderboard_df[score_name] = [row.scores[i, 0] for row in rows]
+    leaderboard_df['train time [s]'] = [row.train_time for row in rows]
+    leaderboard_df['test time [s]'] = [row.valid_time for row in rows]
     leaderboard_df['submitted at (UTC)'] = [
-        date_time_format(submission.submission_timestamp)
-        for submission in submissions]
+        date_time_format(row.submission_timestamp) for row in rows]
     sort_column = event.official_score_name
     leaderboard_df = leaderboard_df.sort_values(
         sort_column, ascending=event.official_score_type.is_lower_the_better)
@@ -1915,29 +2520,18 @@ def get_private_leaderboards(event_name, user_name=None):
     leaderboard_html_with_links : html string
     leaderboard_html_with_no_links : html string
     """
-    submissions = get_submissions(event_name=event_name, user_name=user_name)
-    submissions = [submission for submission in submissions
-                   if submission.is_private_leaderboard]
     event = Event.query.filter_by(name=event_name).one()
+    return _get_private_leaderboards(
+        event, get_leaderboard_rows(event_name, user_name=user_name))
+
 
-    score_names = [score_type.name for score_type in event.score_types]
-    scoresss = np.array([
-        [[round(score.valid_score_cv_bag, score.precision),
-          round(score.valid_score_cv_mean, score.precision),
-          round(score.valid_score_cv_std, score.precision + 1),
-          round(score.test_score_cv_bag, score.precision),
-          round(score.test_score_cv_mean, score.precision),
-          round(score.test_score_cv_std, score.precision + 1)]
-         for score in submission.ordered_scores(score_names)]
-        for submission in submissions
-    ])
-    if len(submissions) > 0:
-        scoresss = np.swapaxes(scoresss, 0, 1)
+def _get_private_leaderboards(event, rows):
+    rows = [row for row in rows if row.is_private_leaderboard]
+    score_names = [score_type.name
+                   for score_type in get_event_score_types(event)]
     leaderboard_df = pd.DataFrame()
-    leaderboard_df['team'] = [
-        submission.event_team.team.name for submission in submissions]
-    leaderboard_df['submission'] = [
-        submission.name_with_link for submission in submissions]
+    leaderboard_df['team'] = [row.team_name for row in rows]
+    leaderboard_df['submission'] = [row.name_with_link for row in rows]
     for score_name in score_names:  # to make sure the column is created
         leaderboard_df[score_name + ' pub bag'] = 0
         leaderboard_df[score_name + ' pub mean'] = 0
@@ -1945,38 +2539,29 @@ def get_private_leaderboards(event_name, user_name=None):
         leaderboard_df[score_name + ' pr bag'] = 0
         leaderboard_df[score_name + ' pr mean'] = 0
         leaderboard_df[score_name + ' pr std'] = 0
-    for score_name, scoress in zip(score_names, scoresss):
-        leaderboard_df[score_name + ' pub bag'] = scoress[:, 0]
-        leaderboard_df[score_name + ' pub mean'] = scoress[:, 1]
-        leaderboard_df[score_name + ' pub std'] = scoress[:, 2]
-        leaderboard_df[score_name + ' pr bag'] = scoress[:, 3]
-        leaderboard_df[score_name + ' pr mean'] = scoress[:, 4]
-        leaderboard_df[score_name + ' pr std'] = scoress[:, 5]
-    leaderboard_df['contributivity'] = [
-        int(round(100 * submission.contributivity))
-        for submission in submissions]
+    for i, score_name in enumerate(score_names):
+        leaderboard_df[score_name + ' pub bag'] = [
+            row.scores[i, 0] for row in rows]
+        leaderboard_df[score_name + ' pub mean'] = [
+            row.scores[i, 1] for row in rows]
+        leaderboard_df[score_name + ' pub std'] = [
+            row.scores[i, 2] for row in rows]
+        leaderboard_df[score_name + ' pr bag'] = [
+            row.scores[i, 3] for row in rows]
+        leaderboard_df[score_name + ' pr mean'] = [
+            row.scores[i, 4] for row in rows]
+        leaderboard_df[score_name + ' pr std'] = [
+            row.scores[i, 5] for row in rows]
+    leaderboard_df['contributivity'] = [row.contributivity for row in rows]
     leaderboard_df['historical contributivity'] = [
-        int(round(100 * submission.historical_contributivity))
-        for submission in submissions]
-    leaderboard_df['train time [s]'] = [
-        int(round(submission.train_time_cv_mean))
-        for submission in submissions]
-    leaderboard_df['trt std'] = [
-        int(round(submission.train_time_cv_std))
-        for submission in submissions]
-    leaderboard_df['test time [s]'] = [
-        int(round(submission.valid_time_cv_mean))
-        for submission in submissions]
-    leaderboard_df['tet std'] = [
-        int(round(submission.valid_time_cv_std))
-        for submission in submissions]
-    leaderboard_df['max RAM [MB]'] = [
-        int(round(submission.max_ram)) if type(submission.max_ram) == float
-        else 0
-        for submission in submissions]
+        row.historical_contributivity for row in rows]
+    leaderboard_df['train time [s]'] = [row.train_time for row in rows]
+    leaderboard_df['trt std'] = [row.train_time_std for row in rows]
+    leaderboard_df['test time [s]'] = [row.valid_time for row in rows]
+    leaderboard_df['tet std'] = [row.valid_time_std for row in rows]
+    leaderboard_df['max RAM [MB]'] = [row.max_ram for row in rows]
     leaderboard_df['submitted at (UTC)'] = [
-        date_time_format(submission.submission_timestamp)
-        for submission in submissions]
+        date_time_format(row.submission_timestamp) for row in rows]
     sort_column = event.official_score_name + ' pr bag'
     leaderboard_df = leaderboard_df.sort_values(
         sort_column, ascending=event.official_score_type.is_lower_the_better)
@@ -2004,79 +2589,49 @@ def get_competition_leaderboards(event_name):
     leaderboard_html_with_links : html string
     leaderboard_html_with_no_links : html string
     """
-    submissions = get_submissions(event_name=event_name)
-    submissions = [
-        submission for submission in submissions
-        if submission.is_public_leaderboard and submission.is_valid and
-        submission.is_in_competition]
     event = Event.query.filter_by(name=event_name).one()
-    score_type = event.official_score_type
+    return _get_competition_leaderboards(event)
+
+
+def _get_competition_leaderboards(event):
+    public_leaderboard_df, private_leaderboard_df = \
+        _get_competition_leaderboard_dfs(event)
+    html_params = dict(
+        escape=False,
+        index=False,
+        max_cols=None,
+        max_rows=None,
+        justify='left',
+        # classes=['ui', 'blue', 'celled', 'table', 'sortable']
+    )
+    public_leaderboard_html = public_leaderboard_df.to_html(**html_params)
+    private_leaderboard_html = private_leaderboard_df.to_html(**html_params)
+
+    return (
+        table_format(public_leaderboard_html),
+        table_format(private_leaderboard_html)
+    )
+
+
+def _get_competition_leaderboard_dfs(event):
     score_name = event.official_score_name
+    ranked_rows = get_competition_leaderboard_rows(db.session, event)
+    rows = [row for row, _, _ in ranked_rows]
 
-    # construct full leaderboard
+    # one row per team, ordered by public rank
     leaderboard_df = pd.DataFrame()
-    leaderboard_df['team'] = [
-        submission.event_team.team.name for submission in submissions]
-    leaderboard_df['submission'] = [
-        submission.name[:20] for submission in submissions]
+    leaderboard_df['public rank'] = [rank for _, rank, _ in ranked_rows]
+    leaderboard_df['private rank'] = [rank for _, _, rank in ranked_rows]
+    leaderboard_df['team'] = [row.team_name for row in rows]
+    leaderboard_df['submission'] = [row.submission_name for row in rows]
     leaderboard_df['public ' + score_name] = [
-        round(
-            submission.official_score.valid_score_cv_bag, score_type.precision)
-        for submission in submissions]
+        row.official_valid_score for row in rows]
     leaderboard_df['private ' + score_name] = [
-        round(
-            submission.official_score.test_score_cv_bag, score_type.precision)
-        for submission in submissions]
-    leaderboard_df['train time [s]'] = [
-        int(round(submission.train_time_cv_mean))
-        for submission in submissions]
-    leaderboard_df['test time [s]'] = [
-        int(round(submission.valid_time_cv_mean))
-        for submission in submissions]
+        row.official_test_score for row in rows]
+    leaderboard_df['train time [s]'] = [row.train_time for row in rows]
+    leaderboard_df['test time [s]'] = [row.valid_time for row in rows]
     leaderboard_df['submitted at (UTC)'] = [
-        date_time_format(submission.submission_timestamp)
-        for submission in submissions]
-
-    # select best submission for each team
-    if score_type.is_lower_the_better:
-        best_df = leaderboard_df.groupby('team').min()
-    else:
-        best_df = leaderboard_df.groupby('team').max()
-    best_df = best_df[['public ' + score_name]].reset_index()
-    best_df['best'] = True
-
-    # merge to get a best indicator column then select best
-    leaderboard_df = pd.merge(
-        leaderboard_df, best_df, how='left',
-        left_on=['team', 'public ' + score_name],
-        right_on=['team', 'public ' + score_name])
-    leaderboard_df = leaderboard_df.fillna(False)
-    leaderboard_df = leaderboard_df[leaderboard_df['best']]
-    leaderboard_df = leaderboard_df.drop(columns='best')
-
-    # dealing with ties: we need the lowest timestamp
-    best_df = leaderboard_df.groupby('team').min()
-    best_df = best_df[['submitted at (UTC)']].reset_index()
-    best_df['best'] = True
-    leaderboard_df = pd.merge(
-        leaderboard_df, best_df, how='left',
-        left_on=['team', 'submitted at (UTC)'],
-        right_on=['team', 'submitted at (UTC)'])
-    leaderboard_df = leaderboard_df.fillna(False)
-    leaderboard_df = leaderboard_df[leaderboard_df['best']]
-    leaderboard_df = leaderboard_df.drop(columns='best')
-
-    # sort by public score then by submission timestamp, compute rank
-    leaderboard_df = leaderboard_df.sort_values(
-        by=['public ' + score_name, 'submitted at (UTC)'],
-        ascending=[score_type.is_lower_the_better, True])
-    leaderboard_df['public rank'] = np.arange(len(leaderboard_df)) + 1
-
-    # sort by private score then by submission timestamp, compute rank
-    leaderboard_df = leaderboard_df.sort_values(
-        by=['private ' + score_name, 'submitted at (UTC)'],
-        ascending=[score_type.is_lower_the_better, True])
-    leaderboard_df['private rank'] = np.arange(len(leaderboard_df)) + 1
+        date_time_format(row.submission_timestamp) for row in rows]
 
     leaderboard_df['move'] =\
         leaderboard_df['public rank'] - leaderboard_df['private rank']
@@ -2090,7 +2645,6 @@ def get_competition_leaderboards(event_name):
         'public ' + score_name: score_name,
         'public rank': 'rank'
     })
-    public_leaderboard_df = public_leaderboard_df.sort_values(by='rank')
 
     private_leaderboard_df = leaderboard_df[[
         'private rank', 'move', 'team', 'submission', 'private ' + score_name,
@@ -2101,69 +2655,113 @@ def get_competition_leaderboards(event_name):
     })
     private_leaderboard_df = private_leaderboard_df.sort_values(by='rank')
 
-    html_params = dict(
-        escape=False,
-        index=False,
-        max_cols=None,
-        max_rows=None,
-        justify='left',
-        # classes=['ui', 'blue', 'celled', 'table', 'sortable']
-    )
-    public_leaderboard_html = public_leaderboard_df.to_html(**html_params)
-    private_leaderboard_html = private_leaderboard_df.to_html(**html_params)
+    return public_leaderboard_df, private_leaderboard_df
 
-    return (
-        table_format(public_leaderboard_html),
-        table_format(private_leaderboard_html)
-    )
 
+def update_leaderboards(event_name, submission_ids=None):
+    """Refresh the leaderboard rows then the leaderboards of an event.
 
-def update_leaderboards(event_name):
-    private_leaderboard_html = get_private_leaderboards(
-        event_name)
-    leaderboards = get_leaderboards(event_name)
-    failed_leaderboard_html = get_failed_leaderboard(event_name)
-    new_leaderboard_html = get_new_leaderboard(event_name)
-    competition_leaderboards_html = get_competition_leaderboards(event_name)
+    Only the leaderboards showing a changed row are rendered again. The
+    failed and new leaderboards are rendered from their own rows, and the
+    public, private and competition leaderboards only when a changed row is
+    or was on the public leaderboard.
+
+    Parameters
+    ----------
+    event_name : string
+    submission_ids : list of int or None, default is None
+        The submissions whose state, scores or flags may have changed. All
+        the submissions of the event are checked if None.
 
+    Returns
+    -------
+    event_team_ids : set of int
+        The event teams with a changed leaderboard row, to be passed to
+        `update_all_user_leaderboards`.
+    """
+    if submission_ids is not None and len(submission_ids) == 0:
+        return set()
     event = Event.query.filter_by(name=event_name).one()
-    event.private_leaderboard_html = private_leaderboard_html
-    event.public_leaderboard_html_with_links = leaderboards[0]
-    event.public_leaderboard_html_no_links = leaderboards[1]
-    event.failed_leaderboard_html = failed_leaderboard_html
-    event.new_leaderboard_html = new_leaderboard_html
-    event.public_competition_leaderboard_html =\
-        competition_leaderboards_html[0]
-    event.private_competition_leaderboard_html = \
-        competition_leaderboards_html[1]
+    public_query = db.session.query(LeaderboardRow.submission_id).filter(
+        LeaderboardRow.event_id == event.id,
+        LeaderboardRow.is_public_leaderboard)
+    if submission_ids is not None:
+        public_query = public_query.filter(
+            LeaderboardRow.submission_id.in_(submission_ids))
+    public_submission_ids = set(
+        submission_id for submission_id, in public_query)
+    changed_rows = update_leaderboard_rows(db.session, event, submission_ids)
+    if len(changed_rows) == 0:
+        return set()
+
+    if any(row.is_public_leaderboard or
+           row.submission_id in public_submission_ids
+           for row in changed_rows):
+        rows = get_leaderboard_rows(event_name)
+        private_leaderboard_html = _get_private_leaderboards(event, rows)
+        leaderboards = _get_leaderboards(event, rows)
+        competition_leaderboards_html = _get_competition_leaderboards(event)
+
+        event.private_leaderboard_html = private_leaderboard_html
+        event.public_leaderboard_html_with_links = leaderboards[0]
+        event.public_leaderboard_html_no_links = leaderboards[1]
+        event.public_competition_leaderboard_html =\
+            competition_leaderboards_html[0]
+        event.private_competition_leaderboard_html = \
+            competition_leaderboards_html[1]
+    event.failed_leaderboard_html = get_failed_leaderboard(event_name)
+    event.new_leaderboard_html = get_new_leaderboard(event_name)
     db.session.commit()
+    return set(row.event_team_id for row in changed_rows)
+
+
+def _set_event_team_leaderboards(event, event_team, rows):
+    event_team.leaderboard_html = _get_leaderboards(event, rows)[0]
+    event_team.failed_leaderboard_html = _get_failed_leaderboard(rows)
+    event_team.new_leaderboard_html = _get_new_leaderboard(rows)
 
 
 def update_user_leaderboards(event_name, user_name):
     logger.info('Leaderboard is updated for user {} in event {}.'.format(
         user_name, event_name))
-    leaderboards = get_leaderboards(event_name, user_name)
-    failed_leaderboard_html = get_failed_leaderboard(event_name, user_name)
-    new_leaderboard_html = get_new_leaderboard(event_name, user_name)
+    event = Event.query.filter_by(name=event_name).one()
+    rows = get_leaderboard_rows(event_name, user_name=user_name)
     for event_team in get_user_event_teams(event_name, user_name):
-        event_team.leaderboard_html = leaderboards[0]
-        event_team.failed_leaderboard_html = failed_leaderboard_html
-        event_team.new_leaderboard_html = new_leaderboard_html
+        _set_event_team_leaderboards(event, event_team, rows)
     db.session.commit()
 
 
-def update_all_user_leaderboards(event_name):
+def update_all_user_leaderboards(event_name, event_team_ids=None):
+    """Update the leaderboards of the teams of an event.
+
+    The leaderboard rows of the event are read once and grouped by team,
+    and all the teams are updated in a single transaction.
+
+    Parameters
+    ----------
+    event_name : string
+    event_team_ids : set of int or None, default is None
+        The event teams to update, eg, the ones returned by
+        `update_leaderboards`. All the teams of the event are updated if
+        None.
+    """
+    if event_team_ids is not None and len(event_team_ids) == 0:
+        return
     event = Event.query.filter_by(name=event_name).one()
-    event_teams = EventTeam.query.filter_by(event=event).all()
+    query = EventTeam.query.filter_by(event=event)
+    if event_team_ids is not None:
+        query = query.filter(EventTeam.id.in_(event_team_ids))
+    event_teams = query.all()
+
+    rows = LeaderboardRow.query.filter_by(event_id=event.id)
+    if event_team_ids is not None:
+        rows = rows.filter(LeaderboardRow.event_team_id.in_(event_team_ids))
+    team_rows = {}
+    for row in rows.order_by(LeaderboardRow.submission_id):
+        team_rows.setdefault(row.event_team_id, []).append(row)
     for event_team in event_teams:
-        user_name = event_team.team.name
-        leaderboards = get_leaderboards(event_name, user_name)
-        failed_leaderboard_html = get_failed_leaderboard(
-            event_name, user_name)
-        new_leaderboard_html = get_new_leaderboard(event_name, user_name)
-        event_team.leaderboard_html = leaderboards[0]
-        event_team.failed_leaderboard_html = failed_leaderboard_html
-        event_team.new_leaderboard_html = new_leaderboard_html
+        _set_event_team_leaderboards(
+            event, event_team, team_rows.get(event_team.id, []))
     db.session.commit()
 
 
@@ -2174,10 +2772,13 @@ def get_failed_leaderboard(event_name, team_name=None, user_name=None):
     -------
     leaderboard_html : html string
     """
-    submissions = get_submissions(
-        event_name=event_name, team_name=team_name, user_name=user_name)
-    submissions = [submission for submission in submissions
-                   if submission.is_error]
+    return _get_failed_leaderboard(get_leaderboard_rows(
+        event_name, team_name=team_name, user_name=user_name,
+        is_error=True))
+
+
+def _get_failed_leaderboard(rows):
+    rows = [row for row in rows if row.is_error]
 
     columns = ['team',
                'submission',
@@ -2185,11 +2786,11 @@ def get_failed_leaderboard(event_name, team_name=None, user_name=None):
                'error']
     leaderboard_dict_list = [
         {column: value for column, value in zip(
-            columns, [submission.event_team.team.name,
-                      submission.name_with_link,
-                      date_time_format(submission.submission_timestamp),
-                      submission.state_with_link])}
-        for submission in submissions
+            columns, [row.team_name,
+                      row.name_with_link,
+                      date_time_format(row.submission_timestamp),
+                      row.state_with_link])}
+        for row in rows
     ]
     leaderboard_df = pd.DataFrame(leaderboard_dict_list, columns=columns)
     html_params = dict(
@@ -2215,23 +2816,22 @@ def get_new_leaderboard(event_name, team_name=None, user_name=None):
     -------
     leaderboard_html : html string
     """
-    submissions = get_submissions(
-        event_name=event_name, team_name=team_name, user_name=user_name)
-    submissions = [submission for submission in submissions
-                   if submission.state in
-                   ['new', 'training', 'sent_to_training'] and
-                   submission.is_not_sandbox]
+    return _get_new_leaderboard(get_leaderboard_rows(
+        event_name, team_name=team_name, user_name=user_name, is_new=True))
+
+
+def _get_new_leaderboard(rows):
+    rows = [row for row in rows if row.is_new]
 
     columns = ['team',
                'submission',
                'submitted at (UTC)']
     leaderboard_dict_list = [
         {column: value for column, value in zip(
-            columns, [submission.event_team.team.name,
-                      submission.name_with_link,
-                      date_time_format(
-                          submission.submission_timestamp)])}
-        for submission in submissions
+            columns, [row.team_name,
+                      row.name_with_link,
+                      date_time_format(row.submission_timestamp)])}
+        for row in rows
     ]
     leaderboard_df = pd.DataFrame(leaderboard_dict_list, columns=columns)
     html_params = dict(
@@ -45,6 +45,9 @@ class RampConfig(object):
     # make it False if parallel training is not working
     # is_parallelize
     RAMP_PARALLELIZE = bool(os.getenv('DATABOARD_PARALLELIZE', 1))
+    # number of versions of the ensemble predictions kept per event
+    RAMP_N_EVENT_ENSEMBLE_VERSIONS = int(
+        os.getenv('DATABOARD_N_EVENT_ENSEMBLE_VERSIONS', 10))
 
 ######################################################################
 
@@ -14,8 +14,8 @@ import zipfile
 
 import flask_login as fl
 import flask_sqlalchemy as fs
-from flask import (abort, flash, g, redirect, render_template, request,
-                   send_file, send_from_directory, session, url_for)
+from flask import (abort, flash, g, jsonify, redirect, render_template,
+                   request, send_file, send_from_directory, session, url_for)
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import NoResultFound
 from werkzeug import secure_filename
@@ -30,7 +30,9 @@ from rampdb.model import (DuplicateSubmissionError, Event, EventTeam, Keyword,
 
 from . import app, db, login_manager, ramp_config, ramp_kits_path
 from .db_tools import (add_event, add_user_interaction, ask_sign_up_team,
-                       create_user, get_active_user_event_team, get_sandbox,
+                       create_user, get_active_user_event_team,
+                       get_leaderboard_columns, get_leaderboard_page,
+                       get_leaderboard_sorting, get_sandbox,
                        get_source_submissions, get_user_interactions, is_admin,
                        is_open_code, is_open_leaderboard, is_public_event,
                        is_user_asked_sign_up, is_user_signed_up,
@@ -49,6 +51,10 @@ from .vizu import score_plot
 
 app.secret_key = os.urandom(24)
 
+# number of rows of the leaderboard pages returned by the json api
+LEADERBOARD_PAGE_LENGTH = 100
+MAX_LEADERBOARD_PAGE_LENGTH = 1000
+
 logger = logging.getLogger('databoard')
 
 
@@ -472,23 +478,17 @@ def my_submissions(event_name):
     team = Team.query.filter_by(name=fl.current_user.name).one()
     event_team = EventTeam.query.filter_by(
         event=event, team=team).one_or_none()
-    leaderboard_html = event_team.leaderboard_html
     failed_leaderboard_html = event_team.failed_leaderboard_html
     new_leaderboard_html = event_team.new_leaderboard_html
     admin = check_admin(fl.current_user, event)
-    if event.official_score_type.is_lower_the_better:
-        sorting_direction = 'asc'
-    else:
-        sorting_direction = 'desc'
     return render_template('leaderboard.html',
                            leaderboard_title='Trained submissions',
-                           leaderboard=leaderboard_html,
                            failed_leaderboard=failed_leaderboard_html,
                            new_leaderboard=new_leaderboard_html,
-                           sorting_column_index=4,
-                           sorting_direction=sorting_direction,
                            event=event,
-                           admin=admin)
+                           admin=admin,
+                           **_get_leaderboard_kwargs(
+                               event, 'user', 'api_my_submissions'))
 
 
 @app.route("/events/<event_name>/leaderboard")
@@ -502,21 +502,10 @@ def leaderboard(event_name):
         interaction='looking at leaderboard',
         user=fl.current_user, event=event)
 
-    if is_open_leaderboard(event, fl.current_user):
-        leaderboard_html = event.public_leaderboard_html_with_links
-    else:
-        leaderboard_html = event.public_leaderboard_html_no_links
-    if event.official_score_type.is_lower_the_better:
-        sorting_direction = 'asc'
-    else:
-        sorting_direction = 'desc'
-
     leaderboard_kwargs = dict(
-        leaderboard=leaderboard_html,
         leaderboard_title='Leaderboard',
-        sorting_column_index=4,
-        sorting_direction=sorting_direction,
-        event=event
+        event=event,
+        **_get_leaderboard_kwargs(event, 'public', 'api_leaderboard')
     )
 
     if fl.current_user.access_level == 'admin' or\
@@ -549,20 +538,120 @@ def competition_leaderboard(event_name):
         user=fl.current_user, event=event)
     admin = check_admin(fl.current_user, event)
 
-    leaderboard_html = event.public_competition_leaderboard_html
-
     leaderboard_kwargs = dict(
-        leaderboard=leaderboard_html,
         leaderboard_title='Leaderboard',
-        sorting_column_index=0,
-        sorting_direction='asc',
         event=event,
-        admin=admin
+        admin=admin,
+        **_get_leaderboard_kwargs(
+            event, 'competition', 'api_competition_leaderboard')
     )
 
     return render_template('leaderboard.html', **leaderboard_kwargs)
 
 
+def _get_leaderboard_kwargs(event, leaderboard_type, endpoint):
+    """Template arguments of a leaderboard paged by the json api."""
+    columns = get_leaderboard_columns(event, leaderboard_type)
+    sorting_column_index, sorting_direction = get_leaderboard_sorting(
+        event, leaderboard_type)
+    return dict(
+        leaderboard_url=url_for(endpoint, event_name=event.name),
+        leaderboard_columns=[column.title for column in columns],
+        leaderboard_orderable=[column.sort_key is not None
+                               for column in columns],
+        sorting_column_index=sorting_column_index,
+        sorting_direction=sorting_direction)
+
+
+def _is_private_leaderboard_open(event, user):
+    return (is_admin(event, user) or
+            (event.closing_timestamp is not None and
+             event.closing_timestamp <= datetime.datetime.utcnow()))
+
+
+def _leaderboard_page_json(event, leaderboard_type, **kwargs):
+    """Page of a leaderboard in the DataTables server-side format.
+
+    Either the DataTables parameters (start, length, order[0][column],
+    order[0][dir] and search[value]) or page, length, sort, direction and
+    team are read from the query string.
+    """
+    args = request.args
+    length = args.get('length', LEADERBOARD_PAGE_LENGTH, type=int)
+    if length < 0 or length > MAX_LEADERBOARD_PAGE_LENGTH:
+        length = MAX_LEADERBOARD_PAGE_LENGTH
+    start = args.get('start', type=int)
+    if start is None:
+        start = (max(args.get('page', 1, type=int), 1) - 1) * length
+    sort_index = args.get('order[0][column]', type=int)
+    if sort_index is None:
+        sort_index = args.get('sort', type=int)
+    direction = args.get('order[0][dir]', args.get('direction', 'asc'))
+    team_name = args.get('search[value]', args.get('team'))
+    n_rows, n_filtered_rows, data = get_leaderboard_page(
+        event.name, leaderboard_type, start=max(start, 0), length=length,
+        sort_index=sort_index, ascending=direction != 'desc',
+        team_name=team_name, **kwargs)
+    return jsonify(draw=args.get('draw', 0, type=int),
+                   recordsTotal=n_rows,
+                   recordsFiltered=n_filtered_rows,
+                   data=data)
+
+
+@app.route("/events/<event_name>/api/leaderboard")
+@fl.login_required
+def api_leaderboard(event_name):
+    event = Event.query.filter_by(name=event_name).one_or_none()
+    if not is_public_event(event, fl.current_user):
+        abort(404)
+    return _leaderboard_page_json(
+        event, 'public',
+        is_link=is_open_leaderboard(event, fl.current_user))
+
+
+@app.route("/events/<event_name>/api/private_leaderboard")
+@fl.login_required
+def api_private_leaderboard(event_name):
+    event = Event.query.filter_by(name=event_name).one_or_none()
+    if not is_public_event(event, fl.current_user):
+        abort(404)
+    if not _is_private_leaderboard_open(event, fl.current_user):
+        abort(403)
+    return _leaderboard_page_json(event, 'private')
+
+
+@app.route("/events/<event_name>/api/competition_leaderboard")
+@fl.login_required
+def api_competition_leaderboard(event_name):
+    event = Event.query.filter_by(name=event_name).one_or_none()
+    if not is_public_event(event, fl.current_user):
+        abort(404)
+    return _leaderboard_page_json(event, 'competition')
+
+
+@app.route("/events/<event_name>/api/private_competition_leaderboard")
+@fl.login_required
+def api_private_competition_leaderboard(event_name):
+    event = Event.query.filter_by(name=event_name).one_or_none()
+    if not is_public_event(event, fl.current_user):
+        abort(404)
+    if not _is_private_leaderboard_open(event, fl.current_user):
+        abort(403)
+    return _leaderboard_page_json(event, 'private_competition')
+
+
+@app.route("/events/<event_name>/api/my_submissions")
+@fl.login_required
+def api_my_submissions(event_name):
+    event = Event.query.filter_by(name=event_name).one_or_none()
+    if not is_public_event(event, fl.current_user):
+        abort(404)
+    if not is_open_code(event, fl.current_user):
+        abort(403)
+    return _leaderboard_page_json(
+        event, 'user', user_name=fl.current_user.name)
+
+
 @app.route("/<submission_hash>/<f_name>", methods=['GET', 'POST'])
 @fl.login_required
 def view_model(submission_hash, f_name):
@@ -722,7 +811,7 @@ def toggle_competition(submission_hash):
         return _redirect_to_user(error_str)
     submission.is_in_competition = not submission.is_in_competition
     db.session.commit()
-    update_leaderboards(submission.event_team.event.name)
+    update_leaderboards(submission.event_team.event.name, [submission.id])
     return redirect(
         u'/{}/{}'.format(submission_hash, submission.files[0].f_name))
 
@@ -1039,22 +1128,16 @@ def private_leaderboard(event_name):
     add_user_interaction(
         interaction='looking at private leaderboard',
         user=fl.current_user, event=event)
-    leaderboard_html = event.private_leaderboard_html
     admin = check_admin(fl.current_user, event)
-    if event.official_score_type.is_lower_the_better:
-        sorting_direction = 'asc'
-    else:
-        sorting_direction = 'desc'
 
     template = render_template(
         'leaderboard.html',
         leaderboard_title='Leaderboard',
-        leaderboard=leaderboard_html,
-        sorting_column_index=5,
-        sorting_direction=sorting_direction,
         event=event,
         private=True,
-        admin=admin
+        admin=admin,
+        **_get_leaderboard_kwargs(
+            event, 'private', 'api_private_leaderboard')
     )
 
     # logger.info(u'private leaderboard takes {}ms'.format(
@@ -1082,15 +1165,14 @@ def private_competition_leaderboard(event_name):
         user=fl.current_user, event=event)
 
     admin = check_admin(fl.current_user, event)
-    leaderboard_html = event.private_competition_leaderboard_html
 
     leaderboard_kwargs = dict(
-        leaderboard=leaderboard_html,
         leaderboard_title='Leaderboard',
-        sorting_column_index=0,
-        sorting_direction='asc',
         event=event,
-        admin=admin
+        admin=admin,
+        **_get_leaderboard_kwargs(
+            event, 'private_competition',
+            'api_private_competition_leaderboard')
     )
 
     return render_template('leaderboard.html', **leaderboard_kwargs)
@@ -134,12 +134,14 @@ def set_n_submissions(e=None):
     set_n_submissions(e)
 
 
-def compute_contributivity(e, is_save_y_pred='False'):
+def compute_contributivity(e, is_save_y_pred='False', full_recompute='False'):
     is_save_y_pred = strtobool(is_save_y_pred)
+    full_recompute = strtobool(full_recompute)
 
     from databoard.db_tools import compute_contributivity
     from databoard.db_tools import compute_historical_contributivity
-    compute_contributivity(e, is_save_y_pred=is_save_y_pred)
+    compute_contributivity(e, is_save_y_pred=is_save_y_pred,
+                           full_recompute=full_recompute)
     compute_historical_contributivity(e)
     set_n_submissions(e)
 
@@ -293,6 +295,26 @@ def backend_train_test_loop(e=None, timeout=30,
         e, timeout, is_compute_contributivity, is_parallelize)
 
 
+def backend_contributivity_loop(e=None, timeout=30, min_interval=5 * 60,
+                                quiet_period=60, max_delay=30 * 60):
+    """Automated contributivity loop.
+
+    Computes the contributivity of the events with newly scored submissions,
+    in an infinite loop, next to backend_train_test_loop with
+    is_compute_contributivity=False.
+
+    Parameters
+    ----------
+    e : string
+        Event name. If set, only watch that event.
+        If event name is prefixed by not, it excludes that event.
+    """
+    from databoard.db_tools import backend_contributivity_loop
+    backend_contributivity_loop(
+        e, int(timeout), int(min_interval), int(quiet_period),
+        int(max_delay))
+
+
 def set_state(e, t, s, state):
     from databoard.db_tools import set_state
     set_state(e, t, s, state)
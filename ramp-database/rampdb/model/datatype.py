@@ -1,20 +1,323 @@
+import os
 import zlib
+import struct
+import hashlib
+import tempfile
 import numpy as np
 import pickle
 
 from sqlalchemy import LargeBinary
 from sqlalchemy import TypeDecorator
 
+try:
+    import lz4.frame
+except ImportError:  # lz4 is an optional dependency
+    lz4 = None
+
 __all__ = ['NumpyType']
 
+# Binary layout of an array:
+#   magic (4 bytes) | version (uint8) | codec (uint8) | dtype length (uint8)
+#   | dtype str | ndim (uint8) | shape (ndim * int64) | encoded data
+# The data is the raw C-contiguous buffer of the array, possibly compressed,
+# or the content hash of the array when it is kept in the prediction store.
+# Sorted index arrays can be encoded compactly as a range (start, stop, step)
+# or as a packed boolean mask.
+# Blobs which do not start with the magic are legacy zlib-compressed pickles.
+MAGIC = b'RNPY'
+VERSION = 1
+_HEADER = struct.Struct('<4sBBB')
+_NDIM = struct.Struct('<B')
+
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_LZ4 = 2
+CODEC_STORE = 3
+CODEC_RANGE = 4
+CODEC_MASK = 5
+_RANGE = struct.Struct('<3q')
+_MASK_LENGTH = struct.Struct('<q')
+CODECS = {
+    'none': CODEC_NONE,
+    'zlib': CODEC_ZLIB,
+    'lz4': CODEC_LZ4,
+}
+
+DEFAULT_CODEC = os.getenv('RAMP_NUMPY_CODEC', 'zlib')
+DEFAULT_LEVEL = int(os.getenv('RAMP_NUMPY_COMPRESSION_LEVEL', 6))
+
+
+def _get_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+# mode of the files of the prediction store: mkstemp creates files readable
+# by their owner only, while the store is shared by the web server and the
+# workers, which can run under other users
+STORE_FILE_MODE = 0o666 & ~_get_umask()
+
+
+def get_prediction_store_path():
+    """Directory of the prediction store, None when it is disabled."""
+    return os.getenv('RAMP_PREDICTION_STORE')
+
+
+def _store_file(store_path, digest):
+    return os.path.join(store_path, digest[:2], digest + '.npy')
+
+
+def _store_array(array, store_path):
+    """Write an array once in the store and return its content hash."""
+    sha1 = hashlib.sha1(array.dtype.str.encode('ascii'))
+    sha1.update(str(array.shape).encode('ascii'))
+    sha1.update(array.data if array.size else b'')
+    digest = sha1.hexdigest()
+    filename = _store_file(store_path, digest)
+    try:
+        # the array is already there: refresh its modification time, so that
+        # remove_stored_array keeps it until the row referring to it is
+        # committed
+        os.utime(filename, None)
+    except OSError:
+        dirname = os.path.dirname(filename)
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:  # created concurrently
+                pass
+        # write in a temporary file first so that readers never see a
+        # partially written array
+        fd, tmp_filename = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, array)
+        os.chmod(tmp_filename, STORE_FILE_MODE)
+        os.rename(tmp_filename, filename)
+    return digest
+
+
+def get_stored_digest(blob):
+    """Content hash of an array kept in the prediction store.
+
+    Returns None when the blob holds the array itself.
+    """
+    if blob is None or is_legacy(blob):
+        return None
+    blob = memoryview(blob)
+    _, _, codec_id, dtype_len = _HEADER.unpack_from(blob)
+    if codec_id != CODEC_STORE:
+        return None
+    offset = _HEADER.size + dtype_len
+    ndim, = _NDIM.unpack_from(blob, offset)
+    offset += _NDIM.size + 8 * ndim
+    return bytes(blob[offset:]).decode('ascii')
+
+
+def remove_stored_array(store_path, digest, before=None):
+    """Remove an array from the store, if it is still there.
+
+    If ``before`` is given, an array written or reused after this time is
+    kept. Returns whether the array was removed.
+    """
+    filename = _store_file(store_path, digest)
+    try:
+        if before is not None and os.path.getmtime(filename) >= before:
+            return False
+        os.remove(filename)
+    except OSError:
+        return False
+    return True
+
+
+def is_legacy(blob):
+    """Whether a stored blob is a zlib-compressed pickle."""
+    return bytes(blob[:len(MAGIC)]) != MAGIC
+
+
+def _compact_index(array):
+    """Encode a sorted array of unique indices as a range or a bit mask.
+
+    Returns None when the array is not such an array or when the compact
+    encoding would not be smaller than the raw buffer.
+    """
+    if (array.ndim != 1 or array.dtype.kind not in 'iu' or
+            array.size < 2 or array[0] < 0):
+        return None
+    steps = np.diff(array)
+    if steps[0] > 0 and np.all(steps == steps[0]):
+        return CODEC_RANGE, _RANGE.pack(
+            int(array[0]), int(array[-1]) + 1, int(steps[0]))
+    if np.all(steps > 0):
+        length = int(array[-1]) + 1
+        if length // 8 < array.nbytes:
+            mask = np.zeros(length, dtype=bool)
+            mask[array] = True
+            return CODEC_MASK, (_MASK_LENGTH.pack(length) +
+                                np.packbits(mask).tobytes())
+    return None
+
+
+def dumps_array(value, codec=DEFAULT_CODEC, level=DEFAULT_LEVEL,
+                store_path=None, compact=False):
+    """Encode an array into the RAMP binary layout.
+
+    Parameters
+    ----------
+    value : array-like or None
+        The value to encode. It is converted with ``np.asarray`` to handle
+        None and lists.
+    codec : {'none', 'zlib', 'lz4'}, default is 'zlib'
+        The codec used to compress the data. If 'lz4' is not installed, zlib
+        is used instead.
+    level : int, default is 6
+        The compression level of the codec.
+    store_path : str or None, default is None
+        If given, the array is written as a ``.npy`` file in this directory
+        and only its content hash is encoded.
+    compact : bool, default is False
+        Whether sorted arrays of unique indices are encoded as a range or
+        as a packed boolean mask when it is smaller.
+
+    Returns
+    -------
+    blob : bytes
+        The encoded array. Arrays which cannot be represented by a raw buffer
+        (e.g. of object dtype) are stored in the legacy pickled format.
+    """
+    array = np.asarray(value, order='C')
+    dtype = array.dtype
+    if dtype.hasobject or dtype.fields is not None:
+        return zlib.compress(array.dumps())
+
+    codec_id = CODECS[codec]
+    if codec_id == CODEC_LZ4 and lz4 is None:
+        codec_id = CODEC_ZLIB
+    compact_index = _compact_index(array) if compact else None
+    if compact_index is not None:
+        codec_id, data = compact_index
+    elif store_path is not None:
+        codec_id = CODEC_STORE
+        data = _store_array(array, store_path).encode('ascii')
+    else:
+        data = array.tobytes()
+    if codec_id == CODEC_ZLIB:
+        data = zlib.compress(data, level)
+    elif codec_id == CODEC_LZ4:
+        data = lz4.frame.compress(data, compression_level=level)
+
+    dtype_str = dtype.str.encode('ascii')
+    return b''.join([
+        _HEADER.pack(MAGIC, VERSION, codec_id, len(dtype_str)),
+        dtype_str,
+        _NDIM.pack(array.ndim),
+        struct.pack('<{}q'.format(array.ndim), *array.shape),
+        data
+    ])
+
+
+def loads_array(blob):
+    """Decode an array stored by :func:`dumps_array`.
+
+    Parameters
+    ----------
+    blob : bytes or memoryview
+        The stored value.
+
+    Returns
+    -------
+    array : ndarray
+        The decoded array. It is writable, as the arrays of the legacy
+        pickled format, except for the arrays kept in the prediction store
+        which are read-only memory maps of their ``.npy`` file.
+    """
+    if is_legacy(blob):
+        return pickle.loads(zlib.decompress(blob))
+
+    blob = memoryview(blob)
+    _, version, codec_id, dtype_len = _HEADER.unpack_from(blob)
+    if version != VERSION:
+        raise ValueError(
+            'Unknown version {} of the array layout'.format(version))
+    offset = _HEADER.size
+    dtype = np.dtype(bytes(blob[offset:offset + dtype_len]).decode('ascii'))
+    offset += dtype_len
+    ndim, = _NDIM.unpack_from(blob, offset)
+    offset += _NDIM.size
+    shape = struct.unpack_from('<{}q'.format(ndim), blob, offset)
+    offset += 8 * ndim
+
+    data = blob[offset:]
+    if codec_id == CODEC_ZLIB:
+        data = zlib.decompress(data)
+    elif codec_id == CODEC_LZ4:
+        if lz4 is None:
+            raise ImportError('lz4 is required to read this array')
+        data = lz4.frame.decompress(data)
+    elif codec_id == CODEC_STORE:
+        store_path = get_prediction_store_path()
+        if store_path is None:
+            raise ValueError('The array is kept in the prediction store: '
+                             'set RAMP_PREDICTION_STORE to read it')
+        digest = bytes(data).decode('ascii')
+        return np.load(_store_file(store_path, digest), mmap_mode='r')
+    elif codec_id == CODEC_RANGE:
+        return np.arange(*_RANGE.unpack_from(data), dtype=dtype)
+    elif codec_id == CODEC_MASK:
+        length, = _MASK_LENGTH.unpack_from(data)
+        mask = np.unpackbits(np.frombuffer(
+            data[_MASK_LENGTH.size:], dtype=np.uint8))[:length]
+        return np.flatnonzero(mask).astype(dtype)
+    elif codec_id != CODEC_NONE:
+        raise ValueError('Unknown codec {}'.format(codec_id))
+    # the buffer is read-only, and callers may modify the array in place
+    return np.frombuffer(data, dtype=dtype).reshape(shape).copy()
+
 
 class NumpyType(TypeDecorator):
-    """Storing zipped numpy arrays."""
+    """Storing numpy arrays.
+
+    Arrays are stored as a small dtype/shape header followed by the raw
+    array buffer, compressed with ``codec``. Rows written in the legacy
+    pickled format are still read.
+
+    Parameters
+    ----------
+    codec : {'none', 'zlib', 'lz4'}, default is 'zlib'
+        The codec used to compress the stored arrays. The default can be set
+        with the ``RAMP_NUMPY_CODEC`` environment variable.
+    level : int, default is 6
+        The compression level of the codec. The default can be set with the
+        ``RAMP_NUMPY_COMPRESSION_LEVEL`` environment variable.
+    external : bool, default is False
+        Whether the arrays are written in the prediction store, when the
+        ``RAMP_PREDICTION_STORE`` environment variable points to it, the
+        database only keeping their content hash. These arrays are read
+        back as read-only memory maps.
+    compact : bool, default is False
+        Whether sorted arrays of unique indices, such as fold indices, are
+        stored as a range or as a packed boolean mask.
+    """
     impl = LargeBinary
 
+    def __init__(self, codec=DEFAULT_CODEC, level=DEFAULT_LEVEL,
+                 external=False, compact=False, *args, **kwargs):
+        if codec not in CODECS:
+            raise ValueError('Unknown codec {}. Choose among {}.'.format(
+                codec, sorted(CODECS)))
+        super(NumpyType, self).__init__(*args, **kwargs)
+        self.codec = codec
+        self.level = level
+        self.external = external
+        self.compact = compact
+
     def process_bind_param(self, value, dialect):
         # we convert the initial value into np.array to handle None and lists
-        return zlib.compress(np.array(value).dumps())
+        store_path = get_prediction_store_path() if self.external else None
+        return dumps_array(value, codec=self.codec, level=self.level,
+                           store_path=store_path, compact=self.compact)
 
     def process_result_value(self, value, dialect):
-        return pickle.loads(zlib.decompress(value))
+        if value is None:
+            return None
+        return loads_array(value)
@@ -1,6 +1,10 @@
 import uuid
 import datetime
+import threading
 
+import numpy as np
+
+from sqlalchemy import Index
 from sqlalchemy import Float
 from sqlalchemy import Column
 from sqlalchemy import String
@@ -10,9 +14,11 @@ from sqlalchemy import DateTime
 from sqlalchemy import ForeignKey
 from sqlalchemy import UniqueConstraint
 from sqlalchemy.orm import backref
+from sqlalchemy.orm import deferred
 from sqlalchemy.orm import relationship
 
 from .base import Model
+from .datatype import NumpyType
 from .problem import Problem
 from .score import ScoreType
 
@@ -20,6 +26,7 @@ __all__ = [
     'Event',
     'EventTeam',
     'EventAdmin',
+    'EventEnsemble',
     'EventScoreType',
 ]
 
@@ -39,6 +46,16 @@ class Event(Model):
     max_members_per_team = Column(Integer, default=1)
     # max number of submissions in Caruana's ensemble
     max_n_ensemble = Column(Integer, default=80)
+    # max number of candidate submissions of Caruana's ensemble, the best
+    # ones on the official score. All the submissions are candidates if None.
+    max_n_ensemble_candidates = Column(Integer, default=None)
+    # candidates whose valid predictions are all within this tolerance of
+    # the ones of a better candidate are ignored. No deduplication if None.
+    ensemble_duplicate_tolerance = Column(Float, default=None)
+    # wall-clock budget of the ensemble selection in seconds, split between
+    # the folds, after which the best ensembles found so far are kept. No
+    # limit if None.
+    max_ensemble_time = Column(Float, default=None)
     is_send_trained_mails = Column(Boolean, default=True)
     is_send_submitted_mails = Column(Boolean, default=True)
     is_public = Column(Boolean, default=False)
@@ -185,23 +202,35 @@ class EventScoreType(Model):
     # default is the same as score_type.precision
     precision = Column(Integer)
 
+    # copied from the score type of the kit when the event is set up, so
+    # that comparing and resetting scores does not need to load the kit.
+    # They are NULL for the event score types set up before they were
+    # added, in which case the score type of the kit is used.
+    _is_lower_the_better = Column('is_lower_the_better', Boolean)
+    _minimum = Column('minimum', Float)
+    _maximum = Column('maximum', Float)
+
     UniqueConstraint(event_id, score_type_id, name='es_constraint')
     UniqueConstraint(event_id, name, name='en_constraint')
 
+    # (problem name, score name) -> (problem module, score type object)
+    _registry = {}
+    _registry_lock = threading.Lock()
+
     def __init__(self, event, score_type_object):
         self.event = event
-        # XXX
-        self.score_type = ScoreType(str(uuid.uuid4()), True, 0, 1)
-        # XXX after migration we should store the index of the
-        # score_type so self.score_type_object (should be renamed
-        # score_type) wouldn't have to do a search each time.
+        # XXX the score types are defined in problem.py, the ScoreType row
+        # is only kept for the foreign key.
+        self.score_type = ScoreType(
+            str(uuid.uuid4()), score_type_object.is_lower_the_better,
+            score_type_object.minimum, score_type_object.maximum)
         self.name = score_type_object.name
         self.precision = score_type_object.precision
+        self._is_lower_the_better = score_type_object.is_lower_the_better
+        self._minimum = score_type_object.minimum
+        self._maximum = score_type_object.maximum
         self.score_type_object
         self.score_function
-        self.is_lower_the_better
-        self.minimum
-        self.maximum
         self.worst
 
     def __repr__(self):
@@ -210,9 +239,17 @@ class EventScoreType(Model):
 
     @property
     def score_type_object(self):
-        score_types = self.event.problem.module.score_types
-        for score_type in score_types:
+        problem = self.event.problem
+        module = problem.module
+        key = (problem.name, self.name)
+        entry = self._registry.get(key)
+        # the module is reloaded when the kit is modified
+        if entry is not None and entry[0] is module:
+            return entry[1]
+        for score_type in module.score_types:
             if score_type.name == self.name:
+                with self._registry_lock:
+                    self._registry[key] = (module, score_type)
                 return score_type
 
     @property
@@ -221,19 +258,162 @@ class EventScoreType(Model):
 
     @property
     def is_lower_the_better(self):
-        return self.score_type_object.is_lower_the_better
+        if self._is_lower_the_better is None:
+            return self.score_type_object.is_lower_the_better
+        return self._is_lower_the_better
 
     @property
     def minimum(self):
-        return self.score_type_object.minimum
+        if self._minimum is None:
+            return self.score_type_object.minimum
+        return self._minimum
 
     @property
     def maximum(self):
-        return self.score_type_object.maximum
+        if self._maximum is None:
+            return self.score_type_object.maximum
+        return self._maximum
 
     @property
     def worst(self):
-        return self.score_type_object.worst
+        if self.is_lower_the_better:
+            return self.maximum
+        return self.minimum
+
+
+class EventEnsemble(Model):
+    """Predictions of the ensemble of the submissions of an event.
+
+    A new version is stored each time the contributivity is computed, and
+    only the last versions are kept. The blended predictions can then be
+    served or re-scored with any score type of the event without running
+    the ensemble selection again.
+    """
+
+    __tablename__ = 'event_ensembles'
+
+    id = Column(Integer, primary_key=True)
+
+    event_id = Column(
+        Integer, ForeignKey('events.id'), nullable=False)
+    event = relationship('Event', backref=backref(
+        'ensembles', cascade='all, delete-orphan',
+        order_by='EventEnsemble.version'))
+
+    version = Column(Integer, nullable=False)
+    timestamp = Column(DateTime, default=datetime.datetime.utcnow)
+
+    # ids of the submissions of the ensemble of each fold, with repetitions:
+    # the ensemble of the fold cv_fold_ids[i] has ensemble_sizes[i] elements
+    cv_fold_ids = Column(NumpyType)
+    ensemble_sizes = Column(NumpyType)
+    ensemble_submission_ids = Column(NumpyType)
+
+    # combination of the foldwise ensembles (combined) and of the foldwise
+    # best submissions (foldwise), on the train data for valid and on the
+    # test data for test. Only loaded on access or with
+    # undefer_group('predictions').
+    combined_valid_y_pred = deferred(
+        Column(NumpyType(external=True)), group='predictions')
+    combined_test_y_pred = deferred(
+        Column(NumpyType(external=True)), group='predictions')
+    foldwise_valid_y_pred = deferred(
+        Column(NumpyType(external=True)), group='predictions')
+    foldwise_test_y_pred = deferred(
+        Column(NumpyType(external=True)), group='predictions')
+
+    UniqueConstraint(event_id, version, name='ee_constraint')
+
+    # the prediction store looks up the rows holding an array by their value
+    __table_args__ = (
+        Index('ix_event_ensembles_combined_valid_y_pred',
+              'combined_valid_y_pred', postgresql_using='hash'),
+        Index('ix_event_ensembles_combined_test_y_pred',
+              'combined_test_y_pred', postgresql_using='hash'),
+        Index('ix_event_ensembles_foldwise_valid_y_pred',
+              'foldwise_valid_y_pred', postgresql_using='hash'),
+        Index('ix_event_ensembles_foldwise_test_y_pred',
+              'foldwise_test_y_pred', postgresql_using='hash'),
+    )
+
+    def __repr__(self):
+        repr = 'EventEnsemble({}, version={})'.format(
+            self.event, self.version)
+        return repr
+
+    @property
+    def fold_ensembles(self):
+        """dict: cv fold id -> submission ids of the ensemble of the fold"""
+        ensembles = np.split(self.ensemble_submission_ids,
+                             np.cumsum(self.ensemble_sizes)[:-1])
+        return dict(zip(self.cv_fold_ids.tolist(), ensembles))
+
+    def _get_predictions(self, y_pred):
+        if y_pred is None:
+            return None
+        return self.event.Predictions(y_pred=y_pred)
+
+    @property
+    def combined_valid_predictions(self):
+        return self._get_predictions(self.combined_valid_y_pred)
+
+    @property
+    def combined_test_predictions(self):
+        return self._get_predictions(self.combined_test_y_pred)
+
+    @property
+    def foldwise_valid_predictions(self):
+        return self._get_predictions(self.foldwise_valid_y_pred)
+
+    @property
+    def foldwise_test_predictions(self):
+        return self._get_predictions(self.foldwise_test_y_pred)
+
+    def compute_scores(self, score_types=None):
+        """Score the stored predictions.
+
+        The valid predictions are scored on the points predicted by at
+        least one fold, as the combined valid scores of the event.
+
+        Parameters
+        ----------
+        score_types : list of EventScoreType or None, default is None
+            The score types to compute. All the score types of the event if
+            None.
+
+        Returns
+        -------
+        scores : dict
+            Maps the name of each score type to a dict of the
+            'combined_valid', 'foldwise_valid', 'combined_test' and
+            'foldwise_test' scores, None for the missing predictions.
+        """
+        if score_types is None:
+            score_types = self.event.score_types
+        problem = self.event.problem
+        ground_truths = {'valid': problem.ground_truths_train(),
+                         'test': problem.ground_truths_test()}
+        predictions = {
+            'combined_valid': self.combined_valid_predictions,
+            'foldwise_valid': self.foldwise_valid_predictions,
+            'combined_test': self.combined_test_predictions,
+            'foldwise_test': self.foldwise_test_predictions,
+        }
+        scores = {}
+        for score_type in score_types:
+            scores[score_type.name] = {}
+            for key, prediction in predictions.items():
+                if prediction is None:
+                    score = None
+                elif key.endswith('valid'):
+                    score = float(score_type.score_function(
+                        ground_truths['valid'], prediction,
+                        prediction.valid_indexes))
+                else:
+                    score = float(score_type.score_function(
+                        ground_truths['test'], prediction))
+                scores[score_type.name][key] = score
+        return scores
 
 
 class EventAdmin(Model):
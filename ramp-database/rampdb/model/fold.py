@@ -1,8 +1,14 @@
+import threading
+
 from sqlalchemy import Enum
+from sqlalchemy import Float
 from sqlalchemy import Column
 from sqlalchemy import Integer
 from sqlalchemy import ForeignKey
+from sqlalchemy import event
 from sqlalchemy.orm import backref
+from sqlalchemy.orm import deferred
+from sqlalchemy.orm import object_session
 from sqlalchemy.orm import relationship
 
 from .base import Model
@@ -19,7 +25,9 @@ cv_fold_types = Enum('live', 'test', name='cv_fold_types')
 class CVFold(Model):
     """Storing train and test folds, more precisely: train and test indices.
 
-    Created when the ramp event is set up.
+    Created when the ramp event is set up. The folds are immutable once
+    stored: their indices are decoded once per process and kept in a cache
+    keyed by the database and the fold id.
     """
 
     __tablename__ = 'cv_folds'
@@ -27,14 +35,98 @@ class CVFold(Model):
     id = Column(Integer, primary_key=True)
     type = Column(cv_fold_types, default='live')
 
-    train_is = Column(NumpyType, nullable=False)
-    test_is = Column(NumpyType, nullable=False)
+    _train_is = deferred(
+        Column('train_is', NumpyType(compact=True), nullable=False),
+        group='folds')
+    _test_is = deferred(
+        Column('test_is', NumpyType(compact=True), nullable=False),
+        group='folds')
 
     event_id = Column(
         Integer, ForeignKey('events.id'), nullable=False)
     event = relationship('Event', backref=backref(
         'cv_folds', cascade='all, delete-orphan'))
 
+    # state of the greedy ensemble selection of the last contributivity
+    # computation, to resume it when new submissions are scored: ids of the
+    # selected submission_on_cv_folds, with repetitions, and the valid score
+    # of their combination
+    ensemble_ids = Column(NumpyType)
+    ensemble_score = Column(Float)
+
+    # (database url, cv_fold.id, 'train_is' or 'test_is') -> read-only
+    # index array
+    _cache = {}
+    _cache_lock = threading.Lock()
+
+    def _cache_key(self, name):
+        """Key of the indices in the cache, None if it cannot be cached."""
+        # the database is looked up once per instance, the indices being
+        # accessed in the loops of the scoring and of the ensembling, and
+        # remembered for the accesses once the instance is detached
+        database = getattr(self, '_database', None)
+        if database is None:
+            session = object_session(self)
+            if session is None:
+                return None
+            database = self._database = str(session.get_bind().url)
+        if self.id is None:
+            # not flushed yet
+            return None
+        return database, self.id, name
+
+    def _get_indices(self, name):
+        key = self._cache_key(name)
+        if key is None:
+            return getattr(self, '_' + name)
+        indices = self._cache.get(key)
+        if indices is None:
+            indices = getattr(self, '_' + name)
+            indices.flags.writeable = False
+            with self._cache_lock:
+                self._cache[key] = indices
+        return indices
+
+    def _set_indices(self, name, indices):
+        setattr(self, '_' + name, indices)
+        key = self._cache_key(name)
+        if key is not None:
+            with self._cache_lock:
+                self._cache.pop(key, None)
+
+    @property
+    def train_is(self):
+        return self._get_indices('train_is')
+
+    @train_is.setter
+    def train_is(self, train_is):
+        self._set_indices('train_is', train_is)
+
+    @property
+    def test_is(self):
+        return self._get_indices('test_is')
+
+    @test_is.setter
+    def test_is(self, test_is):
+        self._set_indices('test_is', test_is)
+
+    @classmethod
+    def clear_cache(cls, cv_fold_id=None):
+        """Clear the cached indices of one or all the folds.
+
+        Parameters
+        ----------
+        cv_fold_id : int or None, default is None
+            The id of the fold to forget. All the folds are forgotten if None.
+        """
+        with cls._cache_lock:
+            if cv_fold_id is None:
+                cls._cache.clear()
+            else:
+                for key in [key for key in cls._cache
+                            if key[1] == cv_fold_id]:
+                    del cls._cache[key]
+
     @staticmethod
     def _pretty_printing(array):
         if array.size > 10:
@@ -47,3 +139,15 @@ class CVFold(Model):
         train_repr = self._pretty_printing(self.train_is)
         test_repr = self._pretty_printing(self.test_is)
         return 'train ' + train_repr + '\n' + ' test ' + test_repr
+
+
+# fold ids are reused when the tables are dropped and recreated, e.g. between
+# tests, and when rows are deleted
+@event.listens_for(CVFold, 'after_delete')
+def _clear_deleted_fold(mapper, connection, target):
+    CVFold.clear_cache(target.id)
+
+
+@event.listens_for(Model.metadata, 'after_drop')
+def _clear_dropped_folds(target, connection, **kw):
+    CVFold.clear_cache()
@@ -0,0 +1,88 @@
+from sqlalchemy import Float
+from sqlalchemy import Column
+from sqlalchemy import String
+from sqlalchemy import Integer
+from sqlalchemy import Boolean
+from sqlalchemy import DateTime
+from sqlalchemy import ForeignKey
+from sqlalchemy import Index
+from sqlalchemy.orm import backref
+from sqlalchemy.orm import relationship
+
+from .base import Model
+from .datatype import NumpyType
+
+__all__ = [
+    'LeaderboardRow',
+]
+
+
+class LeaderboardRow(Model):
+    """Display fields of a submission on the leaderboards of its event.
+
+    One row per submission, refreshed only when the state, the scores or the
+    flags of the submission change, so that the leaderboards are rendered
+    without loading the submissions, their scores and their files.
+    """
+
+    __tablename__ = 'leaderboard_rows'
+
+    id = Column(Integer, primary_key=True)
+
+    submission_id = Column(
+        Integer, ForeignKey('submissions.id'), nullable=False, unique=True)
+    submission = relationship('Submission', backref=backref(
+        'leaderboard_row', uselist=False, cascade='all, delete-orphan'))
+
+    event_id = Column(
+        Integer, ForeignKey('events.id'), nullable=False, index=True)
+    event = relationship('Event', backref=backref(
+        'leaderboard_rows', cascade='all, delete-orphan'))
+
+    event_team_id = Column(
+        Integer, ForeignKey('event_teams.id'), nullable=False)
+
+    team_name = Column(String)
+    submission_name = Column(String)
+    name_with_link = Column(String)
+    state = Column(String)
+    state_with_link = Column(String)
+    # to the second, as shown on the leaderboards, so that the submissions of
+    # the same second are ranked by id
+    submission_timestamp = Column(DateTime)
+
+    # which leaderboards the submission is listed on
+    is_public_leaderboard = Column(Boolean)
+    is_private_leaderboard = Column(Boolean)
+    is_in_competition = Column(Boolean)
+    is_error = Column(Boolean)
+    is_new = Column(Boolean)
+
+    # scores rounded to the precision of the event score types, ordered by
+    # event score type id, in columns: valid bag, mean and std then test bag,
+    # mean and std. None when the submission is not on the leaderboards.
+    scores = Column(NumpyType)
+    # rounded official scores, to rank the submissions
+    official_valid_score = Column(Float)
+    official_test_score = Column(Float)
+
+    # percentages and rounded times in seconds
+    contributivity = Column(Integer)
+    historical_contributivity = Column(Integer)
+    train_time = Column(Integer)
+    train_time_std = Column(Integer)
+    valid_time = Column(Integer)
+    valid_time_std = Column(Integer)
+    max_ram = Column(Integer)
+
+    # the leaderboards are paged sorted by official score or filtered by team
+    Index('ix_leaderboard_rows_event_id_official_valid_score',
+          event_id, official_valid_score)
+    Index('ix_leaderboard_rows_event_id_official_test_score',
+          event_id, official_test_score)
+    Index('ix_leaderboard_rows_event_id_team_name', event_id, team_name)
+
+    def __repr__(self):
+        repr = 'LeaderboardRow({}/{})'.format(
+            self.team_name, self.submission_name)
+        return repr
@@ -1,4 +1,6 @@
 import os
+import threading
+from collections import OrderedDict
 
 from sqlalchemy import Float
 from sqlalchemy import Column
@@ -21,6 +23,7 @@ RAMP_KITS_PATH = os.path.join(
     DEPLOYMENT_PATH, os.getenv('RAMP_KITS_DIR', 'ramp-kits'))
 RAMP_DATA_PATH = os.path.join(
     DEPLOYMENT_PATH, os.getenv('RAMP_DATA_DIR', 'ramp-data'))
+GROUND_TRUTH_CACHE_SIZE = int(os.getenv('RAMP_GROUND_TRUTH_CACHE_SIZE', 8))
 
 
 __all__ = [
@@ -31,6 +34,22 @@ __all__ = [
 ]
 
 
+def _data_signature(path):
+    """Latest modification time of a data directory and of its content.
+
+    The directory itself, its entries and the entries of its
+    sub-directories are inspected.
+    """
+    mtimes = []
+    for root in [path] + [os.path.join(path, name)
+                          for name in os.listdir(path)]:
+        mtimes.append(os.stat(root).st_mtime)
+        if os.path.isdir(root):
+            mtimes.extend(os.stat(os.path.join(root, name)).st_mtime
+                          for name in os.listdir(root))
+    return max(mtimes)
+
+
 class Problem(Model):
     __tablename__ = 'problems'
 
@@ -58,12 +77,13 @@ class Problem(Model):
         self.workflow = Workflow.query.filter_by(
             name=type(self.module.workflow).__name__).one()
 
+    @property
+    def module_path(self):
+        return os.path.join(RAMP_KITS_PATH, self.name, 'problem.py')
+
     @property
     def module(self):
-        return import_module_from_source(
-            os.path.join(RAMP_KITS_PATH, self.name, 'problem.py'),
-            'problem'
-        )
+        return import_module_from_source(self.module_path, 'problem')
 
     @property
     def title(self):
@@ -81,17 +101,58 @@ class Problem(Model):
         path = os.path.join(RAMP_DATA_PATH, self.name)
         return self.module.get_test_data(path=path)
 
+    # (problem name, 'train' or 'test') -> (data signature, y), least
+    # recently used first
+    _ground_truth_cache = OrderedDict()
+    _ground_truth_cache_lock = threading.Lock()
+
+    def get_targets(self, split):
+        """Get the targets of a split, read once as long as data is as is.
+
+        Parameters
+        ----------
+        split : {'train', 'test'}
+            The split of the data.
+
+        Returns
+        -------
+        y : array-like
+            The targets, shared with the other callers: they should not be
+            modified in place.
+        """
+        path = os.path.join(RAMP_DATA_PATH, self.name)
+        signature = _data_signature(path)
+        key = (self.name, split)
+        cache = self._ground_truth_cache
+        with self._ground_truth_cache_lock:
+            entry = cache.pop(key, None)
+            if entry is not None and entry[0] == signature:
+                cache[key] = entry
+                return entry[1]
+        if split == 'train':
+            _, y = self.get_train_data()
+        else:
+            _, y = self.get_test_data()
+        with self._ground_truth_cache_lock:
+            cache[key] = (signature, y)
+            while len(cache) > GROUND_TRUTH_CACHE_SIZE:
+                cache.popitem(last=False)
+        return y
+
+    @classmethod
+    def clear_ground_truth_cache(cls):
+        """Forget the targets read by the ground truth methods."""
+        with cls._ground_truth_cache_lock:
+            cls._ground_truth_cache.clear()
+
     def ground_truths_train(self):
-        _, y_train = self.get_train_data()
-        return self.Predictions(y_true=y_train)
+        return self.Predictions(y_true=self.get_targets('train'))
 
     def ground_truths_test(self):
-        _, y_test = self.get_test_data()
-        return self.Predictions(y_true=y_test)
+        return self.Predictions(y_true=self.get_targets('test'))
 
     def ground_truths_valid(self, test_is):
-        _, y_train = self.get_train_data()
-        return self.Predictions(y_true=y_train[test_is])
+        return self.Predictions(y_true=self.get_targets('train')[test_is])
 
     @property
     def workflow_object(self):
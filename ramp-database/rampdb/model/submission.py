@@ -4,6 +4,7 @@ import datetime
 
 import numpy as np
 from sqlalchemy import Enum
+from sqlalchemy import Index
 from sqlalchemy import Float
 from sqlalchemy import Column
 from sqlalchemy import String
@@ -14,6 +15,7 @@ from sqlalchemy import ForeignKey
 from sqlalchemy import UniqueConstraint
 from sqlalchemy import inspect
 from sqlalchemy.orm import backref
+from sqlalchemy.orm import deferred
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.hybrid import hybrid_property
 
@@ -344,9 +346,10 @@ class SubmissionScore(Model):
     valid_score_cv_bag = Column(Float)  # cv
     test_score_cv_bag = Column(Float)  # holdout
     # we store the partial scores so to see the saturation and
-    # overfitting as the number of cv folds grow
-    valid_score_cv_bags = Column(NumpyType)
-    test_score_cv_bags = Column(NumpyType)
+    # overfitting as the number of cv folds grow. They are only loaded on
+    # access or with undefer_group('cv_bags').
+    valid_score_cv_bags = deferred(Column(NumpyType), group='cv_bags')
+    test_score_cv_bags = deferred(Column(NumpyType), group='cv_bags')
 
     @property
     def score_name(self):
@@ -587,8 +590,13 @@ class SubmissionOnCVFold(Model):
 
     # prediction on the full training set, including train and valid points
     # properties train_predictions and valid_predictions will make the slicing
-    full_train_y_pred = Column(NumpyType, default=None)
-    test_y_pred = Column(NumpyType, default=None)
+    # The predictions are only loaded on access or with
+    # undefer_group('predictions') so that state and timing bookkeeping does
+    # not fetch them.
+    full_train_y_pred = deferred(
+        Column(NumpyType(external=True), default=None), group='predictions')
+    test_y_pred = deferred(
+        Column(NumpyType(external=True), default=None), group='predictions')
     train_time = Column(Float, default=0.0)
     valid_time = Column(Float, default=0.0)
     test_time = Column(Float, default=0.0)
@@ -597,6 +605,14 @@ class SubmissionOnCVFold(Model):
 
     UniqueConstraint(submission_id, cv_fold_id, name='sc_constraint')
 
+    # the prediction store looks up the rows holding an array by their value
+    __table_args__ = (
+        Index('ix_submission_on_cv_folds_full_train_y_pred',
+              'full_train_y_pred', postgresql_using='hash'),
+        Index('ix_submission_on_cv_folds_test_y_pred',
+              'test_y_pred', postgresql_using='hash'),
+    )
+
     def __init__(self, submission, cv_fold):
         self.submission = submission
         self.cv_fold = cv_fold
@@ -0,0 +1,40 @@
+from __future__ import print_function, absolute_import, unicode_literals
+
+import argparse
+
+from .tools import convert_numpy_columns
+from .config import read_database_config
+
+
+def init_parser():
+    """Defines command-line interface"""
+    parser = argparse.ArgumentParser(
+        prog=__file__,
+        description='Rewrite the numpy arrays stored in the legacy pickled '
+                    'format into the binary array format')
+
+    parser.add_argument('config', type=str,
+                        help='Backend configuration file with database '
+                             'connexion and RAMP event details.')
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help='Number of rows rewritten per transaction.')
+    parser.add_argument('--force', action='store_true', default=False,
+                        help='Also rewrite the rows already in the binary '
+                             'format, e.g. to change their codec.')
+
+    return parser
+
+
+def main():
+    parser = init_parser()
+    args = parser.parse_args()
+
+    config = read_database_config(args.config)
+    n_rows = convert_numpy_columns(
+        config, batch_size=args.batch_size, force=args.force)
+
+    print('{} rows rewritten'.format(n_rows))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+import datetime
+
+import numpy as np
+import pytest
+from numpy.testing import assert_array_equal
+
+from rampdb.config import UnknownStateError
+from rampdb.model import CVFold
+from rampdb.model import Submission
+from rampdb.model import SubmissionOnCVFold
+from rampdb.tools.api import get_submission_states
+from rampdb.tools.api import set_predictions
+from rampdb.tools.api import set_submission_states
+from rampdb.tools.api import transition_submission_states
+from rampdb.tools.database import dispose_engines
+from rampdb.tools.database import session_scope
+from rampdb.tools.database import setup_db
+
+
+@pytest.fixture
+def config(tmpdir):
+    config = {'drivername': 'sqlite',
+              'database': str(tmpdir.join('ramp.db'))}
+    setup_db(config)
+    with session_scope(config) as session:
+        session.execute(Submission.__table__.insert(), [
+            {'id': submission_id, 'event_team_id': 1,
+             'name': 'submission_{}'.format(submission_id),
+             'hash_': str(submission_id), 'state': 'new',
+             'submission_timestamp': datetime.datetime.utcnow()}
+            for submission_id in (1, 2, 3)])
+    try:
+        yield config
+    finally:
+        dispose_engines()
+
+
+def test_set_submission_states(config):
+    assert get_submission_states(config, []) == {}
+    set_submission_states(config, {1: 'sent_to_training', 3: 'training'})
+    assert get_submission_states(config, [1, 2, 3, 4]) == {
+        1: 'sent_to_training', 2: 'new', 3: 'training'}
+
+    with pytest.raises(UnknownStateError, match='unknown'):
+        set_submission_states(config, {1: 'unknown', 2: 'new'})
+    assert get_submission_states(config, [1])[1] == 'sent_to_training'
+
+
+def test_transition_submission_states(config):
+    transition_submission_states(config, {1: 'sent_to_training',
+                                          2: 'tested'})
+    with session_scope(config) as session:
+        submissions = {submission.id: submission
+                       for submission in session.query(Submission)}
+    assert submissions[1].sent_to_training_timestamp is not None
+    assert submissions[1].training_timestamp is None
+    assert submissions[2].sent_to_training_timestamp is None
+    assert submissions[2].training_timestamp is not None
+    assert submissions[3].state == 'new'
+
+
+@pytest.fixture(params=[[[0, 1], [2, 3]], [[0, 1], []]],
+                ids=['folds', 'empty_fold'])
+def config_cv_folds(config, request):
+    with session_scope(config) as session:
+        for test_is in request.param:
+            session.add(CVFold(
+                event_id=1, test_is=np.array(test_is, dtype=int),
+                train_is=np.setdiff1d(np.arange(4), test_is)))
+        session.flush()
+        session.execute(SubmissionOnCVFold.__table__.insert(), [
+            {'submission_id': 1, 'cv_fold_id': cv_fold_id, 'state': 'new'}
+            for cv_fold_id in (1, 2)])
+    return config
+
+
+def _check_predictions(config):
+    with session_scope(config) as session:
+        submission_on_cv_folds = (session.query(SubmissionOnCVFold)
+                                  .order_by(SubmissionOnCVFold.cv_fold_id)
+                                  .all())
+        for fold_id, cv_fold in enumerate(submission_on_cv_folds):
+            assert_array_equal(cv_fold.full_train_y_pred,
+                               np.arange(4) + fold_id)
+            assert_array_equal(cv_fold.test_y_pred, np.arange(2) - fold_id)
+            assert cv_fold.train_time == 1 + fold_id
+            assert cv_fold.state == 'tested'
+    assert get_submission_states(config, [1]) == {1: 'tested'}
+
+
+@pytest.mark.parametrize('ext', ['npy', 'npz', 'csv'])
+def test_set_predictions(config_cv_folds, tmpdir, ext):
+    for fold_id in range(2):
+        fold_dir = tmpdir.mkdir('fold_{}'.format(fold_id))
+        for typ, y_pred in [('train', np.arange(4) + fold_id),
+                            ('test', np.arange(2) - fold_id)]:
+            pred_file = str(fold_dir.join('y_pred_{}.{}'.format(typ, ext)))
+            if ext == 'npz':
+                np.savez(pred_file, y_pred=y_pred)
+            elif ext == 'npy':
+                np.save(pred_file, y_pred)
+            else:
+                np.savetxt(pred_file, y_pred, delimiter=',')
+        for i, typ in enumerate(['train', 'valid', 'test']):
+            fold_dir.join(typ + '_time').write(str(1 + fold_id + i))
+    set_predictions(config_cv_folds, 1, str(tmpdir), ext=ext)
+    _check_predictions(config_cv_folds)
+
+
+def test_set_predictions_bundle(config_cv_folds, tmpdir):
+    bundle = {}
+    for fold_id in range(2):
+        bundle['y_pred_train_{}'.format(fold_id)] = np.arange(4) + fold_id
+        bundle['y_pred_test_{}'.format(fold_id)] = np.arange(2) - fold_id
+        for i, typ in enumerate(['train', 'valid', 'test']):
+            bundle['{}_time_{}'.format(typ, fold_id)] = 1 + fold_id + i
+    bundle_file = str(tmpdir.join('predictions.npz'))
+    np.savez(bundle_file, **bundle)
+    set_predictions(config_cv_folds, 1, bundle_file)
+    _check_predictions(config_cv_folds)
+
+
+def test_set_predictions_error(config_cv_folds, tmpdir):
+    bundle = {}
+    for fold_id in range(2):
+        # the predictions should cover the 4 samples of the folds
+        bundle['y_pred_train_{}'.format(fold_id)] = np.arange(3)
+        bundle['y_pred_test_{}'.format(fold_id)] = np.arange(2)
+        for typ in ['train', 'valid', 'test']:
+            bundle['{}_time_{}'.format(typ, fold_id)] = 1
+    bundle_file = str(tmpdir.join('predictions.npz'))
+    np.savez(bundle_file, **bundle)
+    with pytest.raises(ValueError, match='fold 0 have 3 samples'):
+        set_predictions(config_cv_folds, 1, bundle_file)
+    # nothing was written
+    assert get_submission_states(config_cv_folds, [1]) == {1: 'new'}
+
+    with pytest.raises(NotImplementedError):
+        set_predictions(config_cv_folds, 1, str(tmpdir), ext='pkl')
@@ -0,0 +1,165 @@
+import numpy as np
+import pytest
+from numpy.testing import assert_array_equal
+from sqlalchemy.orm import undefer_group
+
+from sqlalchemy import LargeBinary
+from sqlalchemy import type_coerce
+
+from rampdb.model import CVFold
+from rampdb.model import EventEnsemble
+from rampdb.model import Model
+from rampdb.model import SubmissionOnCVFold
+from rampdb.model import Workflow
+from rampdb.tools.database import dispose_engines
+from rampdb.tools.database import get_engine
+from rampdb.tools.database import get_session_maker
+from rampdb.tools.database import remove_unreferenced_arrays
+from rampdb.tools.database import session_scope
+from rampdb.tools.database import setup_db
+
+
+@pytest.fixture
+def config(tmpdir):
+    try:
+        yield {'drivername': 'sqlite',
+               'database': str(tmpdir.join('ramp.db'))}
+    finally:
+        dispose_engines()
+
+
+def test_get_engine_is_cached(config):
+    engine = get_engine(config)
+    assert get_engine(dict(config)) is engine
+    assert get_session_maker(config) is get_session_maker(dict(config))
+    other_config = dict(config, database=config['database'] + '.other')
+    assert get_engine(other_config) is not engine
+
+
+def test_get_engine_pool_config(config):
+    engine = get_engine(dict(config, pool_recycle=3600))
+    assert engine.pool._recycle == 3600
+    assert engine is not get_engine(config)
+
+
+def test_session_scope(config):
+    setup_db(config)
+    with session_scope(config) as session:
+        session.add(Workflow('Classifier'))
+    with session_scope(config) as session:
+        workflow = session.query(Workflow).one()
+    # objects are still readable once the scope is closed
+    assert workflow.name == 'Classifier'
+
+    with pytest.raises(ValueError):
+        with session_scope(config) as session:
+            session.add(Workflow('Regressor'))
+            raise ValueError
+    with session_scope(config) as session:
+        assert session.query(Workflow).count() == 1
+
+
+def test_predictions_are_deferred(config):
+    setup_db(config)
+    with session_scope(config) as session:
+        session.execute(SubmissionOnCVFold.__table__.insert(), [
+            {'id': i, 'submission_id': i, 'cv_fold_id': 1,
+             'full_train_y_pred': np.arange(4), 'test_y_pred': np.arange(2)}
+            for i in (1, 2)])
+    with session_scope(config) as session:
+        submissions_on_cv_fold = session.query(SubmissionOnCVFold).all()
+        for submission_on_cv_fold in submissions_on_cv_fold:
+            assert 'full_train_y_pred' not in submission_on_cv_fold.__dict__
+            assert 'test_y_pred' not in submission_on_cv_fold.__dict__
+        # loaded on access
+        assert_array_equal(submissions_on_cv_fold[0].test_y_pred,
+                           np.arange(2))
+    with session_scope(config) as session:
+        submission_on_cv_fold = (session.query(SubmissionOnCVFold)
+                                 .options(undefer_group('predictions'))
+                                 .first())
+        assert 'full_train_y_pred' in submission_on_cv_fold.__dict__
+        assert 'test_y_pred' in submission_on_cv_fold.__dict__
+
+
+def test_cv_fold_indices_cache(config, monkeypatch):
+    setup_db(config)
+    with session_scope(config) as session:
+        cv_fold = CVFold(event_id=1, train_is=np.arange(10),
+                         test_is=np.array([1, 4, 7]))
+        session.add(cv_fold)
+        assert_array_equal(cv_fold.train_is, np.arange(10))
+    with session_scope(config) as session:
+        cv_fold = session.query(CVFold).one()
+        assert '_train_is' not in cv_fold.__dict__
+        assert_array_equal(cv_fold.test_is, [1, 4, 7])
+        assert not cv_fold.test_is.flags.writeable
+    with session_scope(config) as session:
+        cv_fold = session.query(CVFold).one()
+        # served from the cache without loading the column
+        assert_array_equal(cv_fold.test_is, [1, 4, 7])
+        assert '_test_is' not in cv_fold.__dict__
+        # nor looking up the database again
+        monkeypatch.setattr(session, 'get_bind', None)
+        assert_array_equal(cv_fold.test_is, [1, 4, 7])
+        monkeypatch.undo()
+        cv_fold_id = cv_fold.id
+        session.delete(cv_fold)
+    assert not [key for key in CVFold._cache if key[1] == cv_fold_id]
+
+    with session_scope(config) as session:
+        session.add(CVFold(event_id=1, train_is=np.arange(10),
+                           test_is=np.array([2, 3])))
+    with session_scope(config) as session:
+        session.query(CVFold).one().test_is
+    assert CVFold._cache
+    Model.metadata.drop_all(get_engine(config))
+    assert not CVFold._cache
+
+
+def test_remove_unreferenced_arrays(config, tmpdir, monkeypatch):
+    store = tmpdir.mkdir('store')
+    monkeypatch.setenv('RAMP_PREDICTION_STORE', str(store))
+    setup_db(config)
+    with session_scope(config) as session:
+        session.execute(EventEnsemble.__table__.insert(), [
+            {'id': 1, 'event_id': 1, 'version': 1,
+             'combined_valid_y_pred': np.arange(4),
+             'combined_test_y_pred': np.arange(2)},
+            {'id': 2, 'event_id': 1, 'version': 2,
+             'combined_valid_y_pred': np.arange(4),
+             'combined_test_y_pred': np.arange(3)}])
+        session.execute(SubmissionOnCVFold.__table__.insert(), [
+            {'id': 1, 'submission_id': 1, 'cv_fold_id': 1,
+             'full_train_y_pred': np.arange(2)}])
+    assert len(list(store.visit('*.npy'))) == 3
+
+    table = EventEnsemble.__table__
+    with session_scope(config) as session:
+        blobs = session.execute(
+            table.select().with_only_columns([
+                type_coerce(table.c.combined_valid_y_pred, LargeBinary),
+                type_coerce(table.c.combined_test_y_pred, LargeBinary)])
+            .where(table.c.version == 2)).first()
+        session.execute(table.delete().where(table.c.version == 2))
+    with session_scope(config) as session:
+        # the arrays written recently may belong to uncommitted rows
+        assert remove_unreferenced_arrays(session, blobs) == 0
+        # np.arange(4) is still held by the first version
+        assert remove_unreferenced_arrays(
+            session, blobs, grace_period=0) == 1
+    assert len(list(store.visit('*.npy'))) == 2
+    with session_scope(config) as session:
+        blobs = session.execute(
+            table.select().with_only_columns([
+                type_coerce(table.c.combined_valid_y_pred, LargeBinary),
+                type_coerce(table.c.combined_test_y_pred, LargeBinary)])
+            ).first()
+        session.execute(table.delete())
+    with session_scope(config) as session:
+        # np.arange(2) is still held by a submission
+        assert remove_unreferenced_arrays(
+            session, blobs, grace_period=0) == 1
+        assert_array_equal(
+            session.query(SubmissionOnCVFold).one().full_train_y_pred,
+            np.arange(2))
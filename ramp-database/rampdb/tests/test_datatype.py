@@ -0,0 +1,168 @@
+import stat
+import zlib
+
+import numpy as np
+import pytest
+from numpy.testing import assert_array_equal
+
+from sqlalchemy import column
+from sqlalchemy import select
+from sqlalchemy import table as raw_table
+from sqlalchemy import type_coerce
+from sqlalchemy import LargeBinary
+
+from rampdb.model import CVFold
+from rampdb.model import NumpyType
+from rampdb.model.datatype import STORE_FILE_MODE
+from rampdb.model.datatype import dumps_array
+from rampdb.model.datatype import is_legacy
+from rampdb.model.datatype import loads_array
+from rampdb.tools.database import convert_numpy_columns
+from rampdb.tools.database import dispose_engines
+from rampdb.tools.database import get_engine
+from rampdb.tools.database import setup_db
+
+
+@pytest.mark.parametrize('codec', ['none', 'zlib', 'lz4'])
+@pytest.mark.parametrize('array', [
+    np.arange(10),
+    np.random.RandomState(0).randn(5, 3),
+    np.random.RandomState(0).randn(5, 3)[:, 1],
+    np.array([True, False]),
+    np.array(3.5),
+    np.empty((0, 2)),
+])
+def test_dumps_loads_array(array, codec):
+    blob = dumps_array(array, codec=codec)
+    assert not is_legacy(blob)
+    loaded = loads_array(blob)
+    assert loaded.dtype == array.dtype
+    assert_array_equal(loaded, array)
+    # as the legacy pickled arrays, the arrays can be modified in place
+    assert loaded.flags.writeable
+
+
+@pytest.mark.parametrize('value', [None, 3., np.array(3.), np.array(None)])
+def test_dumps_loads_array_0d(value):
+    # scalars and None keep their 0-d shape
+    loaded = loads_array(dumps_array(value))
+    assert loaded.shape == ()
+    assert loaded.item() == np.asarray(value).item()
+
+
+def test_loads_array_legacy():
+    array = np.random.RandomState(0).randn(5, 3)
+    blob = zlib.compress(array.dumps())
+    assert is_legacy(blob)
+    assert_array_equal(loads_array(blob), array)
+
+
+def test_dumps_array_object_dtype():
+    array = np.array(['a', None], dtype=object)
+    blob = dumps_array(array)
+    assert is_legacy(blob)
+    assert_array_equal(loads_array(blob), array)
+
+
+@pytest.mark.parametrize('array, compact_size', [
+    (np.arange(10, 100000), 24),
+    (np.arange(3, 100000, 4), 24),
+    (np.sort(np.random.RandomState(0).permutation(100000)[:50000]), 12508),
+    (np.array([5, 3, 8]), None),
+    (np.array([1, 7, 1000000]), None),
+    (np.array([0.5, 1.5]), None),
+])
+def test_dumps_array_compact(array, compact_size):
+    blob = dumps_array(array, codec='none', compact=True)
+    if compact_size is None:
+        assert blob == dumps_array(array, codec='none')
+    else:
+        empty = np.array([], dtype=array.dtype)
+        assert len(blob) == len(dumps_array(empty, codec='none')) + \
+            compact_size
+    loaded = loads_array(blob)
+    assert loaded.dtype == array.dtype
+    assert_array_equal(loaded, array)
+
+
+def test_numpy_type_unknown_codec():
+    with pytest.raises(ValueError, match='Unknown codec'):
+        NumpyType(codec='gzip')
+
+
+@pytest.fixture
+def config(tmpdir):
+    try:
+        yield {'drivername': 'sqlite',
+               'database': str(tmpdir.join('ramp.db'))}
+    finally:
+        dispose_engines()
+
+
+def test_convert_numpy_columns(config):
+    setup_db(config)
+    engine = get_engine(config)
+    table = CVFold.__table__
+    train_is = np.arange(5)
+    test_is = np.arange(5, 8)
+    # write the rows in the legacy format bypassing the column type
+    legacy_table = raw_table('cv_folds', column('id'), column('event_id'),
+                             column('train_is'), column('test_is'))
+    engine.execute(legacy_table.insert(), [
+        {'id': i, 'event_id': 1,
+         'train_is': zlib.compress(train_is.dumps()),
+         'test_is': zlib.compress(test_is.dumps())}
+        for i in range(1, 4)])
+
+    assert convert_numpy_columns(config, batch_size=2) == 3
+    assert convert_numpy_columns(config) == 0
+    assert convert_numpy_columns(config, force=True) == 3
+
+    raw = engine.execute(select([type_coerce(table.c.train_is, LargeBinary),
+                                 type_coerce(table.c.test_is, LargeBinary)]))
+    for train_blob, test_blob in raw:
+        assert not is_legacy(train_blob)
+        assert not is_legacy(test_blob)
+    for row in engine.execute(select([table.c.train_is, table.c.test_is])):
+        assert_array_equal(row[0], train_is)
+        assert_array_equal(row[1], test_is)
+
+
+def test_dumps_loads_array_prediction_store(tmpdir, monkeypatch):
+    monkeypatch.setenv('RAMP_PREDICTION_STORE', str(tmpdir))
+    array = np.random.RandomState(0).randn(10, 3)
+    blob = dumps_array(array, store_path=str(tmpdir))
+    # the database only keeps the header and the content hash
+    assert len(blob) < array.nbytes
+    assert len(tmpdir.listdir()) == 1
+    # the same content is written once
+    assert dumps_array(array.copy(), store_path=str(tmpdir)) == blob
+    assert len(tmpdir.listdir()[0].listdir()) == 1
+    # the other users can read the file, as with files created by open
+    store_file, = tmpdir.listdir()[0].listdir()
+    assert stat.S_IMODE(store_file.stat().mode) == STORE_FILE_MODE
+    # reusing the array refreshes its modification time
+    store_file.setmtime(0)
+    dumps_array(array, store_path=str(tmpdir))
+    assert store_file.mtime() > 0
+
+    loaded = loads_array(blob)
+    assert isinstance(loaded, np.memmap)
+    assert not loaded.flags.writeable
+    assert_array_equal(loaded, array)
+    assert_array_equal(loaded[[1, 5]], array[[1, 5]])
+
+    monkeypatch.delenv('RAMP_PREDICTION_STORE')
+    with pytest.raises(ValueError, match='RAMP_PREDICTION_STORE'):
+        loads_array(blob)
+
+
+def test_numpy_type_external(tmpdir, monkeypatch):
+    array = np.arange(6)
+    numpy_type = NumpyType(external=True)
+    assert not is_legacy(numpy_type.process_bind_param(array, None))
+    assert tmpdir.listdir() == []
+    monkeypatch.setenv('RAMP_PREDICTION_STORE', str(tmpdir))
+    blob = numpy_type.process_bind_param(array, None)
+    assert len(tmpdir.listdir()) == 1
+    assert_array_equal(numpy_type.process_result_value(blob, None), array)
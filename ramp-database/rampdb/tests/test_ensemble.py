@@ -0,0 +1,307 @@
+import warnings
+
+import numpy as np
+import pytest
+from numpy.testing import assert_array_equal
+
+from rampdb.tools import ensemble
+from rampdb.tools.ensemble import EnsembleSearch
+from rampdb.tools.ensemble import get_warm_start_index_list
+from rampdb.tools.ensemble import prune_candidates
+from rampdb.tools.ensemble import select_ensemble
+
+
+class BasePrediction(object):
+    """Mimic the prediction types of ramp-workflow."""
+
+    def __init__(self, y_pred=None, y_true=None):
+        self.y_pred = y_pred if y_true is None else y_true
+
+    @classmethod
+    def combine(cls, predictions_list, index_list=None):
+        if index_list is None:
+            index_list = range(len(predictions_list))
+        y_comb_list = np.array(
+            [predictions_list[i].y_pred for i in index_list])
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            y_comb = np.nanmean(y_comb_list, axis=0)
+        return cls(y_pred=y_comb)
+
+
+class Predictions(BasePrediction):
+    pass
+
+
+def rmse(ground_truths, predictions):
+    return np.sqrt(np.nanmean(
+        (ground_truths.y_pred - predictions.y_pred) ** 2))
+
+
+@pytest.fixture
+def fold():
+    rng = np.random.RandomState(42)
+    y_true = rng.randn(200)
+    predictions_list = []
+    for _ in range(30):
+        y_pred = y_true + rng.randn(200) * rng.uniform(0.5, 2)
+        y_pred[rng.randint(0, 200, 5)] = np.nan
+        predictions_list.append(Predictions(y_pred=y_pred))
+    return predictions_list, Predictions(y_true=y_true)
+
+
+def _greedy(search, max_n_ensemble=10):
+    best_index_list = np.array([0])
+    scores = []
+    improvement = True
+    while improvement and len(best_index_list) < max_n_ensemble:
+        old_best_index_list = best_index_list
+        best_index_list, score = search.next_best(best_index_list)
+        scores.append(score)
+        improvement = len(best_index_list) != len(old_best_index_list)
+    return best_index_list, scores
+
+
+def test_ensemble_search_running_sum(fold, monkeypatch):
+    predictions_list, ground_truths = fold
+    search = EnsembleSearch(predictions_list, ground_truths, rmse, True)
+    # ramp-workflow is not available: full recombination
+    assert not search.is_mean
+    expected_index_list, expected_scores = _greedy(search)
+    assert len(expected_index_list) > 2
+
+    monkeypatch.setattr(ensemble, 'BasePrediction', BasePrediction)
+    search = EnsembleSearch(predictions_list, ground_truths, rmse, True)
+    assert search.is_mean
+    best_index_list, scores = _greedy(search)
+    assert_array_equal(best_index_list, expected_index_list)
+    assert scores == expected_scores
+    assert_array_equal(
+        search.combine(best_index_list).y_pred,
+        Predictions.combine(predictions_list, best_index_list).y_pred)
+
+
+def test_ensemble_search_custom_combine(fold, monkeypatch):
+    monkeypatch.setattr(ensemble, 'BasePrediction', BasePrediction)
+
+    class MedianPredictions(Predictions):
+        @classmethod
+        def combine(cls, predictions_list, index_list=None):
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', category=RuntimeWarning)
+                return cls(y_pred=np.nanmedian(
+                    [predictions_list[i].y_pred for i in index_list],
+                    axis=0))
+
+    predictions_list, ground_truths = fold
+    predictions_list = [MedianPredictions(y_pred=predictions.y_pred)
+                        for predictions in predictions_list]
+    search = EnsembleSearch(predictions_list, ground_truths, rmse, True)
+    assert not search.is_mean
+    best_index_list, _ = search.next_best([0])
+    assert len(best_index_list) == 2
+
+
+def _reference_auc(y_true, y_score):
+    pos = y_score[y_true == 1]
+    neg = y_score[y_true != 1]
+    return (np.mean(pos[:, None] > neg[None, :]) +
+            0.5 * np.mean(pos[:, None] == neg[None, :]))
+
+
+def _score_type(name, is_lower_the_better):
+    """Score type of ramp-workflow computed one candidate at a time."""
+
+    def score_function(self, ground_truths, predictions):
+        y_true, y_pred = ground_truths.y_pred, predictions.y_pred
+        if name == 'RMSE':
+            return np.sqrt(np.mean(np.square(y_true - y_pred)))
+        elif name == 'Accuracy':
+            return np.mean(
+                np.argmax(y_true, axis=1) == np.argmax(y_pred, axis=1))
+        elif name == 'NegativeLogLikelihood':
+            y_pred = y_pred / np.sum(y_pred, axis=1, keepdims=True)
+            y_pred = np.clip(y_pred, 10 ** -15, 1 - 10 ** -15)
+            return np.mean(-np.sum(np.log(y_pred) * y_true, axis=1))
+        return _reference_auc(np.argmax(y_true, axis=1), y_pred[:, 1])
+
+    score_type_class = type(name, (object,), {
+        '__module__': 'rampwf.score_types',
+        'is_lower_the_better': is_lower_the_better,
+        'score_function': score_function})
+    return score_type_class()
+
+
+@pytest.mark.parametrize('name, is_lower_the_better', [
+    ('RMSE', True),
+    ('Accuracy', False),
+    ('NegativeLogLikelihood', True),
+    ('ROCAUC', False),
+])
+def test_ensemble_search_batch_score(name, is_lower_the_better, monkeypatch):
+    monkeypatch.setattr(ensemble, 'BasePrediction', BasePrediction)
+    # small batches to check that the candidates are scored by chunks
+    monkeypatch.setattr(ensemble, 'BATCH_SIZE', 1000)
+    rng = np.random.RandomState(0)
+    if name == 'RMSE':
+        y_true = rng.randn(100)
+        y_preds = y_true + rng.randn(20, 100)
+    else:
+        n_classes = 2 if name == 'ROCAUC' else 3
+        y_true = np.eye(n_classes)[rng.randint(0, n_classes, 100)]
+        y_preds = rng.dirichlet(np.ones(n_classes), (20, 100))
+        # rounded probabilities to have ties
+        y_preds = np.round(0.7 * y_preds + 0.3 * y_true, 1)
+    predictions_list = [Predictions(y_pred=y_pred) for y_pred in y_preds]
+    ground_truths = Predictions(y_true=y_true)
+    score_type = _score_type(name, is_lower_the_better)
+
+    search = EnsembleSearch(predictions_list, ground_truths,
+                            score_type.score_function, is_lower_the_better)
+    expected_scores = search._candidate_scores([0, 3])
+    expected_index_list, _ = _greedy(search)
+
+    search = EnsembleSearch(predictions_list, ground_truths,
+                            score_type.score_function, is_lower_the_better,
+                            score_type=score_type)
+    assert search._batch_score is ensemble.BATCH_SCORES[name]
+    np.testing.assert_allclose(
+        search._candidate_scores([0, 3]), expected_scores, rtol=1e-12)
+    best_index_list, _ = _greedy(search)
+    assert_array_equal(best_index_list, expected_index_list)
+
+
+def test_ensemble_search_batch_score_multi_output(monkeypatch):
+    monkeypatch.setattr(ensemble, 'BasePrediction', BasePrediction)
+    rng = np.random.RandomState(0)
+    y_true = rng.randn(100, 2)
+    y_preds = y_true + rng.randn(20, 100, 2) * rng.uniform(0.5, 2, (20, 1, 1))
+    predictions_list = [Predictions(y_pred=y_pred) for y_pred in y_preds]
+    ground_truths = Predictions(y_true=y_true)
+    score_type = _score_type('RMSE', True)
+
+    search = EnsembleSearch(predictions_list, ground_truths,
+                            score_type.score_function, True)
+    expected_scores = search._candidate_scores([0, 3])
+    expected_index_list, _ = _greedy(search)
+
+    search = EnsembleSearch(predictions_list, ground_truths,
+                            score_type.score_function, True,
+                            score_type=score_type)
+    # one score per candidate
+    assert search._candidate_scores([0, 3]).shape == (20,)
+    np.testing.assert_allclose(
+        search._candidate_scores([0, 3]), expected_scores, rtol=1e-12)
+    best_index_list, _ = _greedy(search)
+    assert_array_equal(best_index_list, expected_index_list)
+
+
+PROBLEM = """
+import numpy as np
+
+
+class Predictions(object):
+    def __init__(self, y_pred=None, y_true=None):
+        self.y_pred = y_pred if y_true is None else np.asarray(y_true)
+
+    @classmethod
+    def combine(cls, predictions_list, index_list):
+        return cls(y_pred=np.mean(
+            [predictions_list[i].y_pred for i in index_list], axis=0))
+
+
+class RMSE(object):
+    name = 'rmse'
+    is_lower_the_better = True
+
+    def score_function(self, ground_truths, predictions):
+        return np.sqrt(np.mean((ground_truths.y_pred -
+                                predictions.y_pred) ** 2))
+
+
+score_types = [RMSE()]
+"""
+
+
+def test_select_ensemble(fold, tmpdir):
+    problem_path = tmpdir.join('problem.py')
+    problem_path.write(PROBLEM)
+    predictions_list, ground_truths = fold
+    y_preds = np.nan_to_num(
+        np.array([predictions.y_pred for predictions in predictions_list]))
+    predictions_list = [Predictions(y_pred=y_pred) for y_pred in y_preds]
+
+    search = EnsembleSearch(predictions_list, ground_truths, rmse, True)
+    expected_index_list, expected_scores = _greedy(search, max_n_ensemble=5)
+
+    best_index_list, score, steps = select_ensemble(
+        str(problem_path), 'rmse', y_preds, ground_truths.y_pred, [0], 5)
+    assert_array_equal(best_index_list, expected_index_list)
+    assert [step_score for _, step_score in steps] == \
+        pytest.approx(expected_scores)
+    assert score == pytest.approx(expected_scores[-1])
+    assert_array_equal(steps[0][0], [0])
+
+    # no time left: the starting ensemble is kept
+    best_index_list, score, steps = select_ensemble(
+        str(problem_path), 'rmse', y_preds, ground_truths.y_pred, [0], 5,
+        max_time=0)
+    assert_array_equal(best_index_list, [0])
+    assert steps == []
+    # the score of the kept ensemble is still reported, to resume from it
+    assert score == pytest.approx(search.score([0]))
+
+    # the resumed ensemble scores as when it was selected: it is kept
+    best_index_list, score, steps = select_ensemble(
+        str(problem_path), 'rmse', y_preds, ground_truths.y_pred,
+        expected_index_list[:2], 5, ensemble_score=expected_scores[0],
+        restart_index_list=[0])
+    assert_array_equal(steps[0][0], expected_index_list[:2])
+    assert_array_equal(best_index_list, expected_index_list)
+    # the predictions of its models changed: restart from the best model
+    best_index_list, score, steps = select_ensemble(
+        str(problem_path), 'rmse', y_preds, ground_truths.y_pred,
+        expected_index_list[:2], 5, ensemble_score=expected_scores[0] / 2,
+        restart_index_list=[0])
+    assert_array_equal(steps[0][0], [0])
+    assert_array_equal(best_index_list, expected_index_list)
+
+
+def test_get_warm_start_index_list():
+    candidate_ids = [3, 5, 8, 13]
+    assert_array_equal(
+        get_warm_start_index_list([5, 13, 5], candidate_ids, 10), [1, 3, 1])
+    # nothing to resume from
+    assert get_warm_start_index_list(None, candidate_ids, 10) is None
+    assert get_warm_start_index_list([], candidate_ids, 10) is None
+    # a selected submission was deleted or excluded
+    assert get_warm_start_index_list([5, 4], candidate_ids, 10) is None
+    # full ensemble
+    assert get_warm_start_index_list([5, 13, 5], candidate_ids, 3) is None
+
+
+def test_prune_candidates():
+    y_preds = np.array([[0., 1.], [0., 1.05], [2., 3.], [np.nan, 1.],
+                        [4., 5.]])
+    valid_scores = [0.1, 0.2, 0.3, 0.15, np.nan]
+    assert_array_equal(
+        prune_candidates(y_preds, valid_scores, True), np.arange(5))
+    assert_array_equal(
+        prune_candidates(y_preds, valid_scores, True, max_n_candidates=2),
+        [0, 3])
+    assert_array_equal(
+        prune_candidates(y_preds, valid_scores, False, max_n_candidates=2),
+        [1, 2])
+    # NaN scores come last
+    assert_array_equal(
+        prune_candidates(y_preds, valid_scores, False, max_n_candidates=4),
+        [0, 1, 2, 3])
+    # the second submission is a duplicate of the first one, missing
+    # predictions are only duplicates of missing predictions
+    assert_array_equal(
+        prune_candidates(y_preds, valid_scores, True, tolerance=0.1),
+        [0, 2, 3, 4])
+    assert_array_equal(
+        prune_candidates(y_preds, valid_scores, True, max_n_candidates=3,
+                         tolerance=0.1, keep=[4]),
+        [0, 3, 4])
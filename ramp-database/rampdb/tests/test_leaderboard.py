@@ -0,0 +1,182 @@
+import datetime
+
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+
+from rampdb.model import Event
+from rampdb.model import Extension
+from rampdb.model import EventScoreType
+from rampdb.model import EventTeam
+from rampdb.model import LeaderboardRow
+from rampdb.model import Submission
+from rampdb.model import SubmissionFile
+from rampdb.model import SubmissionFileTypeExtension
+from rampdb.model import SubmissionScore
+from rampdb.model import SubmissionScoreOnCVFold
+from rampdb.model import Team
+from rampdb.model import WorkflowElement
+from rampdb.model import WorkflowElementType
+from rampdb.tools.database import dispose_engines
+from rampdb.tools.database import session_scope
+from rampdb.tools.database import setup_db
+from rampdb.tools.leaderboard import get_competition_leaderboard_rows
+from rampdb.tools.leaderboard import update_leaderboard_rows
+
+
+@pytest.fixture
+def config(tmpdir):
+    config = {'drivername': 'sqlite',
+              'database': str(tmpdir.join('ramp.db'))}
+    setup_db(config)
+    now = datetime.datetime.utcnow()
+    with session_scope(config) as session:
+        session.execute(Event.__table__.insert(), [
+            {'id': 1, 'name': 'iris_test', 'title': 'iris', 'problem_id': 1,
+             'official_score_name': 'acc'}])
+        session.execute(EventScoreType.__table__.insert(), [
+            {'id': 1, 'name': 'acc', 'event_id': 1, 'score_type_id': 1,
+             'precision': 2}])
+        session.execute(Team.__table__.insert(), [
+            {'id': 1, 'name': 'test_user', 'creation_timestamp': now}])
+        session.execute(EventTeam.__table__.insert(), [
+            {'id': 1, 'event_id': 1, 'team_id': 1, 'signup_timestamp': now}])
+        session.execute(Submission.__table__.insert(), [
+            {'id': 1, 'event_team_id': 1, 'name': 'scored',
+             'hash_': '1', 'state': 'scored', 'submission_timestamp': now,
+             'is_valid': True, 'is_in_competition': True,
+             'contributivity': 0.456, 'historical_contributivity': 0.,
+             'train_time_cv_mean': 1.6, 'valid_time_cv_mean': 0.2,
+             'train_time_cv_std': 0.1, 'valid_time_cv_std': 0.1}])
+        session.execute(Submission.__table__.insert(), [
+            {'id': 2, 'event_team_id': 1, 'name': 'failed',
+             'hash_': '2', 'state': 'training_error',
+             'submission_timestamp': now}])
+        session.execute(SubmissionScore.__table__.insert(), [
+            {'id': 1, 'submission_id': 1, 'event_score_type_id': 1,
+             'valid_score_cv_bag': 0.8561, 'test_score_cv_bag': 0.7}])
+        session.execute(SubmissionScoreOnCVFold.__table__.insert(), [
+            {'submission_on_cv_fold_id': i, 'submission_score_id': 1,
+             'valid_score': valid_score, 'test_score': 0.7}
+            for i, valid_score in [(1, 0.8), (2, 0.9)]])
+        session.execute(Extension.__table__.insert(), [
+            {'id': 1, 'name': 'py'}])
+        session.execute(SubmissionFileTypeExtension.__table__.insert(), [
+            {'id': 1, 'type_id': 1, 'extension_id': 1}])
+        session.execute(WorkflowElementType.__table__.insert(), [
+            {'id': i, 'name': name, 'type_id': 1}
+            for i, name in [(1, 'classifier'), (2, 'feature_extractor')]])
+        session.execute(WorkflowElement.__table__.insert(), [
+            {'id': i, 'name': 'element', 'workflow_id': 1,
+             'workflow_element_type_id': i} for i in (1, 2)])
+        # the leaderboards link to the first file of the submissions
+        session.execute(SubmissionFile.__table__.insert(), [
+            {'id': i, 'submission_id': submission_id,
+             'workflow_element_id': workflow_element_id,
+             'submission_file_type_extension_id': 1}
+            for i, submission_id, workflow_element_id
+            in [(1, 1, 1), (2, 2, 2), (3, 1, 2)]])
+    try:
+        yield config
+    finally:
+        dispose_engines()
+
+
+def test_update_leaderboard_rows(config):
+    with session_scope(config) as session:
+        event = session.query(Event).one()
+        rows = update_leaderboard_rows(session, event)
+        assert len(rows) == 2
+    with session_scope(config) as session:
+        rows = {row.submission_id: row
+                for row in session.query(LeaderboardRow)}
+    assert rows[1].team_name == 'test_user'
+    assert rows[1].name_with_link == '<a href=/1/classifier.py>scored</a>'
+    assert rows[1].is_public_leaderboard and not rows[1].is_error
+    assert_allclose(rows[1].scores, [[0.86, 0.85, 0.05, 0.7, 0.7, 0.]])
+    assert rows[1].official_valid_score == pytest.approx(0.86)
+    assert rows[1].contributivity == 46
+    assert rows[1].train_time == 2
+    # the submissions are ranked by the second of their timestamp, as shown
+    with session_scope(config) as session:
+        submission_timestamp = session.query(Submission).get(1)\
+            .submission_timestamp
+    assert rows[1].submission_timestamp == \
+        submission_timestamp.replace(microsecond=0)
+    assert rows[2].is_error and not rows[2].is_public_leaderboard
+    assert rows[2].official_valid_score is None
+    assert rows[2].state_with_link == \
+        '<a href=/2/error.txt>training_error</a>'
+
+    # the rows of the submissions which did not change are not written
+    with session_scope(config) as session:
+        event = session.query(Event).one()
+        assert update_leaderboard_rows(session, event) == []
+        submission = session.query(Submission).get(2)
+        submission.set_state('new')
+        rows = update_leaderboard_rows(session, event, [1, 2])
+        assert [row.submission_id for row in rows] == [2]
+        assert rows[0].is_new and not rows[0].is_error
+
+    # the rows of the deleted submissions are removed
+    with session_scope(config) as session:
+        session.execute(
+            Submission.__table__.delete().where(Submission.id == 2))
+    with session_scope(config) as session:
+        event = session.query(Event).one()
+        rows = update_leaderboard_rows(session, event)
+        assert [row.submission_id for row in rows] == [2]
+    with session_scope(config) as session:
+        assert session.query(LeaderboardRow.submission_id).all() == [(1,)]
+
+
+def test_update_leaderboard_rows_missing_score(config):
+    # a score type added after the submission was scored has no score rows
+    with session_scope(config) as session:
+        session.execute(EventScoreType.__table__.insert(), [
+            {'id': 2, 'name': 'error', 'event_id': 1, 'score_type_id': 2,
+             'precision': 2}])
+    with session_scope(config) as session:
+        event = session.query(Event).one()
+        update_leaderboard_rows(session, event)
+    with session_scope(config) as session:
+        row = session.query(LeaderboardRow).filter_by(submission_id=1).one()
+        assert_allclose(row.scores, [[0.86, 0.85, 0.05, 0.7, 0.7, 0.],
+                                     [np.nan] * 6])
+        assert row.official_valid_score == pytest.approx(0.86)
+
+
+@pytest.mark.parametrize('has_window_functions', [True, False])
+def test_get_competition_leaderboard_rows(config, monkeypatch,
+                                          has_window_functions):
+    monkeypatch.setattr('rampdb.tools.leaderboard._has_window_functions',
+                        lambda session: has_window_functions)
+    now = datetime.datetime.utcnow()
+    with session_scope(config) as session:
+        session.execute(EventScoreType.__table__.update().values(
+            is_lower_the_better=False))
+        session.execute(Team.__table__.insert(), [
+            {'id': i, 'name': 'team_{}'.format(i), 'creation_timestamp': now}
+            for i in (2, 3)])
+        session.execute(EventTeam.__table__.insert(), [
+            {'id': i, 'event_id': 1, 'team_id': i, 'signup_timestamp': now}
+            for i in (2, 3)])
+        session.execute(LeaderboardRow.__table__.insert(), [
+            {'submission_id': submission_id, 'event_id': 1,
+             'event_team_id': event_team_id,
+             'submission_timestamp': now + datetime.timedelta(seconds=delay),
+             'is_public_leaderboard': True,
+             'is_in_competition': submission_id != 16,
+             'official_valid_score': valid_score,
+             'official_test_score': test_score}
+            for submission_id, event_team_id, valid_score, test_score, delay
+            in [(11, 1, 0.8, 0.7, 0), (12, 1, 0.9, 0.6, 1),
+                (13, 1, 0.9, 0.95, 2), (14, 2, 0.85, 0.9, 0),
+                (15, 3, 0.9, 0.8, 0), (16, 3, 0.99, 0.99, 0)]])
+    with session_scope(config) as session:
+        event = session.query(Event).one()
+        rows = get_competition_leaderboard_rows(session, event)
+        # ties are broken by the earliest submission, within and across teams
+        assert [(row.submission_id, public_rank, private_rank)
+                for row, public_rank, private_rank in rows] == \
+            [(15, 1, 2), (12, 2, 3), (14, 3, 1)]
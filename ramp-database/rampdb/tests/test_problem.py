@@ -0,0 +1,152 @@
+import os
+
+import numpy as np
+import pytest
+from numpy.testing import assert_array_equal
+
+from rampdb.model import Event
+from rampdb.model import EventEnsemble
+from rampdb.model import EventScoreType
+from rampdb.model import Problem
+from rampdb.model import problem as problem_module
+
+PROBLEM = """
+import numpy as np
+
+
+class Predictions(object):
+    def __init__(self, y_pred=None, y_true=None):
+        self.y_pred = y_true if y_pred is None else y_pred
+        self.y_true = y_true
+
+    @property
+    def valid_indexes(self):
+        return ~np.isnan(self.y_pred)
+
+
+class RMSE(object):
+    name = 'rmse'
+    precision = 3
+    is_lower_the_better = True
+    minimum = 0.
+    maximum = float('inf')
+
+    def score_function(self, ground_truths, predictions, valid_indexes=None):
+        if valid_indexes is None:
+            valid_indexes = slice(None)
+        return np.sqrt(np.mean((ground_truths.y_pred[valid_indexes] -
+                                predictions.y_pred[valid_indexes]) ** 2))
+
+
+score_types = [RMSE()]
+
+
+def get_train_data(path):
+    return None, np.loadtxt(path + '/data/train.csv')
+
+
+def get_test_data(path):
+    return None, np.loadtxt(path + '/data/test.csv')
+"""
+
+
+@pytest.fixture
+def problem(tmpdir, monkeypatch):
+    kits_path = tmpdir.mkdir('ramp-kits')
+    kits_path.mkdir('iris').join('problem.py').write(PROBLEM)
+    data_path = tmpdir.mkdir('ramp-data')
+    data_dir = data_path.mkdir('iris').mkdir('data')
+    np.savetxt(str(data_dir.join('train.csv')), np.arange(5))
+    np.savetxt(str(data_dir.join('test.csv')), np.arange(3))
+    monkeypatch.setattr('rampdb.model.problem.RAMP_KITS_PATH',
+                        str(kits_path))
+    monkeypatch.setattr('rampdb.model.problem.RAMP_DATA_PATH',
+                        str(data_path))
+    # create the instance without the database lookup of the workflow
+    problem = Problem.__mapper__.class_manager.new_instance()
+    problem.name = 'iris'
+    try:
+        yield problem
+    finally:
+        Problem.clear_ground_truth_cache()
+
+
+def test_ground_truths_cache(problem, monkeypatch):
+    n_reads = []
+    get_train_data = Problem.get_train_data
+
+    def counting_get_train_data(self):
+        n_reads.append(self.name)
+        return get_train_data(self)
+
+    monkeypatch.setattr(Problem, 'get_train_data', counting_get_train_data)
+
+    assert_array_equal(problem.ground_truths_train().y_true, np.arange(5))
+    assert_array_equal(problem.ground_truths_valid([1, 3]).y_true, [1, 3])
+    assert_array_equal(problem.ground_truths_valid([0]).y_true, [0])
+    assert_array_equal(problem.ground_truths_test().y_true, np.arange(3))
+    assert len(n_reads) == 1
+    assert len(Problem._ground_truth_cache) == 2
+
+    # modifying the data invalidates the cache
+    train_file = os.path.join(problem_module.RAMP_DATA_PATH, 'iris', 'data',
+                              'train.csv')
+    np.savetxt(train_file, np.arange(6))
+    stat = os.stat(train_file)
+    os.utime(train_file, (stat.st_atime, stat.st_mtime + 10))
+    assert_array_equal(problem.ground_truths_valid([5]).y_true, [5])
+    assert len(n_reads) == 2
+
+
+def test_ground_truths_cache_is_bounded(problem, monkeypatch):
+    monkeypatch.setattr(problem_module, 'GROUND_TRUTH_CACHE_SIZE', 1)
+    problem.ground_truths_train()
+    problem.ground_truths_test()
+    assert list(Problem._ground_truth_cache) == [('iris', 'test')]
+
+
+def test_event_score_type(problem, monkeypatch):
+    event = Event.__mapper__.class_manager.new_instance()
+    event.problem = problem
+    score_type_object = problem.module.score_types[0]
+    event_score_type = EventScoreType(event, score_type_object)
+    assert event_score_type.score_type_object is score_type_object
+    assert event_score_type.precision == 3
+
+    # the metadata is stored and does not need the kit anymore
+    with monkeypatch.context() as m:
+        m.setattr(Problem, 'module', property(lambda self: None))
+        assert event_score_type.is_lower_the_better
+        assert event_score_type.minimum == 0
+        assert event_score_type.maximum == float('inf')
+        assert event_score_type.worst == float('inf')
+
+    # event score types set up before the columns were added
+    event_score_type._is_lower_the_better = None
+    event_score_type._maximum = None
+    assert event_score_type.is_lower_the_better
+    assert event_score_type.worst == float('inf')
+
+
+def test_event_ensemble(problem):
+    event = Event.__mapper__.class_manager.new_instance()
+    event.problem = problem
+    EventScoreType(event, problem.module.score_types[0])
+    event_ensemble = EventEnsemble(
+        event=event, version=1, cv_fold_ids=np.array([3, 4]),
+        ensemble_sizes=np.array([2, 1]),
+        ensemble_submission_ids=np.array([7, 7, 8]),
+        combined_valid_y_pred=np.array([0., 1., np.nan, 3., 5.]),
+        combined_test_y_pred=np.array([1., 2., 3.]))
+    fold_ensembles = event_ensemble.fold_ensembles
+    assert sorted(fold_ensembles) == [3, 4]
+    assert_array_equal(fold_ensembles[3], [7, 7])
+    assert_array_equal(fold_ensembles[4], [8])
+
+    # the valid predictions are scored where at least one fold predicts
+    assert event_ensemble.compute_scores() == {'rmse': {
+        'combined_valid': pytest.approx(0.5),
+        'foldwise_valid': None,
+        'combined_test': pytest.approx(1.),
+        'foldwise_test': None,
+    }}
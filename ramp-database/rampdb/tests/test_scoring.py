@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from rampdb.tools.scoring import compute_submission_scores
+
+PROBLEM = """
+import warnings
+
+import numpy as np
+
+
+class Predictions(object):
+    def __init__(self, y_pred=None, y_true=None, n_samples=None):
+        if y_true is not None:
+            y_pred = y_true
+        elif y_pred is None:
+            y_pred = np.full(n_samples, np.nan)
+        self.y_pred = np.asarray(y_pred, dtype=float)
+
+    def set_valid_in_train(self, predictions, test_is):
+        self.y_pred[test_is] = predictions.y_pred
+
+    @property
+    def valid_indexes(self):
+        return ~np.isnan(self.y_pred)
+
+    @classmethod
+    def combine(cls, predictions_list, index_list=None):
+        if index_list is None:
+            index_list = range(len(predictions_list))
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            y_comb = np.nanmean(
+                [predictions_list[i].y_pred for i in index_list], axis=0)
+        return cls(y_pred=y_comb)
+
+
+class MAE(object):
+    name = 'mae'
+
+    def score_function(self, ground_truths, predictions, valid_indexes=None):
+        if valid_indexes is None:
+            valid_indexes = slice(None)
+        return np.mean(np.abs(ground_truths.y_pred[valid_indexes] -
+                              predictions.y_pred[valid_indexes]))
+
+
+class Max(MAE):
+    name = 'max'
+
+    def score_function(self, ground_truths, predictions, valid_indexes=None):
+        if valid_indexes is None:
+            valid_indexes = slice(None)
+        return np.max(predictions.y_pred[valid_indexes])
+
+
+score_types = [MAE(), Max()]
+"""
+
+
+def test_compute_submission_scores(tmpdir):
+    problem_path = tmpdir.join('problem.py')
+    problem_path.write(PROBLEM)
+    y_train = np.zeros(4)
+    y_test = np.zeros(2)
+    train_is_list = [np.array([2, 3]), np.array([0, 1])]
+    test_is_list = [np.array([0, 1]), np.array([2, 3])]
+    full_train_y_preds = [np.array([1., 1., 2., 2.]),
+                          np.array([4., 4., 3., 3.])]
+    test_y_preds = [np.array([1., 3.]), np.array([3., 5.])]
+
+    fold_scores, valid_score_cv_bags, test_score_cv_bags =\
+        compute_submission_scores(
+            str(problem_path), ['max', 'mae'], full_train_y_preds,
+            test_y_preds, train_is_list, test_is_list, y_train, y_test)
+    # train, valid and test scores of each fold and score type
+    assert fold_scores.tolist() == [[[2., 1., 3.], [2., 1., 2.]],
+                                    [[4., 3., 5.], [4., 3., 4.]]]
+    # the valid predictions of the folds are complementary
+    assert valid_score_cv_bags.tolist() == [[1., 3.], [1., 2.]]
+    # the test predictions of the folds are averaged
+    assert test_score_cv_bags == pytest.approx(
+        np.array([[3., 4.], [2., 3.]]))
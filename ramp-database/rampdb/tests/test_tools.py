@@ -0,0 +1,82 @@
+import warnings
+
+import numpy as np
+import pytest
+from numpy.testing import assert_array_equal
+
+from rampdb.tools import ensemble
+from rampdb.tools import iter_bagged_predictions
+from rampdb.tools import propagate_historical_contributivity
+
+
+class BasePrediction(object):
+    """Mimic the prediction types of ramp-workflow."""
+
+    def __init__(self, y_pred=None, n_samples=None):
+        if y_pred is None:
+            y_pred = np.full((n_samples, 2), np.nan)
+        self.y_pred = y_pred
+
+    def set_valid_in_train(self, predictions, test_is):
+        self.y_pred[test_is] = predictions.y_pred
+
+    @classmethod
+    def combine(cls, predictions_list, index_list=None):
+        if index_list is None:
+            index_list = range(len(predictions_list))
+        y_comb_list = np.array(
+            [predictions_list[i].y_pred for i in index_list])
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            y_comb = np.nanmean(y_comb_list, axis=0)
+        return cls(y_pred=y_comb)
+
+
+class Predictions(BasePrediction):
+    pass
+
+
+@pytest.mark.parametrize('is_mean', [True, False])
+def test_iter_bagged_predictions(is_mean, monkeypatch):
+    if is_mean:
+        monkeypatch.setattr(ensemble, 'BasePrediction', BasePrediction)
+    rng = np.random.RandomState(0)
+    test_is_list = [rng.choice(20, 8, replace=False) for _ in range(5)]
+    predictions_list = [Predictions(y_pred=rng.rand(8, 2))
+                        for _ in test_is_list]
+    predictions_list[1].y_pred[3] = np.nan
+
+    y_comb = [Predictions(n_samples=20) for _ in predictions_list]
+    n_bags = 0
+    for i, combined_predictions in enumerate(iter_bagged_predictions(
+            Predictions, predictions_list, 20, test_is_list)):
+        y_comb[i].set_valid_in_train(predictions_list[i], test_is_list[i])
+        expected_predictions = Predictions.combine(y_comb[:i + 1])
+        assert_array_equal(combined_predictions.y_pred,
+                           expected_predictions.y_pred)
+        n_bags += 1
+    assert n_bags == len(predictions_list)
+
+    # full prediction vectors
+    for i, combined_predictions in enumerate(iter_bagged_predictions(
+            Predictions, predictions_list)):
+        expected_predictions = Predictions.combine(predictions_list[:i + 1])
+        assert_array_equal(combined_predictions.y_pred,
+                           expected_predictions.y_pred)
+
+
+def test_propagate_historical_contributivity():
+    # submissions from the latest to the earliest: the latest credits the
+    # two others, twice the last one (only the latest credit is kept), and
+    # the second one passes on a part of what it received
+    contributivities = [0.6, 0.4, 0.]
+    credits = {0: [(2, 0.5), (1, 0.25), (2, 0.1)],
+               1: [(2, 0.5)]}
+    historical_contributivities = propagate_historical_contributivity(
+        contributivities, credits)
+    assert historical_contributivities == pytest.approx(
+        [0.15, 0.275, 0.575])
+    assert historical_contributivities.sum() == pytest.approx(1.)
+
+    assert propagate_historical_contributivity(
+        contributivities, {}) == pytest.approx(contributivities)
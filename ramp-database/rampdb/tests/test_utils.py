@@ -1,4 +1,5 @@
 import os
+from rampdb.utils import clear_module_cache
 from rampdb.utils import import_module_from_source
 
 
@@ -9,3 +10,19 @@ def test_import_module_from_source():
                 os.path.join(module_path, 'local_module.py'), 'mod'
         )
         assert hasattr(mod, 'func_local_module')
+
+
+def test_import_module_from_source_cache(tmpdir):
+    source = tmpdir.join('kit_module.py')
+    source.write('VALUE = 1\n')
+    mod = import_module_from_source(str(source), 'kit_module')
+    assert import_module_from_source(str(source), 'kit_module') is mod
+
+    # modifying the source reloads the module
+    source.write('VALUE = 22\n')
+    mod = import_module_from_source(str(source), 'kit_module')
+    assert mod.VALUE == 22
+
+    clear_module_cache(str(source))
+    assert import_module_from_source(str(source), 'kit_module') is not mod
+    clear_module_cache()
@@ -1,2 +1,6 @@
 from .api import *  # noqa
 from .tools import *  # noqa
+from .database import *  # noqa
+from .ensemble import *  # noqa
+from .scoring import *  # noqa
+from .leaderboard import *  # noqa
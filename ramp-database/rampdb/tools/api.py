@@ -6,18 +6,21 @@ Methods for interacting with the database
 from __future__ import print_function, absolute_import
 
 import os
+import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
+from sqlalchemy.orm import undefer_group
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.engine.url import URL
-
-from ..model import Model
+from .database import session_scope
 from .query import select_submissions_by_state
 from .query import select_submissions_by_id
+from .query import select_submissions_by_ids
 from .query import select_submission_by_name
 from .query import select_event_by_name
+from .scoring import bulk_score_submissions
+from ..model import EventEnsemble
+from ..model import Submission
 from ..config import STATES, UnknownStateError
 
 
@@ -25,15 +28,31 @@ __all__ = [
     'get_submissions',
     'get_submission_by_id',
     'get_submission_by_name',
+    'get_submissions_by_ids',
     'set_submission_state',
     'get_submission_state',
+    'set_submission_states',
+    'get_submission_states',
+    'transition_submission_states',
     'set_submission_max_ram',
     'set_submission_error_msg',
     'set_predictions',
     'score_submission',
+    'score_submissions',
+    'score_event_ensemble',
     'get_event_nb_folds',
 ]
 
+TRAINING_END_STATES = [
+    'trained',
+    'validated',
+    'tested',
+    'training_error',
+    'validating_error',
+    'testing_error',
+]
+"""list of str: states reached once the training of a submission ended"""
+
 
 def get_submissions(config, event_name, state='new'):
     """
@@ -65,20 +84,7 @@ def get_submissions(config, event_name, state='new'):
     if state not in STATES:
         raise UnknownStateError("Unrecognized state : '{}'".format(state))
 
-    # Create database url
-    db_url = URL(**config)
-    db = create_engine(db_url)
-
-    # Create a configured "Session" class
-    Session = sessionmaker(db)
-
-    # Link the relational model to the database
-    Model.metadata.create_all(db)
-
-    # Connect to the dabase and perform action
-    with db.connect() as conn:
-        session = Session(bind=conn)
-
+    with session_scope(config) as session:
         submissions = select_submissions_by_state(session, event_name, state)
 
         if not submissions:
@@ -109,19 +115,7 @@ def get_submission_by_id(config, submission_id):
 
     `Submission` instance
     """
-    # Create database url
-    db_url = URL(**config)
-    db = create_engine(db_url)
-
-    # Create a configured "Session" class
-    Session = sessionmaker(db)
-
-    # Link the relational model to the database
-    Model.metadata.create_all(db)
-
-    # Connect to the dabase and perform action
-    with db.connect() as conn:
-        session = Session(bind=conn)
+    with session_scope(config) as session:
         submission = select_submissions_by_id(session, submission_id)
         # force event name and team name to be cached
         submission.event.name
@@ -152,19 +146,7 @@ def get_submission_by_name(config, event_name, team_name, name):
     `Submission` instance
 
     """
-    # Create database url
-    db_url = URL(**config)
-    db = create_engine(db_url)
-
-    # Create a configured "Session" class
-    Session = sessionmaker(db)
-
-    # Link the relational model to the database
-    Model.metadata.create_all(db)
-
-    # Connect to the dabase and perform action
-    with db.connect() as conn:
-        session = Session(bind=conn)
+    with session_scope(config) as session:
         submission = select_submission_by_name(
             session,
             event_name,
@@ -200,25 +182,10 @@ def set_submission_state(config, submission_id, state):
     if state not in STATES:
         raise UnknownStateError("Unrecognized state : '{}'".format(state))
 
-    # Create database url
-    db_url = URL(**config)
-    db = create_engine(db_url)
-
-    # Create a configured "Session" class
-    Session = sessionmaker(db)
-
-    # Link the relational model to the database
-    Model.metadata.create_all(db)
-
-    # Connect to the dabase and perform action
-    with db.connect() as conn:
-        session = Session(bind=conn)
-
+    with session_scope(config) as session:
         submission = select_submissions_by_id(session, submission_id)
         submission.set_state(state)
 
-        session.commit()
-
 
 def get_submission_state(config, submission_id):
     """
@@ -239,27 +206,141 @@ def get_submission_state(config, submission_id):
         when the requested state does not exist in the database
 
     """
-    # Create database url
-    db_url = URL(**config)
-    db = create_engine(db_url)
+    with session_scope(config) as session:
+        submission = select_submissions_by_id(session, submission_id)
+    return submission.state
 
-    # Create a configured "Session" class
-    Session = sessionmaker(db)
 
-    # Link the relational model to the database
-    Model.metadata.create_all(db)
+def get_submissions_by_ids(config, submission_ids):
+    """
+    Get the `Submission` instances of several submission ids at once
 
-    # Connect to the dabase and perform action
-    with db.connect() as conn:
-        session = Session(bind=conn)
-        submission = select_submissions_by_id(session, submission_id)
-    return submission.state
+    Parameters
+    ----------
+    config : dict
+        configuration
+    submission_ids : list of int
+        ids of the requested submissions
+
+    Returns
+    -------
+    List of `Submission` instances, ordered as `submission_ids`. Unknown ids
+    are ignored.
+    """
+    with session_scope(config) as session:
+        submissions = select_submissions_by_ids(session, submission_ids)
+        for submission in submissions:
+            # force event name and team name to be cached
+            submission.event.name
+            submission.team.name
+    submissions = {submission.id: submission for submission in submissions}
+    return [submissions[submission_id] for submission_id in submission_ids
+            if submission_id in submissions]
+
+
+def get_submission_states(config, submission_ids):
+    """
+    Get the states of several submissions in a single query
+
+    Parameters
+    ----------
+    config : dict
+        configuration
+    submission_ids : list of int
+        ids of the requested submissions
+
+    Returns
+    -------
+    dict :
+        {submission_id: state}. Unknown ids are ignored.
+    """
+    submission_ids = list(submission_ids)
+    if not submission_ids:
+        return {}
+    with session_scope(config) as session:
+        states = (session
+                  .query(Submission.id, Submission.state)
+                  .filter(Submission.id.in_(submission_ids))
+                  .all())
+    return dict(states)
+
+
+def set_submission_states(config, states):
+    """
+    Modify the states of several submissions in a single transaction
+
+    Parameters
+    ----------
+    config : dict
+        configuration
+    states : dict
+        {submission_id: new state of the submission}
+
+    Raises
+    ------
+    UnknownStateError :
+        when one of the requested states does not exist in the database
+
+    """
+    _update_submission_states(config, states, stamp_timestamps=False)
+
+
+def transition_submission_states(config, states):
+    """
+    Modify the states of several submissions and stamp their timestamps
+
+    Same as `set_submission_states` but also records the time at which
+    the submissions are sent to training (`sent_to_training_timestamp`)
+    and at which their training ended (`training_timestamp`).
+
+    Parameters
+    ----------
+    config : dict
+        configuration
+    states : dict
+        {submission_id: new state of the submission}
 
+    Raises
+    ------
+    UnknownStateError :
+        when one of the requested states does not exist in the database
 
-def set_predictions(config, submission_id, prediction_path, ext='npy'):
+    """
+    _update_submission_states(config, states, stamp_timestamps=True)
+
+
+def _update_submission_states(config, states, stamp_timestamps):
+    unknown_states = set(states.values()) - set(STATES)
+    if unknown_states:
+        raise UnknownStateError("Unrecognized state : '{}'".format(
+            "', '".join(sorted(unknown_states))))
+    if not states:
+        return
+
+    now = datetime.datetime.utcnow()
+    with session_scope(config) as session:
+        submissions = select_submissions_by_ids(
+            session, list(states), load_cv_folds=True)
+        for submission in submissions:
+            state = states[submission.id]
+            submission.set_state(state)
+            if not stamp_timestamps:
+                continue
+            if state == 'sent_to_training':
+                submission.sent_to_training_timestamp = now
+            elif state in TRAINING_END_STATES:
+                submission.training_timestamp = now
+
+
+def set_predictions(config, submission_id, prediction_path, ext='npy',
+                    n_jobs=None):
     """
     Insert predictions in the database after training/testing
 
+    The prediction files of all the folds are read concurrently and
+    checked against the folds before being written in a single
+    transaction, so that a submission is never left half-populated.
+
     Parameters
     ----------
     config : dict
@@ -268,45 +349,96 @@ def set_predictions(config, submission_id, prediction_path, ext='npy'):
         id of the related submission
     prediction_path : str
         local path where predictions are saved.
-        Should end with 'training_output'.
+        Should end with 'training_output'. It can also be the path of a
+        single '.npz' archive bundling all the folds, with the arrays
+        'y_pred_train_<fold>', 'y_pred_test_<fold>', 'train_time_<fold>',
+        'valid_time_<fold>' and 'test_time_<fold>'.
     ext : {'npy', 'npz', 'csv'}, optional
         extension of the saved prediction extension file (default is 'npy')
+    n_jobs : int or None, optional
+        number of threads reading the prediction files (default is None,
+        i.e. the default of `concurrent.futures.ThreadPoolExecutor`)
 
     Raises
     ------
     NotImplementedError :
         when the extension cannot be read properly
+    ValueError :
+        when the predictions do not match the folds of the submission
 
     """
-    # Create database url
-    db_url = URL(**config)
-    db = create_engine(db_url)
-
-    # Create a configured "Session" class
-    Session = sessionmaker(db)
-
-    # Link the relational model to the database
-    Model.metadata.create_all(db)
-
-    # Connect to the dabase and perform action
-    with db.connect() as conn:
-        session = Session(bind=conn)
-
+    with session_scope(config) as session:
         submission = select_submissions_by_id(session, submission_id)
-
-        for fold_id, cv_fold in enumerate(submission.on_cv_folds):
-            cv_fold.full_train_y_pred = _load_submission(
-                prediction_path, fold_id, 'train', ext)
-            cv_fold.test_y_pred = _load_submission(
-                prediction_path, fold_id, 'test', ext)
-            cv_fold.train_time = _get_time(prediction_path, fold_id, 'train')
-            cv_fold.valid_time = _get_time(prediction_path, fold_id, 'valid')
-            cv_fold.test_time = _get_time(prediction_path, fold_id, 'test')
+        submission_on_cv_folds = sorted(
+            submission.on_cv_folds, key=lambda cv_fold: cv_fold.cv_fold_id)
+        n_folds = len(submission_on_cv_folds)
+
+        if os.path.isfile(prediction_path):
+            folds = _load_bundle(prediction_path, n_folds)
+        else:
+            with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+                folds = list(executor.map(
+                    lambda fold_id: _load_fold(prediction_path, fold_id, ext),
+                    range(n_folds)))
+
+        _check_predictions(submission_on_cv_folds, folds)
+        for cv_fold, fold in zip(submission_on_cv_folds, folds):
+            cv_fold.full_train_y_pred = fold['y_pred_train']
+            cv_fold.test_y_pred = fold['y_pred_test']
+            cv_fold.train_time = fold['train_time']
+            cv_fold.valid_time = fold['valid_time']
+            cv_fold.test_time = fold['test_time']
             cv_fold.state = 'tested'
-            session.commit()
 
         submission.state = 'tested'
-        session.commit()
+
+
+def _load_fold(path, fold_id, ext):
+    """Read the predictions and the times of a fold."""
+    fold = {'y_pred_' + typ: _load_submission(path, fold_id, typ, ext)
+            for typ in ['train', 'test']}
+    fold.update({typ + '_time': _get_time(path, fold_id, typ)
+                 for typ in ['train', 'valid', 'test']})
+    return fold
+
+
+def _load_bundle(bundle_file, n_folds):
+    """Read the predictions and the times of all folds from an archive."""
+    with np.load(bundle_file) as bundle:
+        folds = []
+        for fold_id in range(n_folds):
+            fold = {}
+            for key in ['y_pred_train', 'y_pred_test', 'train_time',
+                        'valid_time', 'test_time']:
+                name = '{}_{}'.format(key, fold_id)
+                if name not in bundle:
+                    raise ValueError(
+                        "Missing '{}' in {}".format(name, bundle_file))
+                fold[key] = bundle[name]
+            for key in ['train_time', 'valid_time', 'test_time']:
+                fold[key] = float(fold[key])
+            folds.append(fold)
+    return folds
+
+
+def _check_predictions(submission_on_cv_folds, folds):
+    """Check that the predictions can be indexed by the fold indices."""
+    n_test = {len(fold['y_pred_test']) for fold in folds}
+    if len(n_test) > 1:
+        raise ValueError('The test predictions of the folds have different '
+                         'lengths: {}'.format(sorted(n_test)))
+    for fold_id, (submission_on_cv_fold, fold) in enumerate(
+            zip(submission_on_cv_folds, folds)):
+        cv_fold = submission_on_cv_fold.cv_fold
+        # the train or the test indices of a fold can be empty
+        n_samples = max([indices.max() + 1
+                         for indices in (cv_fold.train_is, cv_fold.test_is)
+                         if indices.size] + [0])
+        if len(fold['y_pred_train']) < n_samples:
+            raise ValueError(
+                'The train predictions of fold {} have {} samples while the '
+                'fold indices require at least {}'.format(
+                    fold_id, len(fold['y_pred_train']), n_samples))
 
 
 def _load_submission(path, fold_id, typ, ext):
@@ -339,13 +471,16 @@ def _load_submission(path, fold_id, typ, ext):
     if typ not in ['train', 'test']:
         raise ValueError("Only 'train' or 'test' are expected for arg 'typ'")
 
-    if ext.lower() in ['npy', 'npz']:
-        return np.load(pred_file)['y_pred']
+    if ext.lower() == 'npz':
+        with np.load(pred_file) as predictions:
+            return predictions['y_pred']
+    elif ext.lower() == 'npy':
+        return np.load(pred_file)
     elif ext.lower() == 'csv':
-        return np.loadfromtxt(pred_file)
+        return np.loadtxt(pred_file, delimiter=',')
     else:
-        return NotImplementedError("No reader implemented for extension {ext}"
-                                   .format(ext))
+        raise NotImplementedError("No reader implemented for extension {}"
+                                  .format(ext))
 
 
 def _get_time(path, fold_id, typ):
@@ -390,59 +525,96 @@ def score_submission(config, submission_id):
         when the state of the submission is not 'tested'
         (only a submission with state 'tested' can be scored)
     """
+    with session_scope(config) as session:
+        submission = select_submissions_by_id(session, submission_id)
+        _score_submissions(session, submission.event, [submission])
 
-    # Create database url
-    db_url = URL(**config)
-    db = create_engine(db_url)
 
-    # Create a configured "Session" class
-    Session = sessionmaker(db)
+def score_submissions(config, event_name, submission_ids, n_jobs=None):
+    """
+    Score submissions of an event and change their state to 'scored'
 
-    # Link the relational model to the database
-    Model.metadata.create_all(db)
+    The ground truths and the score types are loaded once for all the
+    submissions, which are stored in a single transaction.
 
-    # Connect to the dabase and perform action
-    with db.connect() as conn:
-        session = Session(bind=conn)
+    Parameters
+    ----------
+    config : dict
+        configuration
+    event_name : str
+        name of the RAMP event
+    submission_ids : list of int
+        ids of the submissions
+    n_jobs : int or None, default is None
+        number of processes scoring the submissions, the current process
+        if None
 
-        submission = select_submissions_by_id(session, submission_id)
+    Raises
+    ------
+    ValueError :
+        when the state of a submission is not 'tested' or when it is not a
+        submission of the event
+    """
+    with session_scope(config) as session:
+        event = select_event_by_name(session, event_name)
+        submissions = select_submissions_by_ids(session, submission_ids)
+        for submission in submissions:
+            if submission.event_team.event_id != event.id:
+                raise ValueError('Submission {} is not a submission of the'
+                                 ' event "{}"'.format(submission.id,
+                                                      event_name))
+        _score_submissions(session, event, submissions, n_jobs)
+
+
+def _score_submissions(session, event, submissions, n_jobs=None):
+    # We are conservative:
+    # only score if all stages (train, test, validation)
+    # were completed. submission_on_cv_fold compute scores can be called
+    # manually if needed for submission in various error states.
+    for submission in submissions:
         if submission.state != 'tested':
             raise ValueError('Submission state must be "tested"'
                              ' to score, not "{}"'.format(submission.state))
+    bulk_score_submissions(session, event, submissions, n_jobs)
 
-        # We are conservative:
-        # only score if all stages (train, test, validation)
-        # were completed. submission_on_cv_fold compute scores can be called
-        # manually if needed for submission in various error states.
-        for submission_on_cv_fold in submission.on_cv_folds:
-            submission_on_cv_fold.session = session
-            submission_on_cv_fold.compute_train_scores(session)
-            submission_on_cv_fold.compute_valid_scores(session)
-            submission_on_cv_fold.compute_test_scores(session)
-            submission_on_cv_fold.state = 'scored'
-        session.commit()
-        submission.compute_test_score_cv_bag(session)
-        submission.compute_valid_score_cv_bag(session)
-        # Means and stds were constructed on demand by fetching fold times.
-        # It was slow because submission_on_folds contain also possibly large
-        # predictions. If postgres solves this issue (which can be tested on
-        # the mean and std scores on the private leaderbord), the
-        # corresponding columns (which are now redundant) can be deleted in
-        # Submission and this computation can also be deleted.
-        submission.train_time_cv_mean = np.mean(
-            [ts.train_time for ts in submission.on_cv_folds])
-        submission.valid_time_cv_mean = np.mean(
-            [ts.valid_time for ts in submission.on_cv_folds])
-        submission.test_time_cv_mean = np.mean(
-            [ts.test_time for ts in submission.on_cv_folds])
-        submission.train_time_cv_std = np.std(
-            [ts.train_time for ts in submission.on_cv_folds])
-        submission.valid_time_cv_std = np.std(
-            [ts.valid_time for ts in submission.on_cv_folds])
-        submission.test_time_cv_std = np.std(
-            [ts.test_time for ts in submission.on_cv_folds])
-        submission.state = 'scored'
-        session.commit()
+
+def score_event_ensemble(config, event_name, version=None):
+    """
+    Score the stored ensemble predictions of an event with all its score
+    types, without running the ensemble selection again
+
+    Parameters
+    ----------
+    config : dict
+        configuration
+    event_name : str
+        name of the RAMP event
+    version : int or None, default is None
+        version of the ensemble, the latest one if None
+
+    Returns
+    -------
+    scores : dict
+        the 'combined_valid', 'foldwise_valid', 'combined_test' and
+        'foldwise_test' scores for each score type name
+
+    Raises
+    ------
+    ValueError :
+        when no ensemble is stored for the event
+    """
+    with session_scope(config) as session:
+        event = select_event_by_name(session, event_name)
+        query = (session.query(EventEnsemble)
+                 .filter(EventEnsemble.event_id == event.id)
+                 .options(undefer_group('predictions')))
+        if version is not None:
+            query = query.filter(EventEnsemble.version == version)
+        ensemble = query.order_by(EventEnsemble.version.desc()).first()
+        if ensemble is None:
+            raise ValueError('No ensemble stored for the event "{}"'
+                             .format(event_name))
+        return ensemble.compute_scores()
 
 
 def set_submission_max_ram(config, submission_id, max_ram_mb):
@@ -458,23 +630,9 @@ def set_submission_max_ram(config, submission_id, max_ram_mb):
     max_ram_mb : float
         max ram usage in MB
     """
-    # Create database url
-    db_url = URL(**config)
-    db = create_engine(db_url)
-
-    # Create a configured "Session" class
-    Session = sessionmaker(db)
-
-    # Link the relational model to the database
-    Model.metadata.create_all(db)
-
-    # Connect to the dabase and perform action
-    with db.connect() as conn:
-        session = Session(bind=conn)
-
+    with session_scope(config) as session:
         submission = select_submissions_by_id(session, submission_id)
         submission.max_ram = max_ram_mb
-        session.commit()
 
 
 def set_submission_error_msg(config, submission_id, error_msg):
@@ -491,38 +649,12 @@ def set_submission_error_msg(config, submission_id, error_msg):
         message error
     """
 
-    # Create database url
-    db_url = URL(**config)
-    db = create_engine(db_url)
-
-    # Create a configured "Session" class
-    Session = sessionmaker(db)
-
-    # Link the relational model to the database
-    Model.metadata.create_all(db)
-
-    # Connect to the dabase and perform action
-    with db.connect() as conn:
-        session = Session(bind=conn)
-
+    with session_scope(config) as session:
         submission = select_submissions_by_id(session, submission_id)
         submission.error_msg = error_msg
-        session.commit()
 
 
 def get_event_nb_folds(config, event_name):
-    # Create database url
-    db_url = URL(**config)
-    db = create_engine(db_url)
-
-    # Create a configured "Session" class
-    Session = sessionmaker(db)
-
-    # Link the relational model to the database
-    Model.metadata.create_all(db)
-
-    # Connect to the dabase and perform action
-    with db.connect() as conn:
-        session = Session(bind=conn)
+    with session_scope(config) as session:
         event = select_event_by_name(session, event_name)
         return len(event.cv_folds)
@@ -0,0 +1,289 @@
+"""
+RAMP database connexion management
+
+Process-wide registry of engines and session factories shared by the
+functions of the backend API
+"""
+from __future__ import print_function, absolute_import
+
+import time
+import threading
+from contextlib import contextmanager
+
+from sqlalchemy import union
+from sqlalchemy import select
+from sqlalchemy import bindparam
+from sqlalchemy import type_coerce
+from sqlalchemy import LargeBinary
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.engine.url import URL
+
+from ..model import Model
+from ..model import NumpyType
+from ..model.datatype import get_prediction_store_path
+from ..model.datatype import get_stored_digest
+from ..model.datatype import is_legacy
+from ..model.datatype import loads_array
+from ..model.datatype import remove_stored_array
+
+__all__ = [
+    'get_engine',
+    'get_session_maker',
+    'session_scope',
+    'setup_db',
+    'dispose_engines',
+    'convert_numpy_columns',
+    'remove_unreferenced_arrays',
+]
+
+POOL_KEYS = [
+    'pool_size',
+    'max_overflow',
+    'pool_timeout',
+    'pool_recycle',
+    'pool_pre_ping',
+]
+"""list of str: optional connection pool parameters of the config section"""
+
+_ENGINES = {}
+_SESSION_MAKERS = {}
+_LOCK = threading.Lock()
+
+
+def _config_key(config):
+    """Hashable key identifying a database configuration."""
+    return tuple(sorted((key, str(value)) for key, value in config.items()))
+
+
+def get_engine(config):
+    """
+    Get the engine associated with a database configuration
+
+    The engine, and thus its connection pool, is created once per process
+    and per configuration and reused by all subsequent calls.
+
+    Parameters
+    ----------
+    config : dict
+        configuration of the database connexion. The optional keys listed
+        in `POOL_KEYS` are used to configure the connection pool.
+
+    Returns
+    -------
+    `sqlalchemy.engine.Engine` instance
+
+    """
+    key = _config_key(config)
+    engine = _ENGINES.get(key)
+    if engine is None:
+        with _LOCK:
+            engine = _ENGINES.get(key)
+            if engine is None:
+                url_config = {k: v for k, v in config.items()
+                              if k not in POOL_KEYS}
+                pool_config = {k: v for k, v in config.items()
+                               if k in POOL_KEYS}
+                engine = create_engine(URL(**url_config), **pool_config)
+                _ENGINES[key] = engine
+                _SESSION_MAKERS[key] = sessionmaker(
+                    bind=engine, expire_on_commit=False)
+    return engine
+
+
+def get_session_maker(config):
+    """
+    Get the configured "Session" class of a database configuration
+
+    Parameters
+    ----------
+    config : dict
+        configuration of the database connexion
+
+    Returns
+    -------
+    `sqlalchemy.orm.sessionmaker` instance
+
+    """
+    get_engine(config)
+    return _SESSION_MAKERS[_config_key(config)]
+
+
+@contextmanager
+def session_scope(config):
+    """
+    Provide a transactional scope around a series of operations
+
+    The transaction is committed when the block exits normally and rolled
+    back if an exception is raised. Objects loaded in the scope are not
+    expired on commit so that they can still be read once it is closed.
+
+    Parameters
+    ----------
+    config : dict
+        configuration of the database connexion
+
+    Yields
+    ------
+    session : `sqlalchemy.orm.Session`
+        database connexion session
+
+    """
+    session = get_session_maker(config)()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def setup_db(config):
+    """
+    Create the tables of the RAMP model which do not exist yet
+
+    This is a one-time operation which should be run when deploying the
+    database, not before each query.
+
+    Parameters
+    ----------
+    config : dict
+        configuration of the database connexion
+
+    """
+    Model.metadata.create_all(get_engine(config))
+
+
+def dispose_engines():
+    """Close the connection pools and empty the engine registry."""
+    with _LOCK:
+        for engine in _ENGINES.values():
+            engine.dispose()
+        _ENGINES.clear()
+        _SESSION_MAKERS.clear()
+
+
+def convert_numpy_columns(config, batch_size=1000, force=False):
+    """
+    Rewrite the arrays stored in the legacy pickled format
+
+    All the `NumpyType` columns of the RAMP model are scanned by batches of
+    rows, each batch being rewritten in its own transaction, so that the
+    conversion can be interrupted and resumed.
+
+    Parameters
+    ----------
+    config : dict
+        configuration of the database connexion
+    batch_size : int, optional
+        number of rows read and rewritten per transaction (default is 1000)
+    force : bool, optional
+        whether to also rewrite the rows already in the binary layout, e.g.
+        to change their codec (default is False)
+
+    Returns
+    -------
+    n_rows : int
+        number of rewritten rows
+
+    """
+    engine = get_engine(config)
+    n_rows = 0
+    for table in Model.metadata.sorted_tables:
+        columns = [column for column in table.columns
+                   if isinstance(column.type, NumpyType)]
+        if not columns:
+            continue
+        primary_key, = table.primary_key.columns
+        query = (select([primary_key] +
+                        [type_coerce(column, LargeBinary).label(column.name)
+                         for column in columns])
+                 .where(primary_key > bindparam('last_id'))
+                 .order_by(primary_key)
+                 .limit(batch_size))
+        last_id = -1
+        while True:
+            with engine.begin() as conn:
+                rows = conn.execute(query, last_id=last_id).fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                # rows are grouped by set of non-NULL columns so that each
+                # group is rewritten with a single executemany
+                updates = {}
+                for row in rows:
+                    blobs = {column.name: row[column.name]
+                             for column in columns
+                             if row[column.name] is not None}
+                    if not force and not any(
+                            is_legacy(blob) for blob in blobs.values()):
+                        continue
+                    values = {name: loads_array(blob)
+                              for name, blob in blobs.items()}
+                    values['_id'] = row[0]
+                    updates.setdefault(tuple(sorted(blobs)), []).append(
+                        values)
+                for names, values in updates.items():
+                    update = (table.update()
+                              .where(primary_key == bindparam('_id'))
+                              .values({name: bindparam(name)
+                                       for name in names}))
+                    conn.execute(update, values)
+                    n_rows += len(values)
+    return n_rows
+
+
+def remove_unreferenced_arrays(session, blobs, grace_period=3600):
+    """
+    Remove from the prediction store the arrays no row refers to anymore
+
+    The store is shared by all the external `NumpyType` columns and an
+    array is written once for identical contents, so that the arrays of
+    deleted rows are only removed when no other row holds the same blob.
+    The rows holding the blobs are found with a single query on the
+    indexed external columns. Call it once the deletion of the rows is
+    committed.
+
+    An array written or reused by a transaction which is not committed yet
+    is not seen in the database, so the arrays written or reused during the
+    grace period are kept.
+
+    Parameters
+    ----------
+    session : `sqlalchemy.orm.Session`
+        database connexion session
+    blobs : list of bytes
+        raw values of the external columns of the deleted rows
+    grace_period : float, optional
+        seconds before the query during which the written or reused arrays
+        are kept (default is 3600)
+
+    Returns
+    -------
+    n_arrays : int
+        number of removed arrays
+
+    """
+    store_path = get_prediction_store_path()
+    if store_path is None:
+        return 0
+    blobs = {get_stored_digest(blob): bytes(blob) for blob in blobs}
+    blobs.pop(None, None)
+    if len(blobs) == 0:
+        return 0
+    columns = [type_coerce(column, LargeBinary)
+               for table in Model.metadata.sorted_tables
+               for column in table.columns
+               if isinstance(column.type, NumpyType) and column.type.external]
+    before = time.time() - grace_period
+    query = union(*[select([column]).where(column.in_(list(blobs.values())))
+                    for column in columns])
+    referenced_blobs = set(bytes(blob) for blob, in session.execute(query))
+    n_arrays = 0
+    for digest, blob in blobs.items():
+        if (blob not in referenced_blobs and
+                remove_stored_array(store_path, digest, before=before)):
+            n_arrays += 1
+    return n_arrays
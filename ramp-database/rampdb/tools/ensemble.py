@@ -0,0 +1,451 @@
+"""
+Greedy forward selection of ensembles of submissions (Caruana's algorithm)
+
+The combination used by all the prediction types of ramp-workflow is the
+NaN-aware mean of their predictions. For these types, the search keeps the
+running sum and count of the predictions of the current ensemble, so that
+evaluating a candidate costs a single vector addition and a score call
+instead of recombining the whole ensemble. The predictions of all the
+models are stacked in a single array, and the candidates of a greedy step
+are scored in one NumPy pass for the common score types of ramp-workflow.
+"""
+from __future__ import print_function, absolute_import
+
+import time
+
+import numpy as np
+
+from ..utils import import_module_from_source
+
+try:
+    from rampwf.prediction_types.base import BasePrediction
+except ImportError:  # ramp-workflow is only needed to combine predictions
+    BasePrediction = None
+
+__all__ = [
+    'EnsembleSearch',
+    'get_warm_start_index_list',
+    'prune_candidates',
+    'select_ensemble',
+]
+
+BATCH_SIZE = 2 ** 24
+"""int: maximum number of combined values scored in one pass"""
+
+
+def _rmse(y_true, y_preds):
+    # averaged over the samples and the outputs of multi-output regressions
+    return np.sqrt(np.mean(np.square(y_true - y_preds),
+                           axis=tuple(range(1, y_preds.ndim))))
+
+
+def _accuracy(y_true, y_preds):
+    y_true_label_index = np.argmax(y_true, axis=1)
+    y_pred_label_index = np.argmax(y_preds, axis=2)
+    return np.mean(y_pred_label_index == y_true_label_index, axis=1)
+
+
+def _negative_log_likelihood(y_true, y_preds):
+    y_proba_normalized = y_preds / np.sum(y_preds, axis=2, keepdims=True)
+    # Kaggle's rule
+    y_proba_normalized = np.maximum(y_proba_normalized, 10 ** -15)
+    y_proba_normalized = np.minimum(y_proba_normalized, 1 - 10 ** -15)
+    scores = - np.sum(np.log(y_proba_normalized) * y_true, axis=2)
+    return np.mean(scores, axis=1)
+
+
+def _roc_auc(y_true, y_preds):
+    # Mann-Whitney statistic of the probabilities of the second class, ties
+    # getting the average of their ranks
+    y_true = np.argmax(y_true, axis=1) == 1
+    y_score = y_preds[:, :, 1]
+    n_samples = y_score.shape[1]
+    order = np.argsort(y_score, axis=1, kind='mergesort')
+    y_sorted = np.take_along_axis(y_score, order, axis=1)
+    rank = np.arange(1, n_samples + 1)
+    is_first = np.ones(y_sorted.shape, dtype=bool)
+    is_first[:, 1:] = y_sorted[:, 1:] != y_sorted[:, :-1]
+    is_last = np.ones(y_sorted.shape, dtype=bool)
+    is_last[:, :-1] = is_first[:, 1:]
+    first_rank = np.maximum.accumulate(
+        np.where(is_first, rank, 0), axis=1)
+    last_rank = np.minimum.accumulate(
+        np.where(is_last, rank, n_samples + 1)[:, ::-1], axis=1)[:, ::-1]
+    ranks = np.empty(y_sorted.shape)
+    np.put_along_axis(ranks, order, (first_rank + last_rank) / 2., axis=1)
+    n_pos = np.sum(y_true)
+    n_neg = n_samples - n_pos
+    return ((np.sum(ranks[:, y_true], axis=1) - n_pos * (n_pos + 1) / 2.) /
+            (n_pos * n_neg))
+
+
+BATCH_SCORES = {
+    'RMSE': _rmse,
+    'Accuracy': _accuracy,
+    'NegativeLogLikelihood': _negative_log_likelihood,
+    'ROCAUC': _roc_auc,
+}
+"""dict: batched versions of the score types of ramp-workflow, called with
+the ground truths and the stacked combined predictions of the candidates"""
+
+
+def _get_batch_score(score_type):
+    """Batched version of a score type, None if there is none."""
+    if (score_type is None or
+            not type(score_type).__module__.startswith('rampwf.')):
+        return None
+    return BATCH_SCORES.get(type(score_type).__name__)
+
+
+def _is_mean_combine(Predictions):
+    """Whether the predictions are combined with the default NaN-aware mean.
+
+    Parameters
+    ----------
+    Predictions : class
+        The prediction type.
+
+    Returns
+    -------
+    is_mean : bool
+    """
+    if BasePrediction is None:
+        return False
+    combine = getattr(Predictions.combine, '__func__', None)
+    return combine is getattr(BasePrediction.combine, '__func__', None)
+
+
+class EnsembleSearch(object):
+    """Greedy forward selection of predictions on a single fold.
+
+    Combination with replacement, what Caruana suggests. Basically, if a
+    model is added several times, it's upweighted, leading to
+    integer-weighted ensembles.
+
+    Parameters
+    ----------
+    predictions_list : list of instances of Predictions
+        Each element of the list is an instance of Predictions of a model
+        on the same (cross-validation valid) data points.
+    ground_truths : instance of Predictions
+        The ground truth.
+    score_function : callable
+        The score function, called with ``ground_truths`` and the combined
+        predictions.
+    is_lower_the_better : bool
+        Whether a lower score is a better score.
+    score_type : score type object or None, default is None
+        The score type of ``score_function``. For the score types in
+        `BATCH_SCORES`, all the candidates of a greedy step are scored at
+        once. Custom score types are called candidate per candidate.
+    """
+
+    def __init__(self, predictions_list, ground_truths, score_function,
+                 is_lower_the_better, score_type=None):
+        self.predictions_list = predictions_list
+        self.ground_truths = ground_truths
+        self.score_function = score_function
+        self.is_lower_the_better = is_lower_the_better
+        self.Predictions = type(predictions_list[0])
+        self.is_mean = _is_mean_combine(self.Predictions)
+        self._batch_score = None
+        if self.is_mean:
+            # (n_models, n_samples[, n_classes]) contiguous arrays
+            y_preds = np.array(
+                [predictions.y_pred for predictions in predictions_list])
+            # np.nanmean accumulates integers as floats
+            if y_preds.dtype.kind not in 'fc':
+                y_preds = y_preds.astype(np.float64)
+            self._present = ~np.isnan(y_preds)
+            self._values = np.where(self._present, y_preds, 0)
+            del y_preds
+            self._batch_score = _get_batch_score(score_type)
+            self._y_true = np.asarray(ground_truths.y_pred)
+        # running sum and count of the last combined ensemble
+        self._index_list = ()
+        self._sum = None
+        self._count = None
+
+    def _is_better(self, score, best_score):
+        if self.is_lower_the_better:
+            return score < best_score
+        return score > best_score
+
+    def _running_sum(self, index_list):
+        """Sum and count of the predictions of an ensemble.
+
+        The sums of the last ensemble are reused when ``index_list`` extends
+        it. The predictions are added in the order of ``index_list``, which
+        is the order used by np.nanmean, so that the combined predictions are
+        exactly the same.
+        """
+        index_list = tuple(int(i) for i in index_list)
+        n_common = len(self._index_list)
+        if index_list[:n_common] != self._index_list or n_common == 0:
+            n_common = 0
+            self._sum = np.zeros_like(self._values[0])
+            self._count = np.zeros(self._sum.shape, dtype=np.intp)
+        for i in index_list[n_common:]:
+            self._sum = self._sum + self._values[i]
+            self._count = self._count + self._present[i]
+        self._index_list = index_list
+        return self._sum, self._count
+
+    def _mean(self, total, count):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.Predictions(y_pred=total / count)
+
+    def combine(self, index_list):
+        """Combine the predictions of an ensemble.
+
+        Parameters
+        ----------
+        index_list : list of integers
+            Indices of the models of the ensemble.
+
+        Returns
+        -------
+        combined_predictions : instance of Predictions
+        """
+        if not self.is_mean:
+            return self.Predictions.combine(
+                self.predictions_list, index_list)
+        return self._mean(*self._running_sum(index_list))
+
+    def score(self, index_list):
+        """Score of the combined predictions of an ensemble."""
+        return self.score_function(
+            self.ground_truths, self.combine(index_list))
+
+    def _candidate_scores(self, best_index_list):
+        """Scores of the ensembles extended by each of the models."""
+        n_models = len(self.predictions_list)
+        if not self.is_mean:
+            return np.array([
+                self.score_function(
+                    self.ground_truths, self.Predictions.combine(
+                        self.predictions_list,
+                        np.append(best_index_list, i)))
+                for i in range(n_models)])
+        total, count = self._running_sum(best_index_list)
+        scores = []
+        batch_size = max(1, BATCH_SIZE // max(1, total.size))
+        for start in range(0, n_models, batch_size):
+            totals = total + self._values[start:start + batch_size]
+            counts = count + self._present[start:start + batch_size]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                y_preds = totals / counts
+            # points without any prediction are handled by the score
+            # function of the score type
+            if self._batch_score is not None and np.all(counts):
+                scores.extend(self._batch_score(self._y_true, y_preds))
+            else:
+                scores.extend(
+                    self.score_function(
+                        self.ground_truths, self.Predictions(y_pred=y_pred))
+                    for y_pred in y_preds)
+        return np.array(scores, dtype=float)
+
+    def next_best(self, best_index_list):
+        """Find the model improving most the combination when added to it.
+
+        Parameters
+        ----------
+        best_index_list : list of integers
+            Indices of the current best models.
+
+        Returns
+        -------
+        best_index_list : list of integers
+            Indices of the models in the new combination. If the same as
+            input, no models were found improving the score.
+        best_score : float
+            Score of the new combination.
+        """
+        best_score = self.score(best_index_list)
+        scores = self._candidate_scores(best_index_list)
+        # the first best candidate is kept, scores which cannot be compared
+        # (NaN) are ignored
+        if self.is_lower_the_better:
+            scores[np.isnan(scores)] = np.inf
+            best_index = int(np.argmin(scores))
+        else:
+            scores[np.isnan(scores)] = -np.inf
+            best_index = int(np.argmax(scores))
+        if self._is_better(scores[best_index], best_score):
+            return (np.append(best_index_list, best_index),
+                    scores[best_index])
+        else:
+            return best_index_list, best_score
+
+
+def select_ensemble(problem_path, score_name, y_preds, y_true,
+                    best_index_list, max_n_ensemble, max_time=None,
+                    ensemble_score=None, restart_index_list=None):
+    """Run the greedy forward selection on a single fold.
+
+    Only arrays and names are passed so that the selection of the folds can
+    run in worker processes, joblib memory-mapping the large arrays.
+
+    Parameters
+    ----------
+    problem_path : str
+        Path to the problem.py of the kit, defining the prediction and
+        score types.
+    score_name : str
+        Name of the score type used to select the models.
+    y_preds : ndarray, shape (n_models, n_samples[, n_classes])
+        Stacked predictions of the models on the fold.
+    y_true : array-like, shape (n_samples,)
+        Targets of the fold.
+    best_index_list : list of integers
+        Indices of the models to start the selection with.
+    max_n_ensemble : int
+        Maximum size of the ensemble.
+    max_time : float or None, default is None
+        Wall-clock budget of the selection in seconds, counted from its
+        start, after which no more greedy steps are taken and the best
+        ensemble found so far is returned. The time is not bounded if None.
+    ensemble_score : float or None, default is None
+        Score of the ensemble of ``best_index_list`` when it was selected,
+        if the selection is resumed from it.
+    restart_index_list : list of integers or None, default is None
+        Indices of the models to restart the selection with when the
+        ensemble of ``best_index_list`` now scores worse than
+        ``ensemble_score``, i.e. when the predictions of its models changed.
+
+    Returns
+    -------
+    best_index_list : list of integers
+        Indices of the selected models.
+    score : float
+        Score of the ensemble of the selected models, also when no step was
+        taken.
+    steps : list of (list of integers, float)
+        The ensemble and the score of each step of the selection.
+    """
+    start_time = time.time()
+    module = import_module_from_source(problem_path, 'problem')
+    score_type = [score_type for score_type in module.score_types
+                  if score_type.name == score_name][0]
+    predictions_list = [module.Predictions(y_pred=y_pred)
+                        for y_pred in y_preds]
+    ground_truths = module.Predictions(y_true=y_true)
+    search = EnsembleSearch(
+        predictions_list, ground_truths, score_type.score_function,
+        score_type.is_lower_the_better, score_type)
+    best_index_list = np.asarray(best_index_list)
+    score = search.score(best_index_list)
+    if (ensemble_score is not None and restart_index_list is not None and
+            search._is_better(ensemble_score, score)):
+        best_index_list = np.asarray(restart_index_list)
+        score = search.score(best_index_list)
+    steps = []
+    improvement = True
+    while improvement and len(best_index_list) < max_n_ensemble:
+        if max_time is not None and time.time() - start_time >= max_time:
+            break
+        old_best_index_list = best_index_list
+        best_index_list, score = search.next_best(best_index_list)
+        improvement = len(best_index_list) != len(old_best_index_list)
+        steps.append((old_best_index_list, score))
+    return best_index_list, score, steps
+
+
+def get_warm_start_index_list(ensemble_ids, candidate_ids, max_n_ensemble):
+    """Map a previously selected ensemble onto the current candidates.
+
+    The greedy selection can resume from the ensemble of the last
+    computation when models were only added since then. It is restarted
+    from scratch when one of the selected models is not a candidate anymore
+    (deleted or excluded from the ensemble) or when the ensemble is already
+    full, since the new models could then never enter it.
+
+    Parameters
+    ----------
+    ensemble_ids : array-like of integers or None
+        Ids of the models of the previous ensemble, with repetitions.
+    candidate_ids : list of integers
+        Ids of the current candidate models.
+    max_n_ensemble : int
+        Maximum size of the ensemble.
+
+    Returns
+    -------
+    best_index_list : ndarray of integers or None
+        Indices of the previous ensemble in ``candidate_ids``, None if the
+        selection cannot be resumed.
+    """
+    if ensemble_ids is None or len(ensemble_ids) == 0:
+        return None
+    if len(ensemble_ids) >= max_n_ensemble:
+        return None
+    index = {candidate_id: i for i, candidate_id in enumerate(candidate_ids)}
+    try:
+        return np.array([index[ensemble_id] for ensemble_id in ensemble_ids])
+    except KeyError:
+        return None
+
+
+def _is_duplicate(y_preds, y_pred, tolerance):
+    """Whether y_pred is within tolerance of one of y_preds everywhere."""
+    # NaN predictions (missing points) only match NaN predictions
+    is_both_nan = np.isnan(y_preds) & np.isnan(y_pred)
+    with np.errstate(invalid='ignore'):
+        difference = np.where(is_both_nan, 0, np.abs(y_preds - y_pred))
+        is_close = difference.reshape(len(y_preds), -1) <= tolerance
+    return bool(np.any(np.all(is_close, axis=1)))
+
+
+def prune_candidates(y_preds, valid_scores, is_lower_the_better,
+                     max_n_candidates=None, tolerance=None, keep=()):
+    """Select the models worth considering in the greedy selection.
+
+    The models are visited from the best to the worst valid score. A model
+    is ignored when its predictions are all within ``tolerance`` of the ones
+    of a better model already selected, and the visit stops once
+    ``max_n_candidates`` models are selected.
+
+    Parameters
+    ----------
+    y_preds : ndarray, shape (n_models, n_samples[, n_classes])
+        Stacked predictions of the models on the fold.
+    valid_scores : array-like of floats, shape (n_models,)
+        Valid scores of the models, NaN scores being the worst.
+    is_lower_the_better : bool
+        Whether a lower score is a better score.
+    max_n_candidates : int or None, default is None
+        Maximum number of selected models. Not bounded if None.
+    tolerance : float or None, default is None
+        Maximum absolute difference between the predictions of two models
+        considered identical. Models are not deduplicated if None.
+    keep : list of integers, default is ()
+        Indices of models to select in any case, e.g. the models of the
+        ensemble the selection is resumed from.
+
+    Returns
+    -------
+    candidate_indices : ndarray of integers
+        Sorted indices of the selected models.
+    """
+    valid_scores = np.asarray(valid_scores, dtype=float)
+    if not is_lower_the_better:
+        valid_scores = -valid_scores
+    valid_scores[np.isnan(valid_scores)] = np.inf
+    order = np.argsort(valid_scores, kind='mergesort')
+    candidate_indices = sorted(set(int(i) for i in keep))
+    is_candidate = np.zeros(len(y_preds), dtype=bool)
+    is_candidate[candidate_indices] = True
+    for i in order:
+        if (max_n_candidates is not None and
+                len(candidate_indices) >= max_n_candidates):
+            break
+        if is_candidate[i]:
+            continue
+        if (tolerance is not None and len(candidate_indices) > 0 and
+                _is_duplicate(y_preds[candidate_indices], y_preds[i],
+                              tolerance)):
+            continue
+        candidate_indices.append(int(i))
+        is_candidate[i] = True
+    return np.flatnonzero(is_candidate)
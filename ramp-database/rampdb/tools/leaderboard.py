@@ -0,0 +1,278 @@
+"""
+Materialised leaderboards
+
+The display fields of each submission are kept in a `LeaderboardRow`, and a
+row is only written when one of its fields changed, so that refreshing the
+leaderboards after a submission is scored costs a few rows instead of the
+whole event. The fields are computed from a flat projection of the
+submissions, without loading them.
+"""
+from __future__ import print_function, absolute_import
+
+import os
+
+import numpy as np
+from sqlalchemy import func
+
+from ..model import LeaderboardRow
+from .query import select_leaderboard_data
+
+__all__ = [
+    'get_competition_leaderboard_rows',
+    'get_event_score_types',
+    'update_leaderboard_rows',
+]
+
+_NEW_STATES = ('new', 'training', 'sent_to_training')
+_ERROR_STATES = ('training_error', 'checking_error', 'validating_error',
+                 'testing_error')
+
+
+def get_event_score_types(event):
+    """Score types of an event in the order of the leaderboard columns."""
+    return sorted(event.score_types, key=lambda score_type: score_type.id)
+
+
+def _get_std(mean, square_mean):
+    # the variance is computed in the database as avg(x * x) - avg(x) ** 2,
+    # which can be slightly negative due to rounding
+    return np.sqrt(max(square_mean - mean ** 2, 0.))
+
+
+def _get_scores(records, score_types):
+    score_dict = {record.event_score_type_id: record for record in records}
+    scores = []
+    for score_type in score_types:
+        record = score_dict.get(score_type.id)
+        if record is None:
+            # the score rows of a score type added to the event after the
+            # submission was scored are missing
+            scores.append([np.nan] * 6)
+            continue
+        precision = score_type.precision
+        scores.append([
+            round(record.valid_score_cv_bag, precision),
+            round(record.valid_score_mean, precision),
+            round(_get_std(record.valid_score_mean,
+                           record.valid_score_square_mean), precision + 1),
+            round(record.test_score_cv_bag, precision),
+            round(record.test_score_mean, precision),
+            round(_get_std(record.test_score_mean,
+                           record.test_score_square_mean), precision + 1)])
+    return np.array(scores, dtype=float)
+
+
+def _get_row_values(records, score_types, official_index):
+    """Display fields of a submission, keyed by `LeaderboardRow` column.
+
+    The records are the tuples of the submission returned by
+    `select_leaderboard_data`, one per score.
+    """
+    record = records[0]
+    # same as Submission.is_not_sandbox, name_with_link and state_with_link
+    is_not_sandbox = record.name != os.getenv('RAMP_SANDBOX_DIR',
+                                              'starting_kit')
+    is_leaderboard = bool(
+        is_not_sandbox and record.is_valid and record.state == 'scored')
+    link = '/' + os.path.join(
+        record.hash_, '{}.{}'.format(record.file_type, record.extension))
+    values = dict(
+        event_team_id=record.event_team_id,
+        team_name=record.team_name,
+        submission_name=record.name[:20],
+        name_with_link='<a href={}>{}</a>'.format(link, record.name[:20]),
+        state=record.state,
+        state_with_link='<a href=/{}>{}</a>'.format(
+            os.path.join(record.hash_, 'error.txt'), record.state),
+        submission_timestamp=record.submission_timestamp.replace(
+            microsecond=0),
+        is_public_leaderboard=is_leaderboard,
+        is_private_leaderboard=is_leaderboard,
+        is_in_competition=bool(record.is_in_competition),
+        is_error=record.state in _ERROR_STATES,
+        is_new=record.state in _NEW_STATES and is_not_sandbox,
+        scores=None,
+        official_valid_score=None,
+        official_test_score=None,
+        contributivity=int(round(100 * (record.contributivity or 0))),
+        historical_contributivity=int(round(
+            100 * (record.historical_contributivity or 0))),
+        train_time=None,
+        train_time_std=None,
+        valid_time=None,
+        valid_time_std=None,
+        max_ram=None,
+    )
+    # the scores and the times are only set once the submission is scored
+    if is_leaderboard:
+        scores = _get_scores(records, score_types)
+        values.update(
+            scores=scores,
+            official_valid_score=float(scores[official_index, 0]),
+            official_test_score=float(scores[official_index, 3]),
+            train_time=int(round(record.train_time_cv_mean)),
+            train_time_std=int(round(record.train_time_cv_std)),
+            valid_time=int(round(record.valid_time_cv_mean)),
+            valid_time_std=int(round(record.valid_time_cv_std)),
+            max_ram=(int(round(record.max_ram))
+                     if type(record.max_ram) == float else 0))
+    return values
+
+
+def _is_equal(value, other):
+    # NumpyType reads None back as an object array holding None
+    value, other = [
+        None if isinstance(x, np.ndarray) and x.dtype.hasobject else x
+        for x in (value, other)]
+    if isinstance(value, np.ndarray) or isinstance(other, np.ndarray):
+        # NaN scores compare equal
+        return (isinstance(value, np.ndarray) and
+                isinstance(other, np.ndarray) and
+                value.shape == other.shape and
+                value.tobytes() == other.tobytes())
+    return value == other
+
+
+def update_leaderboard_rows(session, event, submission_ids=None):
+    """Refresh the leaderboard rows of the submissions of an event.
+
+    Only the rows whose display fields changed are written. The caller
+    commits.
+
+    Parameters
+    ----------
+    session :
+        database connexion session
+    event : `Event` instance
+        The event of the submissions.
+    submission_ids : list of int or None, default is None
+        The submissions which may have changed. All the submissions of the
+        event are checked if None, and the rows of the deleted submissions
+        are removed.
+
+    Returns
+    -------
+    rows : list of `LeaderboardRow` instances
+        The rows which were created, updated or deleted.
+    """
+    if submission_ids is not None and len(submission_ids) == 0:
+        return []
+    records = {}
+    for record in select_leaderboard_data(session, event.id, submission_ids):
+        records.setdefault(record.submission_id, []).append(record)
+    row_query = session.query(LeaderboardRow).filter(
+        LeaderboardRow.event_id == event.id)
+    if submission_ids is not None:
+        row_query = row_query.filter(
+            LeaderboardRow.submission_id.in_(submission_ids))
+    rows = {row.submission_id: row for row in row_query}
+
+    score_types = get_event_score_types(event)
+    official_index = [score_type.name for score_type in score_types].index(
+        event.official_score_name)
+    changed_rows = []
+    for submission_id in sorted(records):
+        values = _get_row_values(
+            records[submission_id], score_types, official_index)
+        row = rows.pop(submission_id, None)
+        if row is None:
+            row = LeaderboardRow(submission_id=submission_id,
+                                 event_id=event.id)
+            session.add(row)
+        elif all(_is_equal(getattr(row, key), value)
+                 for key, value in values.items()):
+            continue
+        for key, value in values.items():
+            setattr(row, key, value)
+        changed_rows.append(row)
+    # rows left are the ones of submissions which do not exist anymore
+    for row in sorted(rows.values(), key=lambda row: row.submission_id):
+        session.delete(row)
+        changed_rows.append(row)
+    return changed_rows
+
+
+def _has_window_functions(session):
+    # window functions are supported by sqlite since 3.25
+    dialect = session.get_bind().dialect
+    if dialect.name != 'sqlite':
+        return True
+    return dialect.dbapi.sqlite_version_info >= (3, 25, 0)
+
+
+def _get_competition_order(score, is_lower_the_better):
+    # best score first, ties broken by the earliest submission: by the second
+    # of its timestamp as the pandas tables did, then by id
+    return [score.asc() if is_lower_the_better else score.desc(),
+            LeaderboardRow.submission_timestamp,
+            LeaderboardRow.submission_id]
+
+
+def get_competition_leaderboard_rows(session, event):
+    """Best submission of each team of an event and its competition ranks.
+
+    The best submission of a team is its submission in competition with the
+    best public official score, the earliest one in case of a tie. The teams
+    are ranked by the public and the private official scores of their best
+    submission, the earliest one first in case of a tie. The ranks are
+    computed in the database with window functions, or by ordering the rows
+    in the database if it does not support them.
+
+    Parameters
+    ----------
+    session :
+        database connexion session
+    event : `Event` instance
+
+    Returns
+    -------
+    rows : list of (row, public_rank, private_rank) tuples
+        The `LeaderboardRow` of the best submission of each team with its
+        ranks starting at 1, ordered by public rank.
+    """
+    is_lower_the_better = [
+        score_type.is_lower_the_better for score_type in event.score_types
+        if score_type.name == event.official_score_name][0]
+    public_order = _get_competition_order(
+        LeaderboardRow.official_valid_score, is_lower_the_better)
+    private_order = _get_competition_order(
+        LeaderboardRow.official_test_score, is_lower_the_better)
+
+    def filter_rows(query):
+        return query.filter(LeaderboardRow.event_id == event.id,
+                            LeaderboardRow.is_public_leaderboard,
+                            LeaderboardRow.is_in_competition)
+
+    if not _has_window_functions(session):
+        # the best submission of a team is its first one in public order
+        best_rows = []
+        event_team_ids = set()
+        for row in filter_rows(session.query(LeaderboardRow)).order_by(
+                *public_order):
+            if row.event_team_id not in event_team_ids:
+                event_team_ids.add(row.event_team_id)
+                best_rows.append(row)
+        if len(best_rows) == 0:
+            return []
+        private_ranks = {
+            submission_id: rank for rank, (submission_id,) in enumerate(
+                session.query(LeaderboardRow.submission_id)
+                .filter(LeaderboardRow.id.in_([row.id for row in best_rows]))
+                .order_by(*private_order), 1)}
+        return [(row, rank, private_ranks[row.submission_id])
+                for rank, row in enumerate(best_rows, 1)]
+
+    team_rank = func.row_number().over(
+        partition_by=LeaderboardRow.event_team_id,
+        order_by=public_order).label('team_rank')
+    team_ranks = filter_rows(
+        session.query(LeaderboardRow.id, team_rank)).subquery()
+    public_rank = func.row_number().over(
+        order_by=public_order).label('public_rank')
+    private_rank = func.row_number().over(
+        order_by=private_order).label('private_rank')
+    query = (session.query(LeaderboardRow, public_rank, private_rank)
+             .join(team_ranks, team_ranks.c.id == LeaderboardRow.id)
+             .filter(team_ranks.c.team_rank == 1)
+             .order_by(public_rank))
+    return [tuple(row) for row in query]
@@ -3,7 +3,18 @@ RAMP database helper queries
 """
 from __future__ import print_function, absolute_import
 
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import subqueryload
+
 from ..model import Submission, Event, EventTeam, Team
+from ..model import Extension
+from ..model import SubmissionFile
+from ..model import SubmissionFileTypeExtension
+from ..model import SubmissionScore
+from ..model import SubmissionScoreOnCVFold
+from ..model import WorkflowElement
+from ..model import WorkflowElementType
 
 
 def select_submissions_by_id(session, submission_id):
@@ -33,6 +44,46 @@ def select_submissions_by_id(session, submission_id):
     return submission
 
 
+def select_submissions_by_ids(session, submission_ids, load_cv_folds=False):
+    """
+    Query for all submissions with the given ids in a single round-trip
+
+    Parameters
+    ----------
+    session : `sqlalchemy.orm.Session`
+        database connexion session
+    submission_ids : list of int
+        ids of the requested submissions
+    load_cv_folds : bool, optional
+        whether to eagerly load the submissions on CV folds in the same
+        round-trip (default is False)
+
+    Returns
+    -------
+    List of submissions : List[`rampbkd.model.Submission`]
+        queried submissions, ordered by id
+
+    """
+    submission_ids = list(submission_ids)
+    if not submission_ids:
+        return []
+
+    query = (session
+             .query(Submission)
+             .filter(Submission.id.in_(submission_ids)))
+    if load_cv_folds:
+        query = query.options(subqueryload(Submission.on_cv_folds))
+    submissions = (query
+                   .options(joinedload(Submission.event_team)
+                            .joinedload(EventTeam.event))
+                   .options(joinedload(Submission.event_team)
+                            .joinedload(EventTeam.team))
+                   .order_by(Submission.id)
+                   .all())
+
+    return submissions
+
+
 def select_submissions_by_state(session, event_name, state):
     """
     Query for all submissions of given event with given status
@@ -115,3 +166,131 @@ def select_event_by_name(session, event_name):
     """
     event = session.query(Event).filter(Event.name == event_name).one()
     return event
+
+
+def select_leaderboard_data(session, event_id, submission_ids=None):
+    """
+    Query the leaderboard fields of the submissions of an event in a single
+    round-trip
+
+    The means of the fold scores and of their squares are aggregated in the
+    database, so that neither the fold scores nor the kit are loaded.
+
+    Parameters
+    ----------
+    session :
+        database connexion session
+    event_id : int
+        id of the RAMP event
+    submission_ids : list of int, optional
+        ids of the requested submissions, all the submissions of the event
+        if None (default)
+
+    Returns
+    -------
+    List of tuples
+        one tuple per submission and submission score, ordered by submission
+        id then event score type id. The fields are submission_id,
+        event_team_id, team_name, name, hash_, state, submission_timestamp,
+        is_valid, is_in_competition, contributivity,
+        historical_contributivity, train_time_cv_mean, train_time_cv_std,
+        valid_time_cv_mean, valid_time_cv_std, max_ram, file_type,
+        extension, event_score_type_id, valid_score_cv_bag,
+        test_score_cv_bag, valid_score_mean, valid_score_square_mean,
+        test_score_mean and test_score_square_mean. The file fields are the
+        ones of the first file of the submission and the score fields are
+        None for a submission without scores.
+
+    """
+    def filter_submissions(query):
+        query = (query
+                 .join(EventTeam, EventTeam.id == Submission.event_team_id)
+                 .filter(EventTeam.event_id == event_id))
+        if submission_ids is not None:
+            query = query.filter(Submission.id.in_(submission_ids))
+        return query
+
+    fold_score = SubmissionScoreOnCVFold
+    fold_scores = (session
+                   .query(fold_score.submission_score_id,
+                          func.avg(fold_score.valid_score)
+                          .label('valid_score_mean'),
+                          func.avg(fold_score.valid_score *
+                                   fold_score.valid_score)
+                          .label('valid_score_square_mean'),
+                          func.avg(fold_score.test_score)
+                          .label('test_score_mean'),
+                          func.avg(fold_score.test_score *
+                                   fold_score.test_score)
+                          .label('test_score_square_mean'))
+                   .select_from(fold_score)
+                   .join(SubmissionScore,
+                         SubmissionScore.id == fold_score.submission_score_id)
+                   .join(Submission,
+                         Submission.id == SubmissionScore.submission_id))
+    fold_scores = (filter_submissions(fold_scores)
+                   .group_by(fold_score.submission_score_id)
+                   .subquery())
+    # the leaderboards link to the first file of the submissions
+    first_files = (session
+                   .query(SubmissionFile.submission_id,
+                          func.min(SubmissionFile.id).label('id'))
+                   .select_from(SubmissionFile)
+                   .join(Submission,
+                         Submission.id == SubmissionFile.submission_id))
+    first_files = (filter_submissions(first_files)
+                   .group_by(SubmissionFile.submission_id)
+                   .subquery())
+
+    query = (session
+             .query(Submission.id.label('submission_id'),
+                    Submission.event_team_id,
+                    Team.name.label('team_name'),
+                    Submission.name,
+                    Submission.hash_,
+                    Submission.state,
+                    Submission.submission_timestamp,
+                    Submission.is_valid,
+                    Submission.is_in_competition,
+                    Submission.contributivity,
+                    Submission.historical_contributivity,
+                    Submission.train_time_cv_mean,
+                    Submission.train_time_cv_std,
+                    Submission.valid_time_cv_mean,
+                    Submission.valid_time_cv_std,
+                    Submission.max_ram,
+                    WorkflowElementType.name.label('file_type'),
+                    Extension.name.label('extension'),
+                    SubmissionScore.event_score_type_id,
+                    SubmissionScore.valid_score_cv_bag,
+                    SubmissionScore.test_score_cv_bag,
+                    fold_scores.c.valid_score_mean,
+                    fold_scores.c.valid_score_square_mean,
+                    fold_scores.c.test_score_mean,
+                    fold_scores.c.test_score_square_mean)
+             .select_from(Submission))
+    query = (filter_submissions(query)
+             .join(Team, Team.id == EventTeam.team_id)
+             .outerjoin(first_files,
+                        first_files.c.submission_id == Submission.id)
+             .outerjoin(SubmissionFile,
+                        SubmissionFile.id == first_files.c.id)
+             .outerjoin(WorkflowElement,
+                        WorkflowElement.id ==
+                        SubmissionFile.workflow_element_id)
+             .outerjoin(WorkflowElementType,
+                        WorkflowElementType.id ==
+                        WorkflowElement.workflow_element_type_id)
+             .outerjoin(SubmissionFileTypeExtension,
+                        SubmissionFileTypeExtension.id ==
+                        SubmissionFile.submission_file_type_extension_id)
+             .outerjoin(Extension,
+                        Extension.id ==
+                        SubmissionFileTypeExtension.extension_id)
+             .outerjoin(SubmissionScore,
+                        SubmissionScore.submission_id == Submission.id)
+             .outerjoin(fold_scores,
+                        fold_scores.c.submission_score_id ==
+                        SubmissionScore.id)
+             .order_by(Submission.id, SubmissionScore.event_score_type_id))
+    return query.all()
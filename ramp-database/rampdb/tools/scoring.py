@@ -0,0 +1,245 @@
+"""
+Scoring of trained and tested submissions in bulk
+
+The ground truths and the score types of the event are resolved once for all
+the folds of all the submissions, and the scores are written with one bulk
+update per table.
+"""
+from __future__ import print_function, absolute_import
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sqlalchemy.orm import undefer_group
+from sqlalchemy.orm.util import identity_key
+
+from ..model import EventScoreType
+from ..model import Submission
+from ..model import SubmissionOnCVFold
+from ..model import SubmissionScore
+from ..model import SubmissionScoreOnCVFold
+from ..utils import import_module_from_source
+from .tools import iter_bagged_predictions
+
+__all__ = [
+    'bulk_score_submissions',
+    'compute_submission_scores',
+]
+
+
+def _compute_scores(Predictions, score_types, ground_truths_train,
+                    ground_truths_test, full_train_y_preds, test_y_preds,
+                    train_is_list, test_is_list):
+    """Scores of the folds and bagged scores of a submission."""
+    fold_scores = np.empty((len(full_train_y_preds), len(score_types), 3))
+    valid_predictions_list = []
+    test_predictions_list = []
+    for i, (full_train_y_pred, test_y_pred, train_is, test_is) in\
+            enumerate(zip(full_train_y_preds, test_y_preds, train_is_list,
+                          test_is_list)):
+        full_train_predictions = Predictions(y_pred=full_train_y_pred)
+        test_predictions = Predictions(y_pred=test_y_pred)
+        for j, score_type in enumerate(score_types):
+            fold_scores[i, j] = (
+                score_type.score_function(
+                    ground_truths_train, full_train_predictions, train_is),
+                score_type.score_function(
+                    ground_truths_train, full_train_predictions, test_is),
+                score_type.score_function(
+                    ground_truths_test, test_predictions))
+        valid_predictions_list.append(
+            Predictions(y_pred=full_train_y_pred[test_is]))
+        test_predictions_list.append(test_predictions)
+
+    valid_score_cv_bags = np.empty((len(score_types), len(test_is_list)))
+    for i, combined_predictions in enumerate(iter_bagged_predictions(
+            Predictions, valid_predictions_list,
+            len(ground_truths_train.y_pred), test_is_list)):
+        valid_indexes = combined_predictions.valid_indexes
+        for j, score_type in enumerate(score_types):
+            valid_score_cv_bags[j, i] = score_type.score_function(
+                ground_truths_train, combined_predictions, valid_indexes)
+    test_score_cv_bags = np.empty((len(score_types), len(test_is_list)))
+    for i, combined_predictions in enumerate(iter_bagged_predictions(
+            Predictions, test_predictions_list)):
+        for j, score_type in enumerate(score_types):
+            test_score_cv_bags[j, i] = score_type.score_function(
+                ground_truths_test, combined_predictions)
+    return fold_scores, valid_score_cv_bags, test_score_cv_bags
+
+
+def compute_submission_scores(problem_path, score_names, full_train_y_preds,
+                              test_y_preds, train_is_list, test_is_list,
+                              y_train, y_test):
+    """Score the predictions of a submission on all its folds.
+
+    Only arrays and names are passed so that the submissions can be scored
+    in worker processes.
+
+    Parameters
+    ----------
+    problem_path : str
+        Path to the problem.py of the kit, defining the prediction and
+        score types.
+    score_names : list of str
+        Names of the score types to compute.
+    full_train_y_preds : list of ndarray
+        Predictions of each fold on the full train data.
+    test_y_preds : list of ndarray
+        Predictions of each fold on the test data.
+    train_is_list, test_is_list : list of ndarray
+        Train and valid indices of each fold.
+    y_train, y_test : ndarray
+        Train and test targets.
+
+    Returns
+    -------
+    fold_scores : ndarray, shape (n_folds, n_scores, 3)
+        Train, valid and test scores of each fold.
+    valid_score_cv_bags : ndarray, shape (n_scores, n_folds)
+        Valid scores of the combination of the first folds.
+    test_score_cv_bags : ndarray, shape (n_scores, n_folds)
+        Test scores of the combination of the first folds.
+    """
+    module = import_module_from_source(problem_path, 'problem')
+    score_types = {score_type.name: score_type
+                   for score_type in module.score_types}
+    return _compute_scores(
+        module.Predictions, [score_types[name] for name in score_names],
+        module.Predictions(y_true=y_train), module.Predictions(y_true=y_test),
+        full_train_y_preds, test_y_preds, train_is_list, test_is_list)
+
+
+def bulk_score_submissions(session, event, submissions, n_jobs=None):
+    """Score tested submissions of an event and mark them as scored.
+
+    The ground truths and the score types are loaded once, the predictions
+    of all the submissions are read in one query, and the scores, bagged
+    scores and timing aggregates are written with bulk updates. The caller
+    commits.
+
+    Parameters
+    ----------
+    session :
+        database connexion session
+    event : `Event` instance
+        The event of the submissions.
+    submissions : list of `Submission` instances
+        Submissions in the 'tested' state.
+    n_jobs : int or None, default is None
+        Number of worker processes. The submissions are scored in the
+        current process if None or 1.
+    """
+    if len(submissions) == 0:
+        return
+    submission_ids = [submission.id for submission in submissions]
+    submissions_on_cv_fold = (
+        session.query(SubmissionOnCVFold)
+        .filter(SubmissionOnCVFold.submission_id.in_(submission_ids))
+        .options(undefer_group('predictions'))
+        .order_by(SubmissionOnCVFold.submission_id,
+                  SubmissionOnCVFold.cv_fold_id)
+        .all())
+    folds = {submission_id: [] for submission_id in submission_ids}
+    for submission_on_cv_fold in submissions_on_cv_fold:
+        folds[submission_on_cv_fold.submission_id].append(
+            submission_on_cv_fold)
+
+    event_score_types = event.score_types
+    score_names = [score_type.name for score_type in event_score_types]
+    problem = event.problem
+    arguments = [
+        ([submission_on_cv_fold.full_train_y_pred
+          for submission_on_cv_fold in folds[submission_id]],
+         [submission_on_cv_fold.test_y_pred
+          for submission_on_cv_fold in folds[submission_id]],
+         [submission_on_cv_fold.cv_fold.train_is
+          for submission_on_cv_fold in folds[submission_id]],
+         [submission_on_cv_fold.cv_fold.test_is
+          for submission_on_cv_fold in folds[submission_id]])
+        for submission_id in submission_ids]
+    if n_jobs is None or n_jobs == 1:
+        Predictions = problem.Predictions
+        score_types = [score_type.score_type_object
+                       for score_type in event_score_types]
+        ground_truths_train = problem.ground_truths_train()
+        ground_truths_test = problem.ground_truths_test()
+        results = [
+            _compute_scores(Predictions, score_types, ground_truths_train,
+                            ground_truths_test, *args)
+            for args in arguments]
+    else:
+        y_train = problem.get_targets('train')
+        y_test = problem.get_targets('test')
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = [
+                executor.submit(compute_submission_scores,
+                                problem.module_path, score_names, *args,
+                                y_train=y_train, y_test=y_test)
+                for args in arguments]
+            results = [future.result() for future in futures]
+    results = dict(zip(submission_ids, results))
+
+    # (submission on cv fold id or submission id, score name) -> row id
+    score_on_cv_fold_ids = dict(
+        ((submission_on_cv_fold_id, name), score_id)
+        for score_id, submission_on_cv_fold_id, name in (
+            session.query(SubmissionScoreOnCVFold.id,
+                          SubmissionScoreOnCVFold.submission_on_cv_fold_id,
+                          EventScoreType.name)
+            .filter(SubmissionScoreOnCVFold.submission_score_id ==
+                    SubmissionScore.id)
+            .filter(SubmissionScore.event_score_type_id ==
+                    EventScoreType.id)
+            .filter(SubmissionScore.submission_id.in_(submission_ids))))
+    score_ids = dict(
+        ((submission_id, name), score_id)
+        for score_id, submission_id, name in (
+            session.query(SubmissionScore.id, SubmissionScore.submission_id,
+                          EventScoreType.name)
+            .filter(SubmissionScore.event_score_type_id ==
+                    EventScoreType.id)
+            .filter(SubmissionScore.submission_id.in_(submission_ids))))
+
+    score_on_cv_fold_rows = []
+    score_rows = []
+    submission_on_cv_fold_rows = []
+    submission_rows = []
+    for submission_id in submission_ids:
+        fold_scores, valid_score_cv_bags, test_score_cv_bags =\
+            results[submission_id]
+        for i, submission_on_cv_fold in enumerate(folds[submission_id]):
+            for j, name in enumerate(score_names):
+                score_on_cv_fold_rows.append({
+                    'id': score_on_cv_fold_ids[
+                        (submission_on_cv_fold.id, name)],
+                    'train_score': float(fold_scores[i, j, 0]),
+                    'valid_score': float(fold_scores[i, j, 1]),
+                    'test_score': float(fold_scores[i, j, 2])})
+            submission_on_cv_fold_rows.append(
+                {'id': submission_on_cv_fold.id, 'state': 'scored'})
+        for j, name in enumerate(score_names):
+            score_rows.append({
+                'id': score_ids[(submission_id, name)],
+                'valid_score_cv_bag': float(valid_score_cv_bags[j, -1]),
+                'test_score_cv_bag': float(test_score_cv_bags[j, -1]),
+                'valid_score_cv_bags': valid_score_cv_bags[j],
+                'test_score_cv_bags': test_score_cv_bags[j]})
+        submission_row = {'id': submission_id, 'state': 'scored'}
+        for typ in ['train', 'valid', 'test']:
+            times = [getattr(submission_on_cv_fold, typ + '_time')
+                     for submission_on_cv_fold in folds[submission_id]]
+            submission_row[typ + '_time_cv_mean'] = float(np.mean(times))
+            submission_row[typ + '_time_cv_std'] = float(np.std(times))
+        submission_rows.append(submission_row)
+
+    for cls, rows in [(SubmissionScoreOnCVFold, score_on_cv_fold_rows),
+                      (SubmissionScore, score_rows),
+                      (SubmissionOnCVFold, submission_on_cv_fold_rows),
+                      (Submission, submission_rows)]:
+        session.bulk_update_mappings(cls, rows)
+        # the instances already loaded are refreshed on their next access
+        for row in rows:
+            instance = session.identity_map.get(identity_key(cls, row['id']))
+            if instance is not None:
+                session.expire(instance, [key for key in row if key != 'id'])
@@ -3,6 +3,8 @@ import numpy as np
 from ..model import Team
 from ..model import Event
 from ..model import EventTeam
+from .ensemble import EnsembleSearch
+from .ensemble import _is_mean_combine
 
 __all__ = [
     'get_active_user_event_team',
@@ -13,6 +15,8 @@ __all__ = [
     'get_user_event_teams',
     'get_next_best_single_fold',
     'combine_predictions_list',
+    'iter_bagged_predictions',
+    'propagate_historical_contributivity',
 ]
 
 
@@ -60,13 +64,8 @@ def get_next_best_single_fold(event, predictions_list, ground_truths,
     predictions_list[best_index_list] using event.official_score_function.
     If there is no model improving the input
     combination, the input best_index_list is returned. Otherwise the best
-    model is added to the list. We could also return the combined prediction
-    (for efficiency, so the combination would not have to be done each time;
-    right now the algo is quadratic), but I don't think any meaningful
-    rule will be associative, in which case we should redo the combination from
-    scratch each time the set changes. Since now combination = mean, we could
-    maintain the sum and the number of models, but it would be a bit bulky.
-    We'll see how this evolves.
+    model is added to the list. Use `EnsembleSearch` to run several steps
+    without recomputing the current combination each time.
 
     Parameters
     ----------
@@ -84,33 +83,11 @@ def get_next_best_single_fold(event, predictions_list, ground_truths,
         Indices of the models in the new combination. If the same as input,
         no models wer found improving the score.
     """
-    best_predictions = combine_predictions_list(
-        predictions_list, index_list=best_index_list)
-    best_score = event.official_score_function(
-        ground_truths, best_predictions)
-    best_index = -1
-    # Combination with replacement, what Caruana suggests. Basically, if a
-    # model is added several times, it's upweighted, leading to
-    # integer-weighted ensembles
-    r = np.arange(len(predictions_list))
-    # Randomization doesn't matter, only in case of exact equality.
-    # np.random.shuffle(r)
-    # print r
-    for i in r:
-        combined_predictions = combine_predictions_list(
-            predictions_list, index_list=np.append(best_index_list, i))
-        new_score = event.official_score_function(
-            ground_truths, combined_predictions)
-        is_lower_the_better = event.official_score_type.is_lower_the_better
-        if (is_lower_the_better and new_score < best_score) or\
-                (not is_lower_the_better and new_score > best_score):
-            best_predictions = combined_predictions
-            best_index = i
-            best_score = new_score
-    if best_index > -1:
-        return np.append(best_index_list, best_index), best_score
-    else:
-        return best_index_list, best_score
+    score_type = event.official_score_type
+    search = EnsembleSearch(
+        predictions_list, ground_truths, event.official_score_function,
+        score_type.is_lower_the_better, score_type.score_type_object)
+    return search.next_best(best_index_list)
 
 
 def combine_predictions_list(predictions_list, index_list=None):
@@ -158,6 +135,94 @@ def combine_predictions_list(predictions_list, index_list=None):
     return combined_predictions
 
 
+def iter_bagged_predictions(Predictions, predictions_list, n_samples=None,
+                            test_is_list=None):
+    """Combine the predictions of the folds one after the other.
+
+    Yields the combination of the first fold, then of the first two folds,
+    etc., which gives the bagging learning curve. For the prediction types
+    combined with the NaN-aware mean, a running sum and count of the
+    predictions are kept across the folds, so that each combination costs
+    a single pass over the samples.
+
+    Parameters
+    ----------
+    Predictions : class
+        The prediction type.
+    predictions_list : list of instances of Predictions
+    n_samples : int or None, default is None
+        Number of samples of the combined predictions. The number of samples
+        of the predictions if None.
+    test_is_list : list of array-like or None, default is None
+        Indices of the samples predicted by each element of
+        predictions_list. If None, the full prediction vectors are bagged.
+
+    Yields
+    ------
+    combined_predictions : instance of Predictions
+    """
+    if n_samples is None:
+        n_samples = len(predictions_list[0].y_pred)
+    if test_is_list is None:  # we combine the full list
+        test_is_list = [range(len(predictions.y_pred))
+                        for predictions in predictions_list]
+    if not _is_mean_combine(Predictions):
+        y_comb = [Predictions(n_samples=n_samples) for _ in predictions_list]
+        for i, test_is in enumerate(test_is_list):
+            y_comb[i].set_valid_in_train(predictions_list[i], test_is)
+            yield combine_predictions_list(y_comb[:i + 1])
+        return
+    total = None
+    for predictions, test_is in zip(predictions_list, test_is_list):
+        y_pred = np.asarray(predictions.y_pred, dtype=np.float64)
+        if total is None:
+            total = np.zeros((n_samples,) + y_pred.shape[1:])
+            count = np.zeros(total.shape, dtype=np.intp)
+        test_is = np.asarray(test_is, dtype=np.intp)
+        is_present = ~np.isnan(y_pred)
+        # the folds are added in order, as np.nanmean does, so that the
+        # combinations are exactly the same
+        total[test_is] += np.where(is_present, y_pred, 0)
+        count[test_is] += is_present
+        with np.errstate(invalid='ignore', divide='ignore'):
+            yield Predictions(y_pred=total / count)
+
+
+def propagate_historical_contributivity(contributivities, credits):
+    """Share the contributivity of the submissions with the ones they credit.
+
+    The submissions are processed in order, usually from the latest to the
+    earliest. Each submission gives to the submissions it credits a part of
+    its historical contributivity, i.e. its own contributivity plus the
+    credits it received from the submissions processed before it.
+
+    Parameters
+    ----------
+    contributivities : array-like of floats, shape (n_submissions,)
+        Contributivity of the submissions, in processing order.
+    credits : dict
+        Maps the index of a submission to the list of (index of the credited
+        submission, similarity) it enters, the latest credits first. Only the
+        latest credit to a given submission is taken into account.
+
+    Returns
+    -------
+    historical_contributivities : ndarray, shape (n_submissions,)
+    """
+    historical_contributivities = np.zeros(len(contributivities))
+    for i, contributivity in enumerate(contributivities):
+        historical_contributivities[i] += contributivity
+        historical_contributivity = historical_contributivities[i]
+        credited = set()
+        for source, similarity in credits.get(i, ()):
+            if source not in credited:
+                partial_credit = historical_contributivity * similarity
+                historical_contributivities[source] += partial_credit
+                historical_contributivities[i] -= partial_credit
+                credited.add(source)
+    return historical_contributivities
+
+
 def _get_score_cv_bags(event, score_type, predictions_list, ground_truths,
                        test_is_list=None):
     """
@@ -179,17 +244,10 @@ def _get_score_cv_bags(event, score_type, predictions_list, ground_truths,
     -------
     score_cv_bags : instance of Score ()
     """
-    if test_is_list is None:  # we combine the full list
-        test_is_list = [range(len(predictions.y_pred))
-                        for predictions in predictions_list]
-
-    y_comb = np.array(
-        [event.Predictions(n_samples=len(ground_truths.y_pred))
-         for _ in predictions_list])
     score_cv_bags = []
-    for i, test_is in enumerate(test_is_list):
-        y_comb[i].set_valid_in_train(predictions_list[i], test_is)
-        combined_predictions = combine_predictions_list(y_comb[:i + 1])
+    for combined_predictions in iter_bagged_predictions(
+            event.Predictions, predictions_list, len(ground_truths.y_pred),
+            test_is_list):
         valid_indexes = combined_predictions.valid_indexes
         score_cv_bags.append(score_type.score_function(
             ground_truths, combined_predictions, valid_indexes))
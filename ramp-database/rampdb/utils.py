@@ -1,9 +1,18 @@
+import os
 import importlib
+import threading
+
+# (absolute path, module name) -> ((mtime, size) of the source, module)
+_MODULE_CACHE = {}
+_MODULE_CACHE_LOCK = threading.Lock()
 
 
 def import_module_from_source(source, name):
     """Load a module from a Python source file.
 
+    The loaded module is cached and reused by the subsequent calls as long
+    as the source file is not modified.
+
     Parameters
     ----------
     source : str
@@ -15,7 +24,33 @@ def import_module_from_source(source, name):
     module : Python module
         Return the Python module which has been loaded.
     """
+    key = (os.path.abspath(source), name)
+    stat = os.stat(source)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = _MODULE_CACHE.get(key)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
     spec = importlib.util.spec_from_file_location(name, source)
     module = importlib.util.module_from_spec(spec)
     spec.loader.exec_module(module)
+    with _MODULE_CACHE_LOCK:
+        _MODULE_CACHE[key] = (signature, module)
     return module
+
+
+def clear_module_cache(source=None):
+    """Forget the modules loaded by :func:`import_module_from_source`.
+
+    Parameters
+    ----------
+    source : str or None, default is None
+        Path to the Python source file to forget. All the modules are
+        forgotten if None.
+    """
+    with _MODULE_CACHE_LOCK:
+        if source is None:
+            _MODULE_CACHE.clear()
+        else:
+            source = os.path.abspath(source)
+            for key in [key for key in _MODULE_CACHE if key[0] == source]:
+                del _MODULE_CACHE[key]
@@ -19,8 +19,10 @@ from rampdb.tools import select_submissions_by_id
 from rampdb.tools import set_predictions
 from rampdb.tools import set_submission_state
 from rampdb.tools import get_submissions
-from rampdb.tools import get_submission_state
+from rampdb.tools import get_submission_states
 from rampdb.tools import get_submission_by_id
+from rampdb.tools import get_submissions_by_ids
+from rampdb.tools import transition_submission_states
 from rampdb.tools import set_submission_max_ram
 from rampdb.tools import score_submission
 from rampdb.tools import set_submission_error_msg
@@ -131,37 +133,47 @@ def train_loop(config, event_name):
     while True:
         # Launch new instances for new submissions
         submissions = get_submissions(config, event_name, 'new')
-        for submission_id, _ in submissions:
-            submission = get_submission_by_id(config, submission_id)
-            if submission.is_sandbox:
-                continue
-            try:
-                instance, = launch_ec2_instances(config, nb=1)
-            except botocore.exceptions.ClientError as ex:
-                logger.info('Exception when launching a new instance : "{}"'.format(ex))
-                logger.info('Skipping...')
-                continue
-            nb_trials = 0
-            while nb_trials < conf.get('new_instance_nb_trials', 20):
-                if instance.state.get('name') == 'running':
-                    break
-                nb_trials += 1
-                time.sleep(conf.get('new_instance_check_interval', 6))
-            
-            _tag_instance_by_submission(config, instance.id, submission)
-            _add_or_update_tag(config, instance.id, 'train_loop', '1')
-            logger.info('Launched instance "{}" for submission "{}"'.format(
-                instance.id, submission))
-            set_submission_state(config, submission.id, 'sent_to_training')
+        submission_ids = [submission_id for submission_id, _ in submissions]
+        new_states = {}
+        # the states are written even if the loop fails midway, so that
+        # the launched instances are not launched again
+        try:
+            for submission in get_submissions_by_ids(config, submission_ids):
+                if submission.is_sandbox:
+                    continue
+                try:
+                    instance, = launch_ec2_instances(config, nb=1)
+                except botocore.exceptions.ClientError as ex:
+                    logger.info('Exception when launching a new instance : "{}"'.format(ex))
+                    logger.info('Skipping...')
+                    continue
+                nb_trials = 0
+                while nb_trials < conf.get('new_instance_nb_trials', 20):
+                    if instance.state.get('name') == 'running':
+                        break
+                    nb_trials += 1
+                    time.sleep(conf.get('new_instance_check_interval', 6))
+
+                _tag_instance_by_submission(config, instance.id, submission)
+                _add_or_update_tag(config, instance.id, 'train_loop', '1')
+                logger.info('Launched instance "{}" for submission "{}"'.format(
+                    instance.id, submission))
+                new_states[submission.id] = 'sent_to_training'
+        except BaseException:
+            _transition_submission_states_on_error(config, new_states)
+            raise
+        transition_submission_states(config, new_states)
         # Score tested submissions
         submissions = get_submissions(config, event_name, 'tested')
-        for submission_id, _ in submissions:
-            label = _get_submission_label_by_id(config, submission_id)
+        submission_ids = [submission_id for submission_id, _ in submissions]
+        for submission in get_submissions_by_ids(config, submission_ids):
+            label = _get_submission_label(submission)
             logger.info('Scoring submission : {}'.format(label))
-            score_submission(config, submission_id)
-            _run_hook(config, HOOK_SUCCESSFUL_TRAINING, submission_id)
+            score_submission(config, submission.id)
+            _run_hook(config, HOOK_SUCCESSFUL_TRAINING, submission.id)
         # Get running instances and process events
         instance_ids = list_ec2_instance_ids(config)
+        instances = []
         for instance_id in instance_ids:
             if not _is_ready(config, instance_id):
                 continue
@@ -174,68 +186,96 @@ def train_loop(config, event_name):
                 continue
             if 'train_loop' not in tags:
                 continue
-            # Process each instance
-            label = tags['Name']
-            submission_id = int(tags['submission_id'])
-            state = get_submission_state(config, submission_id)
-            if state == 'sent_to_training':
-                exit_status = upload_submission(
-                    config, instance_id, submission_id)
-                if exit_status != 0:
-                    logger.error(
-                        'Cannot upload submission "{}"'
-                        ', an error occured'.format(label))
-                    continue
-                # start training HERE
-                exit_status = launch_train(config, instance_id, submission_id)
-                if exit_status != 0:
-                    logger.error(
-                        'Cannot start training of submission "{}"'
-                        ', an error occured.'.format(label))
-                    continue
-                set_submission_state(config, submission_id, 'training')
-                _run_hook(config, HOOK_START_TRAINING, submission_id)
- 
-            elif state == 'training':
-                # in any case (successful training or not)
-                # download the log 
-                download_log(config, instance_id, submission_id)
-                if _training_finished(config, instance_id, submission_id):                   
-                    logger.info(
-                        'Training of "{}" finished, checking '
-                        'if successful or not...'.format(label))
-                    if _training_successful(
-                            config,
-                            instance_id,
-                            submission_id):
-                        logger.info('Training of "{}" was successful'.format(label))
-                        if conf.get(MEMORY_PROFILING_FIELD):
-                            logger.info('Download max ram usage info of "{}"'.format(label))
-                            download_mprof_data(config, instance_id, submission_id)
-                            max_ram = _get_submission_max_ram(config, submission_id)
-                            logger.info('Max ram usage of "{}": {}MB'.format(label, max_ram))
-                            set_submission_max_ram(config, submission_id, max_ram)
-                            
-                        logger.info('Downloading the predictions of "{}"'.format(label))
-                        path = download_predictions(
-                            config, instance_id, submission_id)
-                        set_predictions(config, submission_id, path, ext='npz')
-                        set_submission_state(config, submission_id, 'tested')
-                    else:
-                        logger.info('Training of "{}" failed'.format(label))
-                        set_submission_state(
-                            config, submission_id, 'training_error')
-                        error_msg = _get_traceback(
-                            _get_log_content(config, submission_id)
-                        )
-                        set_submission_error_msg(
-                            config, submission_id, error_msg)
-                        _run_hook(config, HOOK_FAILED_TRAINING, submission_id)
-                    # training finished, so terminate the instance
-                    terminate_ec2_instance(config, instance_id)
+            instances.append((instance_id, tags))
+        # Fetch the states of all the submissions being trained at once
+        states = get_submission_states(
+            config, [int(tags['submission_id']) for _, tags in instances])
+        new_states = {}
+        hooks = []
+        # the states are written even if the loop fails midway, so that
+        # the terminated instances are not waited for
+        try:
+            for instance_id, tags in instances:
+                # Process each instance
+                label = tags['Name']
+                submission_id = int(tags['submission_id'])
+                state = states.get(submission_id)
+                if state == 'sent_to_training':
+                    exit_status = upload_submission(
+                        config, instance_id, submission_id)
+                    if exit_status != 0:
+                        logger.error(
+                            'Cannot upload submission "{}"'
+                            ', an error occured'.format(label))
+                        continue
+                    # start training HERE
+                    exit_status = launch_train(config, instance_id, submission_id)
+                    if exit_status != 0:
+                        logger.error(
+                            'Cannot start training of submission "{}"'
+                            ', an error occured.'.format(label))
+                        continue
+                    new_states[submission_id] = 'training'
+                    hooks.append((HOOK_START_TRAINING, submission_id))
+
+                elif state == 'training':
+                    # in any case (successful training or not)
+                    # download the log
+                    download_log(config, instance_id, submission_id)
+                    if _training_finished(config, instance_id, submission_id):
+                        logger.info(
+                            'Training of "{}" finished, checking '
+                            'if successful or not...'.format(label))
+                        if _training_successful(
+                                config,
+                                instance_id,
+                                submission_id):
+                            logger.info('Training of "{}" was successful'.format(label))
+                            if conf.get(MEMORY_PROFILING_FIELD):
+                                logger.info('Download max ram usage info of "{}"'.format(label))
+                                download_mprof_data(config, instance_id, submission_id)
+                                max_ram = _get_submission_max_ram(config, submission_id)
+                                logger.info('Max ram usage of "{}": {}MB'.format(label, max_ram))
+                                set_submission_max_ram(config, submission_id, max_ram)
+
+                            logger.info('Downloading the predictions of "{}"'.format(label))
+                            path = download_predictions(
+                                config, instance_id, submission_id)
+                            set_predictions(config, submission_id, path, ext='npz')
+                            new_states[submission_id] = 'tested'
+                        else:
+                            logger.info('Training of "{}" failed'.format(label))
+                            new_states[submission_id] = 'training_error'
+                            error_msg = _get_traceback(
+                                _get_log_content(config, submission_id)
+                            )
+                            set_submission_error_msg(
+                                config, submission_id, error_msg)
+                            hooks.append((HOOK_FAILED_TRAINING, submission_id))
+                        # training finished, so terminate the instance
+                        terminate_ec2_instance(config, instance_id)
+        except BaseException:
+            _transition_submission_states_on_error(config, new_states)
+            raise
+        transition_submission_states(config, new_states)
+        for hook_name, submission_id in hooks:
+            _run_hook(config, hook_name, submission_id)
         time.sleep(secs)
 
 
+def _transition_submission_states_on_error(config, new_states):
+    """Write the states reached before an error without hiding the error.
+
+    The database is often the cause of the error, so a failure to write the
+    states is only logged and the caller re-raises its own error.
+    """
+    try:
+        transition_submission_states(config, new_states)
+    except Exception as ex:
+        logger.error('Cannot write the states of the submissions {} : '
+                     '"{}"'.format(sorted(new_states), ex))
+
+
 def launch_ec2_instance_and_train(config, submission_id):
     """
     This function does the following steps:
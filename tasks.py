@@ -131,6 +131,16 @@ def score_submission(c, event, team, submission, is_save_y_pred=False):
     compute_contributivity(c, event, is_save_y_pred=is_save_y_pred)
 
 
+@task
+def score_submissions(c, event, n_jobs=None, is_save_y_pred=False):
+    """Score all the tested submissions of an event at once."""
+    from databoard.db_tools import score_submissions
+
+    score_submissions(
+        event, n_jobs=None if n_jobs is None else int(n_jobs))
+    compute_contributivity(c, event, is_save_y_pred=is_save_y_pred)
+
+
 @task
 def set_n_submissions(c, event=None):
     from databoard.db_tools import set_n_submissions
@@ -138,11 +148,13 @@ def set_n_submissions(c, event=None):
 
 
 @task
-def compute_contributivity(c, event, is_save_y_pred=False):
+def compute_contributivity(c, event, is_save_y_pred=False,
+                           full_recompute=False):
     from databoard.db_tools import compute_contributivity
     from databoard.db_tools import compute_historical_contributivity
     from databoard.db_tools import set_n_submissions
-    compute_contributivity(event, is_save_y_pred=is_save_y_pred)
+    compute_contributivity(event, is_save_y_pred=is_save_y_pred,
+                           full_recompute=full_recompute)
     compute_historical_contributivity(event)
     set_n_submissions(event)
 
@@ -317,6 +329,36 @@ def backend_train_test_loop(c, event=None, timeout=30,
         event, timeout, is_compute_contributivity, is_parallelize)
 
 
+@task
+def backend_contributivity_loop(c, event=None, timeout=30,
+                                min_interval=5 * 60, quiet_period=60,
+                                max_delay=30 * 60):
+    """Automated contributivity loop.
+
+    Computes the contributivity of the events with newly scored submissions,
+    in an infinite loop. Run it next to backend_train_test_loop with
+    --no-is-compute-contributivity so that the training is never delayed.
+
+    Parameters
+    ----------
+    event : string
+        Event name. If set, only watch that event.
+        If event name is prefixed by not, it excludes that event.
+    min_interval : int
+        Minimum number of seconds between two computations for an event.
+    quiet_period : int
+        Number of seconds without newly scored submissions before an event
+        is updated, to coalesce bursts.
+    max_delay : int
+        Maximum number of seconds an event waits for a quiet period.
+    """
+    from databoard.db_tools import backend_contributivity_loop
+
+    backend_contributivity_loop(
+        event, int(timeout), int(min_interval), int(quiet_period),
+        int(max_delay))
+
+
 @task
 def set_state(c, event, team, submission, state):
     "Set submission state"
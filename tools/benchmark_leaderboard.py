@@ -0,0 +1,171 @@
+"""Benchmark the leaderboard data query against the ORM path.
+
+Creates a sqlite database holding an event with scored submissions, then
+times the computation of the leaderboard fields of all the submissions:
+
+- orm: load the submissions and read the fields through the ORM
+  relationships, as the leaderboards did before the leaderboard rows, one
+  lazy load per team, score, fold score and file;
+- query: ``select_leaderboard_data``, a single query aggregating the fold
+  scores in the database.
+
+Usage: python tools/benchmark_leaderboard.py [n_submissions] [n_folds]
+"""
+from __future__ import print_function
+
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from rampdb.model import Event
+from rampdb.model import EventScoreType
+from rampdb.model import EventTeam
+from rampdb.model import Extension
+from rampdb.model import Submission
+from rampdb.model import SubmissionFile
+from rampdb.model import SubmissionFileTypeExtension
+from rampdb.model import SubmissionScore
+from rampdb.model import SubmissionScoreOnCVFold
+from rampdb.model import Team
+from rampdb.model import WorkflowElement
+from rampdb.model import WorkflowElementType
+from rampdb.tools.database import dispose_engines
+from rampdb.tools.database import session_scope
+from rampdb.tools.database import setup_db
+from rampdb.tools.leaderboard import _get_row_values
+from rampdb.tools.leaderboard import get_event_score_types
+from rampdb.tools.query import select_leaderboard_data
+
+N_TEAMS = 100
+SCORE_NAMES = ['acc', 'nll']
+
+
+def populate(config, n_submissions, n_folds):
+    rng = np.random.RandomState(42)
+    now = datetime.datetime.utcnow()
+    with session_scope(config) as session:
+        def insert(model, rows):
+            session.execute(model.__table__.insert(), rows)
+
+        insert(Event, [{'id': 1, 'name': 'benchmark', 'title': 'benchmark',
+                        'problem_id': 1, 'official_score_name': 'acc'}])
+        insert(EventScoreType, [
+            {'id': i + 1, 'name': name, 'event_id': 1,
+             'score_type_id': i + 1, 'precision': 3}
+            for i, name in enumerate(SCORE_NAMES)])
+        insert(Team, [{'id': i, 'name': 'team_{}'.format(i),
+                       'creation_timestamp': now}
+                      for i in range(1, N_TEAMS + 1)])
+        insert(EventTeam, [{'id': i, 'event_id': 1, 'team_id': i,
+                            'signup_timestamp': now}
+                           for i in range(1, N_TEAMS + 1)])
+        insert(Extension, [{'id': 1, 'name': 'py'}])
+        insert(SubmissionFileTypeExtension, [
+            {'id': 1, 'type_id': 1, 'extension_id': 1}])
+        insert(WorkflowElementType, [
+            {'id': 1, 'name': 'classifier', 'type_id': 1}])
+        insert(WorkflowElement, [
+            {'id': 1, 'name': 'classifier', 'workflow_id': 1,
+             'workflow_element_type_id': 1}])
+        submission_ids = range(1, n_submissions + 1)
+        insert(Submission, [
+            {'id': i, 'event_team_id': 1 + i % N_TEAMS,
+             'name': 'submission_{}'.format(i), 'hash_': str(i),
+             'state': 'scored', 'submission_timestamp': now,
+             'is_valid': True, 'is_in_competition': True,
+             'contributivity': rng.rand(), 'historical_contributivity': 0.,
+             'train_time_cv_mean': 10 * rng.rand(),
+             'train_time_cv_std': rng.rand(),
+             'valid_time_cv_mean': rng.rand(),
+             'valid_time_cv_std': rng.rand(), 'max_ram': 100.}
+            for i in submission_ids])
+        insert(SubmissionFile, [
+            {'id': i, 'submission_id': i, 'workflow_element_id': 1,
+             'submission_file_type_extension_id': 1}
+            for i in submission_ids])
+        n_scores = len(SCORE_NAMES)
+        insert(SubmissionScore, [
+            {'id': (i - 1) * n_scores + j + 1, 'submission_id': i,
+             'event_score_type_id': j + 1,
+             'valid_score_cv_bag': rng.rand(),
+             'test_score_cv_bag': rng.rand()}
+            for i in submission_ids for j in range(n_scores)])
+        insert(SubmissionScoreOnCVFold, [
+            {'submission_on_cv_fold_id': (i - 1) * n_folds + k + 1,
+             'submission_score_id': (i - 1) * n_scores + j + 1,
+             'train_score': rng.rand(), 'valid_score': rng.rand(),
+             'test_score': rng.rand()}
+            for i in submission_ids for j in range(n_scores)
+            for k in range(n_folds)])
+
+
+def get_scores_orm(config):
+    with session_scope(config) as session:
+        event = session.query(Event).one()
+        score_types = get_event_score_types(event)
+        submissions = (session.query(Submission)
+                       .join(EventTeam)
+                       .filter(EventTeam.event_id == event.id)
+                       .order_by(Submission.id)
+                       .all())
+        results = {}
+        for submission in submissions:
+            # the fields read by get_leaderboards and get_private_leaderboards
+            submission.event_team.team.name
+            submission.name_with_link
+            score_dict = {score.score_name: score
+                          for score in submission.scores}
+            results[submission.id] = np.array([
+                [round(score.valid_score_cv_bag, score.precision),
+                 round(score.valid_score_cv_mean, score.precision),
+                 round(score.valid_score_cv_std, score.precision + 1),
+                 round(score.test_score_cv_bag, score.precision),
+                 round(score.test_score_cv_mean, score.precision),
+                 round(score.test_score_cv_std, score.precision + 1)]
+                for score in [score_dict[score_type.name]
+                              for score_type in score_types]])
+    return results
+
+
+def get_scores_query(config):
+    with session_scope(config) as session:
+        event = session.query(Event).one()
+        score_types = get_event_score_types(event)
+        records = {}
+        for record in select_leaderboard_data(session, event.id):
+            records.setdefault(record.submission_id, []).append(record)
+        return {
+            submission_id: _get_row_values(records_, score_types, 0)['scores']
+            for submission_id, records_ in records.items()}
+
+
+def main(n_submissions=2000, n_folds=8):
+    path = tempfile.mkdtemp()
+    config = {'drivername': 'sqlite',
+              'database': os.path.join(path, 'benchmark.db')}
+    try:
+        setup_db(config)
+        populate(config, n_submissions, n_folds)
+        results = {}
+        for name, get_scores in [('orm', get_scores_orm),
+                                 ('query', get_scores_query)]:
+            start = time.time()
+            results[name] = get_scores(config)
+            print('{}: {:.3f}s'.format(name, time.time() - start))
+        n_different = sum(
+            not np.allclose(scores, results['query'][submission_id])
+            for submission_id, scores in results['orm'].items())
+        print('{} submissions, {} folds, {} different scores'.format(
+            n_submissions, n_folds, n_different))
+    finally:
+        dispose_engines()
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])